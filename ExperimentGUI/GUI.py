@@ -1,24 +1,46 @@
+import functools
 import itertools
-import threading
+import queue
 import time
 import random
-import tkinter as tk
-from tkinter import messagebox
 
-import customtkinter as ctk
-import pandas as pd
-from PIL import Image
-from customtkinter import CTkImage
-
-import openai_interact_rewrite
-import openai_interact_profile
+import startup  # Times the imports below and the GUI setup (see startup.py)
+
+with startup.phase("import customtkinter"):
+    import tkinter as tk
+    from tkinter import messagebox
+    import customtkinter as ctk
+
+with startup.phase("import experiment modules"):
+    import adaptive_training
+    import llm_backend
+    import openai_interact_rewrite
+    import openai_interact_profile
+    import paragraph_csv
+    import precomputed
+    import session_checkpoint
+    import session_client
+    import token_count
+    import topic_catalog
+    from event_log import EventLog
+    from icon_cache import IconCache
+    import timing
+    from session_state import SessionState
+    from speculative_pipeline import SPECULATIVE_GENERATION, SpeculativePipeline
+
+
+# The widgets of a paragraph pair layout that change from page to page (see build_paragraph_page).
+PARAGRAPH_PAGE_WIDGETS = ("paragraph_frame", "paragraph_title", "paragraph_image", "paragraph_radio_var",
+                          "left_option_frame", "right_option_frame", "left_text", "right_text", "refresh_button",
+                          "paragraph_participant_id")
 
 
 class GUI:
     """A GUI for the MCA project, using the customtkinter library"""
 
-    def __init__(self):
-        """Initialize the GUI"""
+    def __init__(self, resume_path=None):
+        """Initialize the GUI. With resume_path (a session log), continue that session instead of starting a new one
+        (see session_checkpoint.py)."""
 
         # Define variables
         self.participant_id_entry = None
@@ -26,6 +48,7 @@ class GUI:
         self.participant_id = None
         self.experiment_version = None
         self.participant_id_display = None
+        self.log = None  # Session event log (see event_log.py), opened once the participant ID is confirmed
         self.text = {}
         self.current_page = 0
         self.runtimes = {}
@@ -43,15 +66,41 @@ class GUI:
         ctk.set_appearance_mode("light")
 
         # Create a set of variables to record the time spent on each page of the GUI.
-        self.startTime = 0  # Initialize variable to record start time (will be a Unix timestamp)
-        self.endTime = 0  # Initialize variable to record end time (will be a Unix timestamp)
-        self.calcTime = 0  # Initialize variable to record calculated time (will be a Unix timestamp)
+        self.startTime = 0  # Initialize variable to record start time (monotonic, see timing.py)
+        self.endTime = 0  # Initialize variable to record end time (monotonic, see timing.py)
+        self.calcTime = 0  # Initialize variable to record calculated time (in sec.)
         self.startGUI = 0  # Global start time (starting from when Instructions are displayed)
         self.quitGUI = 0  # Global end time (when GUI is closed)
-
-        # Define the number of GPT interactions to complete. In this study, there are 2 paragraph pairs included in
-        # the test session. self.num_gpt_interactions should be equal to that number.
-        self.num_gpt_interactions = 2
+        # Timing spans for the session trace (see timing.py). Pages, participant dwell, and the loading page each have
+        # their own track in the trace, so they do not overlap the render spans on the main thread.
+        self.page_span = None
+        self.dwell_span = None
+        self.loading_span = None
+        self.session_filename = None
+
+        # Test session topics, by GPT interaction number (1 = first test page). In this study, the test session has the
+        # 2 topics listed under "test_topics" in topics.json. Set GUI_RANDOM_TOPICS to draw a random set of topics for
+        # each session instead (see topic_catalog.py).
+        self.resume_state = session_checkpoint.load(resume_path) if resume_path else None
+        self.topic_catalog = topic_catalog.get_catalog()
+        if self.resume_state is not None:
+            self.topics = self.resume_state["topics"]
+        else:
+            self.topics = dict(enumerate(self.topic_catalog.session_topics(), start=1))
+        self.num_gpt_interactions = len(self.topics)
+
+        # Adaptive training (see adaptive_training.py): the training pairs are chosen from a pool as the participant
+        # makes their choices, instead of being the rows of input_paragraphs.csv in order. Enabled by setting
+        # GUI_ADAPTIVE_POOL to a pool file (a session that was adaptive is resumed as adaptive).
+        self.adaptive_training = None
+        self.training_pairs = []  # Pool ids of the pairs chosen so far, in page order (adaptive training only).
+        if adaptive_training.POOL_PATH or (self.resume_state or {}).get("training_pairs"):
+            self.adaptive_training = adaptive_training.AdaptiveTraining(adaptive_training.POOL_PATH or
+                                                                        adaptive_training.DEFAULT_POOL_PATH)
+            if self.resume_state is not None:
+                self.training_pairs = self.resume_state["training_pairs"]
+            else:
+                self.training_pairs = [self.adaptive_training.next_pair([], []).id]
 
         # Initialize the text
         self.init_text()
@@ -100,26 +149,162 @@ class GUI:
         # Closing page track selection
         self.closing_selection = None
 
-        # Image paths for loaded images (These are the icons displayed at the top of each page)
-        self.image_paths = ['Icons/WaterCycle.png', 'Icons/ClimateChange.png', 'Icons/Photosynthesis.png',
-                            'Icons/StatesOfMatter.png', 'Icons/PlateTectonics.png', 'Icons/Electricity.png']
-
-        # GPT-paragraph variables
-        self.generated_text_iter1 = None
-        self.generated_text_iter2 = None
-
-        self.gpt_paragraph1_iter1 = ""
-        self.gpt_paragraph2_iter1 = ""
-        self.gpt_paragraph1_iter2 = ""
-        self.gpt_paragraph2_iter2 = ""
+        # Image paths for loaded images (These are the icons displayed at the top of each page, from topics.json)
+        self.set_image_paths()
+
+        # Decode and downscale every icon once, on a background thread while the participant ID is being entered.
+        # Pages then reuse the cached CTkImage objects (see icon_cache.py).
+        self.welcome_image_path = "Icons/welcome.png"
+        self.welcome_image_size = (500, 500)
+        self.page_image_size = (350, 350)
+        self.icons = IconCache(ctk.ScalingTracker.get_window_scaling(self.root))
+        icon_paths = (self.adaptive_training.icons() if self.adaptive_training is not None else []) + self.image_paths
+        self.icons.preload([(self.welcome_image_path, self.welcome_image_size)] +
+                           [(path, self.page_image_size) for path in dict.fromkeys(icon_paths)])
+
+        # GPT-paragraph variables. The rewrites for all test session topics are requested at once and stored here as
+        # they finish, as (paragraph1, paragraph2) tuples keyed by GPT interaction number (1 = first test page).
+        self.generated_texts = {}
+        self.awaiting_interaction = None  # GPT interaction number of the page currently waiting on the loading page.
+
+        # Every profile and rewrite request runs on the session's worker executor and its result is handed back to the
+        # main thread, which is the only thread that sets the fields above (see session_state.py). A new request for
+        # the profile or for a rewrite supersedes the previous one, so a refresh never shows an older result.
+        self.state = SessionState(lambda function, *args: self.root.after(0, function, *args))
+        # Generation id of each GPT interaction's current rewrite request ("precomputed" for a precomputed variant).
+        # Superseded requests print their rewrites to the transcript too, so the test page logs the order it shows with
+        # this id ("Displayed order for GPT interaction N"), and analytics.py reads the order from there.
+        self.rewrite_generations = {}
+
+        # Streaming mode: rewrites are streamed and shown as they are generated, so the test page appears after the
+        # first token instead of the whole completion. Worker threads put (interaction number, stream id, text) in
+        # self.token_queue, which is drained on the main thread (drain_tokens). Selection stays locked until both
+        # paragraphs are complete. The generic/custom order is decided before generation starts (self.rewrite_orders).
+        self.use_streaming = openai_interact_rewrite.STREAMING
+        self.token_queue = queue.Queue()
+        self.rewrite_orders = {}  # 'first' or 'second' (position of the generic rewrite), by GPT interaction number.
+        self.streamed_text = {}  # Text streamed so far, by GPT interaction number.
+        self.stream_ids = {}  # Latest stream id by GPT interaction number. Pieces from older streams are ignored.
+        self.streaming_interaction = None  # GPT interaction number of the page currently showing a stream.
+        self.selection_locked = False
+
+        # Retained-mode pages: the paragraph pair page and the loading page are built once and reused (hidden with
+        # pack_forget instead of destroyed), so page transitions only swap content instead of rebuilding the widgets.
+        self.retained_frames = set()
+        self.paragraph_frame = None
+        self.paragraph_pages = []  # Paragraph pair layouts (widgets by attribute name), see build_paragraph_page.
+
+        # Look-ahead rendering: while the participant reads a training page, the next training page is filled into a
+        # second paragraph pair layout, stacked under the visible page so Tk lays it out (icon, wrapped text) without
+        # showing it. Continue then only raises the finished page. Set to False to fill each page when it is shown.
+        self.use_lookahead_rendering = True
+        self.lookahead_delay = 250  # ms after a page is shown, so the look-ahead never delays drawing the page itself.
+        self.lookahead_job = None  # after() id of the scheduled look-ahead render.
+        self.prerendered = None  # (page number, content, layout) of the page rendered ahead, until it is shown.
+        self.loading_frame = None
+        self.loading_animation = None  # after() id of the loading animation, cancelled when the page is hidden.
+
+        # Generation failures (after the request scheduler's retries, see request_scheduler.py). The loading page shows
+        # a "Try Again" button instead of waiting forever for a rewrite that will not arrive.
+        self.failed_interactions = set()  # GPT interaction numbers whose rewrite failed.
+
+        # Speculative generation: the profile and rewrites are started in the background as soon as every training
+        # choice is known, so most of the GPT-4 latency overlaps the end of the training session instead of the
+        # loading page. Off unless GUI_SPECULATIVE=1 (see speculative_pipeline.py).
+        self.use_speculative_generation = SPECULATIVE_GENERATION
+        # On the last training page, speculation starts once the choice has been left unchanged this long (ms), so
+        # clicking back and forth between the options does not start a job for every click. Continue starts it at once.
+        self.speculation_delay = 300
+        self.speculation_job = None  # after() id of the pending speculation
+        self.speculative_pipeline = SpeculativePipeline(self.num_gpt_interactions, self.topics)
+
+        # Precomputed mode (see precomputed.py): serve a pregenerated profile and rewrites for the participant's
+        # selections instead of calling GPT-4. Enabled by setting GUI_PRECOMPUTED to a table file.
+        self.precomputed = None
+        self.precomputed_variant = None  # Variant number currently served (a different one is served on refresh).
+        if precomputed.PRECOMPUTED_PATH:
+            training_pairs = [openai_interact_profile.paragraph_pair_text(*self.text[i])
+                              for i in range(1, self.num_training_pages() + 1)]
+            self.precomputed = precomputed.PrecomputedTable(precomputed.PRECOMPUTED_PATH, training_pairs)
+            if list(self.topics.values()) != self.topic_catalog.test_topic_ids:
+                # Tables are built for the study's test topics, so a random topic set is generated live.
+                print("Precomputed mode is off: this session's test topics are not the ones the table was built for.")
+                self.precomputed = None
+            elif self.adaptive_training is not None:
+                # Tables are built for the study's four training pairs.
+                print("Precomputed mode is off: adaptive training chooses its own training pairs.")
+                self.precomputed = None
 
     def run(self):
         '''Run the CTk mainloop() and our first page'''
         self.current_page = 0
         self.runtimes[self.current_page] = []
-        self.create_participant_id_screen()
+        if self.resume_state is not None:
+            self.resume_session()
+        else:
+            self.create_participant_id_screen()
+        self.root.after(0, self.startup_done)
+        if self.use_streaming:
+            self.drain_tokens()
         self.root.mainloop()
 
+    def startup_done(self):
+        '''Report the startup time, then load what the session needs later in the background (see startup.py)'''
+        print(startup.ready())
+        tasks = [("tokenizer", token_count.get_encoding), ("rewrite scoring", openai_interact_rewrite.warm_up_scoring)]
+        if session_client.SESSION_SERVER is None:
+            tasks.insert(0, ("LLM backend", llm_backend.warm_up))
+        startup.warm_up(tasks)
+
+    def checkpoint(self, *fields, **values):
+        '''Write the current value of the given attributes (and any given values) to the session log, so the session can
+        be resumed from this point (see session_checkpoint.py)'''
+        if self.log is not None:
+            self.log.event("checkpoint", session_checkpoint.snapshot(self, fields, values))
+
+    def resume_session(self):
+        '''Continue a session from its log: restore its state and show the page the participant was on'''
+        state = self.resume_state
+        for field, value in state.items():
+            setattr(self, field, value)
+        self.participant_id_display = "ID: " + self.participant_id
+        if self.adaptive_training is not None:
+            self.layout_adaptive_pages()  # The test session pages follow the last training pair once it is known
+
+        # The training pairs shown so far, as they are sent to the PROFILER (the current page adds its own).
+        shown_training_pages = range(1, min(self.current_page, self.num_training_pages() + 1))
+        self.paragraph_pair_list = [openai_interact_profile.paragraph_pair_text(*self.text[i])
+                                    for i in shown_training_pages]
+
+        # Continue the same log and transcript.
+        self.log = EventLog(self.session_filename + ".jsonl", transcript_path=self.session_filename + ".txt")
+        self.log.capture_stdout()
+        reused = sorted(self.generated_texts)
+        self.log.event("session_resumed", {"page": self.current_page, "profile": self.student_profile is not None,
+                                           "rewrites": reused})
+        print(f"\n***\nSession resumed on page {self.current_page} at {time.time()} [Unix epoch, in sec.]. Reusing "
+              f"{'the student profiles' if self.student_profile is not None else 'no profile'} and "
+              f"{len(reused)} rewrite(s) {reused}.\n***\n")
+
+        self.startGUI = timing.now()
+        self.log.page_boundary(self.current_page)
+        self.page_span = timing.begin(f"page {self.current_page}", "page", track="pages")
+        self.runtimes[self.current_page] = []
+        if self.current_page == 0:
+            self.create_welcome()
+            return
+        with timing.span("render", "page", page=self.current_page):
+            self.create_page()
+
+        # Request the rewrites that had not arrived before the session stopped (once the profile exists; without it,
+        # the first test page generates everything).
+        if self.student_profile is not None and self.gpt_interaction_num() >= 1:
+            missing = [interaction_num for interaction_num in range(self.gpt_interaction_num(),
+                                                                    self.num_gpt_interactions + 1)
+                       if interaction_num not in self.generated_texts]
+            if missing:
+                self.fetch_gpt_text(missing)
+
     def create_participant_id_screen(self):
         participantIDfont = ("Open Sans", 14)
 
@@ -175,23 +360,30 @@ class GUI:
                 self.experiment_version = selected_group
                 self.participant_id_display = "ID: " + participant_id
 
-                # Write the participant ID to the output file.
-                filename = f"{time.strftime('%Y-%m-%d %H-%M-%S')}" + f" ID-{participant_id}" + ".txt"
-                with open(filename, 'w') as f:
-                    f.write(f"Participant ID: {self.participant_id}\n\n")
-
-                # Change the stdout to the file to capture further output.
-                sys.stdout = open(filename, 'a')
+                # Start the session log. Events are written to the .jsonl file by a background thread, and the
+                # human-readable transcript (.txt) is rendered from them, so printing never waits on the disk.
+                filename = f"{time.strftime('%Y-%m-%d %H-%M-%S')}" + f" ID-{participant_id}"
+                self.session_filename = filename
+                self.log = EventLog(filename + ".jsonl", transcript_path=filename + ".txt")
+                self.log.capture_stdout()  # Capture further output.
+                self.log.event("session_start", {"participant_id": self.participant_id,
+                                                 "group": self.experiment_version,
+                                                 "test_topics": list(self.topics.values()),
+                                                 "startup": startup.breakdown()})
+                self.checkpoint("participant_id", "experiment_version", "topics", "current_page",
+                                *self.adaptive_fields())
 
                 # Initialize the save file & table:
+                print(f"Participant ID: {self.participant_id}\n")
                 print(f"Group: {self.experiment_version}")
+                print(f"Test Topics: {', '.join(self.topics.values())}")
                 print("\nGUI Start time: " + str(time.time()) + " [Unix epoch, in sec.]")
                 print("\nGUI User Data (For Tabular Items)\n" +
                       "Page   Button            Time (sec) since page started \n" +
                       "------------------------------------------------------")
 
-                # Destroy the current frame and move on to the welcome screen (create_welcome)
-                self.frame.destroy()
+                # Remove the current frame and move on to the welcome screen (create_welcome)
+                self.clear_frame()
                 self.create_welcome()
             else:
                 # If the user clicks 'No', let them re-enter the participant ID/Group selection.
@@ -213,10 +405,22 @@ class GUI:
             self.text[0].append(file.read())
 
         # Get the paragraph selection page text
-        df = pd.read_csv("input_paragraphs.csv")
-        for i, series in df.iterrows():
-            self.text[i] = [series['PageTitle'], series['Paragraph1'],
-                            series['Paragraph2']]  # Shift index by 1 for initial paragraphs
+        if self.adaptive_training is not None:
+            # The instructions give the number of pairs of the study, which adaptive training does not have.
+            most = self.adaptive_training.max_pairs + self.num_gpt_interactions
+            self.text[0][1] = self.text[0][1].replace("You will see a total of six pairs.",
+                                                      f"You will see up to {most} pairs.")
+            self.layout_adaptive_pages()
+        else:
+            self.layout_pages(paragraph_csv.read_paragraph_pages("input_paragraphs.csv"))
+
+    def layout_pages(self, training_pages):
+        '''Number the pages after the welcome page: the training pages ({page: [title, paragraph 1, paragraph 2]}),
+        then the GPT interaction pages and the close page'''
+        for i in [i for i in self.text if i > 0]:
+            del self.text[i]
+        for i, page in training_pages.items():
+            self.text[i] = page  # Shift index by 1 for initial paragraphs
             # print(i, self.text[i])
 
         # Starting index for GPT pages is after the last initial paragraph
@@ -230,6 +434,49 @@ class GUI:
         # Set the close page text
         self.text[len(self.text)] = ["Close", "", ""]
 
+    def layout_adaptive_pages(self):
+        '''(Adaptive training) Lay out the pages for the training pairs chosen so far. Until training is complete, there
+        is room for max_pairs training pages, so page numbers only shift once the last pair is known.'''
+        pairs = [self.adaptive_training.pair(pair_id) for pair_id in self.training_pairs]
+        training_pages = {i: pair.page(i, self.topic_catalog) for i, pair in enumerate(pairs, start=1)}
+        if len(self.user_selections) < len(pairs):  # The last pair chosen has not been answered yet
+            for i in range(len(pairs) + 1, self.adaptive_training.max_pairs + 1):
+                training_pages[i] = ["Not chosen yet", "", ""]
+        self.layout_pages(training_pages)
+        if hasattr(self, 'image_paths'):
+            self.set_image_paths()
+
+    def set_image_paths(self):
+        '''Set the icons of the paragraph pages (by page number - 1): the training topics, then the test topics'''
+        if self.adaptive_training is None:
+            training_topic_ids = self.topic_catalog.training_topic_ids
+        else:
+            training_topic_ids = [self.adaptive_training.pair(pair_id).topic_id for pair_id in self.training_pairs]
+            # Pages not chosen yet show the last icon (they are never shown before they are chosen)
+            training_topic_ids += training_topic_ids[-1:] * (self.num_training_pages() - len(training_topic_ids))
+        self.image_paths = [self.topic_catalog.get(topic_id).icon
+                            for topic_id in training_topic_ids + list(self.topics.values())]
+
+    def adaptive_fields(self):
+        '''Checkpoint fields of adaptive training (none without it)'''
+        return ("training_pairs",) if self.adaptive_training is not None else ()
+
+    def choose_next_pair(self):
+        '''(Adaptive training) Choose the pair for the next training page from the choices so far, or end training'''
+        training = self.adaptive_training
+        estimates = training.estimates(self.training_pairs, self.user_selections)
+        pair = training.next_pair(self.training_pairs, self.user_selections)
+        if pair is not None:
+            self.training_pairs.append(pair.id)
+        self.layout_adaptive_pages()
+
+        print(f"Preference estimates after {len(self.user_selections)} pairs: {training.describe(estimates)}")
+        if pair is not None:
+            print(f"Next training pair: {pair.id}")
+        else:
+            print(f"Training complete after {len(self.training_pairs)} pairs.")
+        self.log.event("training_pair", {"estimates": estimates, "next_pair": pair.id if pair is not None else None})
+
     def create_welcome(self):
         self.frame = ctk.CTkFrame(self.root)
         self.frame.pack(padx=10, pady=10, fill='both', expand=True)
@@ -247,7 +494,7 @@ class GUI:
                                  font=('Open Sans', 18), height=10, wraplength=1200)
 
         # Add an image
-        ctk_image = CTkImage(light_image=Image.open("Icons/welcome.png"), size=(500, 500))
+        ctk_image = self.icons.get(self.welcome_image_path, self.welcome_image_size)
         image_label = ctk.CTkLabel(master=header_frame, image=ctk_image, text='')
         image_label.pack(padx=0, pady=10)
         ctkTitle2.pack(padx=30, pady=0, anchor='s')
@@ -266,16 +513,17 @@ class GUI:
         participantID.pack(padx=85, pady=10, side='bottom', anchor='w')
 
         # Start timer on welcome page.
-        self.startTime = time.time()
+        self.start_page_timer("welcome")
 
     def create_instructions(self):
         # Calculate time the welcome page was open and destroy the welcome page.
-        self.endTime = time.time()
-        self.calcTime = self.endTime - self.startTime
+        self.calcTime = self.stop_page_timer()
+        self.endTime = timing.now()
         self.startGUI = self.endTime
+        self.page_span = timing.begin(f"page {self.current_page}", "page", track="pages")
         print(f"Welc   Continue           " +
               f"{self.calcTime:.2f} s")
-        self.frame.destroy()
+        self.clear_frame()
 
         # An option selection is not required for the welcome page. Bypass the requirement of selecting a option in
         # the click_next_page method.
@@ -315,7 +563,7 @@ class GUI:
         participantID.pack(padx=85, pady=10, side='bottom', anchor='w')
 
         # Start the timer
-        self.startTime = time.time()
+        self.start_page_timer("instructions")
 
     ################################
     # The below 3 methods handle the appearance/look-and-feel of the GUI as you mouse over a selection.
@@ -328,6 +576,10 @@ class GUI:
             text_box.configure(border_color="#DBDBDB", border_width=0)
 
     def on_click(self, event, text_box, radio_var):
+        # Selection is locked while a rewrite is still streaming in.
+        if self.selection_locked:
+            return
+
         # Unhighlight the previously clicked textbox if it exists
         if self.clicked_text_box and self.clicked_text_box != text_box:
             self.clicked_text_box.configure(border_color="#DBDBDB", border_width=0)
@@ -350,7 +602,7 @@ class GUI:
             self.right_option_frame.configure(fg_color=selected_color)
 
         # When the user clicks a radio button, save their choice and print it
-        self.runtimes[self.current_page].append(time.time() - self.startTime)
+        self.runtimes[self.current_page].append(timing.now() - self.startTime)
         self.user_choices[self.current_page] = radio_var.get()
         if radio_var.get() == 1:  # Save the opposite of the user choice as well
             self.notUser_choices[self.current_page] = 2  # If they selected the left option, save the right (not chosen)
@@ -359,6 +611,16 @@ class GUI:
         print(f"pg {self.current_page}   Option Select: {radio_var.get()}   " +
               f"{self.runtimes[self.current_page][-1]:.2f} s")
 
+        # On the last training page the tentative choice completes the selection list, so speculation can start
+        # while the participant is still reading, once the choice has settled (see speculation_delay). Changing the
+        # choice afterwards discards that work and starts it again.
+        if self.current_page == self.num_training_pages() and self.use_speculative_generation:
+            self.cancel_speculation()
+            self.speculation_job = self.root.after(
+                self.speculation_delay, self.speculate,
+                self.user_selections + [self.user_choices[self.current_page]],
+                self.user_notSelections + [self.notUser_choices[self.current_page]])
+
         # Update "option_selected" to reflect that one of the two options has been selected. Failing to do so will
         # cause an error in the click_next_page method.
         self.option_selected = True
@@ -366,14 +628,18 @@ class GUI:
 
     def click_next_page(self, response=None):
         '''Close the current page and launch the next page'''
+        if self.selection_locked:
+            messagebox.showinfo(title="Please Wait", message="Please wait until both paragraphs have finished loading.")
+            return
+
         # Check if an option has been selected
         if not self.option_selected and self.current_page not in [0, len(self) - 1]:
             messagebox.showinfo(title="Selection Required", message="Please select an option before continuing.")
             return  # Do not move on to the next page and exit early.
 
         # Save endTime immediately
-        self.endTime = time.time()
-        self.calcTime = self.endTime - self.startTime
+        self.calcTime = self.stop_page_timer()
+        self.endTime = timing.now()
 
         # If an option has been selected, we need to append the selected text and not selected texts.
         # Save selected paragraphs to "self.user_selections" and the not selected paragraphs to
@@ -394,6 +660,16 @@ class GUI:
             print(f"Paragraphs not Chosen Text: {self.user_notSelections_text}")
             print("***\n")
 
+            # Adaptive training: choose the next pair, or end training, now that this choice is known.
+            if self.adaptive_training is not None and self.current_page <= self.num_training_pages():
+                self.choose_next_pair()
+
+            # Once the final training choice is committed, make sure a speculative job exists for exactly these
+            # selections (this reuses the job started from on_click if the choice did not change).
+            if self.current_page == self.num_training_pages():
+                self.cancel_speculation()
+                self.speculate(self.user_selections, self.user_notSelections)
+
         # Save the runtime & response
         self.runtimes[self.current_page].append(self.calcTime)
 
@@ -410,16 +686,65 @@ class GUI:
             print(f"pg {self.current_page}   Continue           " +
                   f"{self.runtimes[self.current_page][-1]:.2f} s\nPage Submitted.")
 
+        self.log.event("page_submitted", {"choice": self.user_choices.get(self.current_page),
+                                          "dwell": self.runtimes[self.current_page][-1]})
+
         # Move forward
+        self.page_span.end(choice=self.user_choices.get(self.current_page))
         self.current_page += 1  # Update the page number
+        self.checkpoint("current_page", "user_choices", "notUser_choices", "user_selections", "user_notSelections",
+                        "user_selections_text", "user_notSelections_text", "runtimes", *self.adaptive_fields())
+        self.log.page_boundary(self.current_page)  # Make everything logged so far durable
+        self.page_span = timing.begin(f"page {self.current_page}", "page", track="pages")
 
-        # Otherwise destroy the current frame and launch the next page
-        if hasattr(self, 'frame'):
-            self.frame.destroy()
+        # Otherwise remove the current frame and launch the next page
+        self.clear_frame()
         self.runtimes[self.current_page] = []  # Reset runtimes
 
         # Create the next page
-        self.create_page()
+        with timing.span("render", "page", page=self.current_page):
+            self.create_page()
+
+    def start_page_timer(self, name=None):
+        '''Start timing the participant on the page that has just been shown'''
+        self.startTime = timing.now()
+        if self.dwell_span is not None:
+            self.dwell_span.end()
+        self.dwell_span = timing.begin("dwell", "page", track="dwell", page=self.current_page, screen=name)
+
+    def stop_page_timer(self):
+        '''Stop timing the participant on the current page. Returns the time since the page was shown (in sec.)'''
+        if self.dwell_span is not None:
+            self.dwell_span.end()
+            self.dwell_span = None
+        return timing.now() - self.startTime
+
+    def start_loading_timer(self):
+        '''Start timing a loading page (stopped in update_gpt_interaction_page)'''
+        self.startTime = timing.now()
+        if self.loading_span is not None:
+            self.loading_span.end()
+        self.loading_span = timing.begin("loading", "page", track="loading", page=self.current_page)
+
+    def num_training_pages(self):
+        '''Return the number of paragraph pair pages in the training session'''
+        return len(self.text) - self.num_gpt_interactions - 2
+
+    def cancel_speculation(self):
+        if self.speculation_job is not None:
+            self.root.after_cancel(self.speculation_job)
+            self.speculation_job = None
+
+    def speculate(self, selections, notSelections):
+        '''Start (or reuse) background generation of the profile and rewrites for a complete set of selections'''
+        self.speculation_job = None
+        if not self.use_speculative_generation or len(selections) != self.num_training_pages():
+            return
+        if self.precomputed is not None and self.precomputed.has(selections, self.experiment_version):
+            return  # Served from the precomputed table instead (see use_precomputed_variant).
+        self.speculative_pipeline.submit(selections, notSelections,
+                                         self.paragraph_pair_list[:self.num_training_pages()],
+                                         self.experiment_version)
 
     # Create the next GUI screen
     def create_page(self, interaction=None):
@@ -427,9 +752,8 @@ class GUI:
         # Each time a new page is created, ensure the option_selected flag is set to False.
         self.option_selected = False
 
-        # Destroy the previous frame if it exists
-        if hasattr(self, 'frame'):
-            self.frame.destroy()
+        # Remove the previous frame if it exists
+        self.clear_frame()
 
         # Check if the current page is a "regular page" (i.e., from CSV/the TRAINING SESSION)
         if self.current_page < len(self.text) - self.num_gpt_interactions - 1:
@@ -441,12 +765,25 @@ class GUI:
         elif self.current_page in range(len(self.text) - self.num_gpt_interactions - 1, len(self.text) - 1):
             if interaction is None:
                 # GPT interaction page setup
-                if self.generated_text_iter1 is None:  # Then it is the first GPT interaction page
+                gpt_interaction_num = self.gpt_interaction_num()
+                if self.student_profile is None:  # Then it is the first GPT interaction page
                     self.create_gpt_interaction_page()
-                # Otherwise profiles and texts have already been generated, so we can move on w/o "loading"
-                if self.generated_text_iter1 is not None:
-                    self.startTime = time.time()
-                    self.update_gpt_interaction_page(self.gpt_paragraph1_iter2, self.gpt_paragraph2_iter2)
+                # Otherwise the profile exists. If this page's text has already been generated, we can move on
+                # w/o "loading"
+                elif gpt_interaction_num in self.generated_texts:
+                    self.startTime = timing.now()
+                    self.update_gpt_interaction_page(*self.generated_texts[gpt_interaction_num])
+                # If its rewrite is streaming, show what has arrived so far.
+                elif gpt_interaction_num in self.streamed_text:
+                    self.startTime = timing.now()
+                    self.show_streaming_page(gpt_interaction_num)
+                # Otherwise its rewrite is still running: show the loading page until it arrives (on_rewrite_ready)
+                else:
+                    self.start_loading_timer()
+                    self.awaiting_interaction = gpt_interaction_num
+                    self.create_loading_page("Loading", "Please wait while we load your next paragraphs.")
+                    if gpt_interaction_num in self.failed_interactions:
+                        self.show_generation_error()
             if interaction is not None:
                 self.gpt_refresh_code = interaction
                 self.create_gpt_interaction_page()
@@ -456,43 +793,144 @@ class GUI:
             self.break_screen()
 
     def create_paragraph_page(self, title, paragraph1, paragraph2, radio_var, gpt_interaction_num):
-        self.paragraph_pair_list.append(f"{title} \n\nParagraph 1:\n{paragraph1}\n\nParagraph 2:\n{paragraph2}")
+        self.paragraph_pair_list.append(openai_interact_profile.paragraph_pair_text(title, paragraph1, paragraph2))
+
+        # The paragraph pair layouts are built once (build_paragraph_page) and reused for every training and test page.
+        # Only the title, icon, texts, and refresh button change from page to page. If this page was rendered ahead
+        # while the participant read the previous one (prerender_next_page), it only has to be raised.
+        content = (title, paragraph1, paragraph2, self.image_paths[self.current_page - 1])
+        page = self.take_prerendered_page(content)
+        if page is None:
+            if not self.paragraph_pages:
+                self.paragraph_pages.append(self.build_paragraph_page())
+            page = self.paragraph_pages[0]
+            self.fill_paragraph_page(page, *content)
+        self.show_paragraph_page(page)
+        self.clicked_text_box = None  # Reset tracking parameter to None each time a new page is created.
+
+        # The refresh button is only active on GPT pages.
+        if gpt_interaction_num == 0:
+            self.refresh_button.configure(text='', command=None, fg_color='transparent', state='disabled')
+        if gpt_interaction_num > 0:
+            self.refresh_button.configure(text="Refresh", command=lambda: self.click_refresh(gpt_interaction_num),
+                                          fg_color=self.refresh_button_fg_color, state='normal')
+        self.paragraph_participant_id.configure(text=self.participant_id_display)
 
-        # Page setup
-        self.frame = ctk.CTkFrame(self.root)
         self.frame.pack(padx=10, pady=10, fill='both', expand=True)
-        self.clicked_text_box = None  # Reset tracking parameter to None each time a new page is created.
+
+        # Start the timer (the page is visible from here, however long ago it was rendered)
+        self.start_page_timer()
+
+        if gpt_interaction_num == 0:
+            self.schedule_prerender()
+
+    def fill_paragraph_page(self, page, title, paragraph1, paragraph2, image_path):
+        """Swap a page's content into a paragraph pair layout"""
+        page["paragraph_title"].configure(text=title)
+        page["paragraph_image"].configure(image=self.icons.get(image_path, self.page_image_size))
+        for text_box, paragraph in ((page["left_text"], paragraph1), (page["right_text"], paragraph2)):
+            text_box.configure(state='normal')
+            text_box.delete('1.0', tk.END)
+            text_box.insert(tk.END, paragraph)
+            text_box.configure(state='disabled', border_color="#DBDBDB", border_width=0)  # Disable after insertion
+            text_box.see('1.0')
+
+        # Clear the previous page's selection
+        page["paragraph_radio_var"].set(0)
+        page["left_option_frame"].configure(fg_color="transparent")
+        page["right_option_frame"].configure(fg_color="transparent")
+
+    def show_paragraph_page(self, page):
+        """Make a paragraph pair layout the current page (self.left_text etc. refer to the visible layout)"""
+        self.use_paragraph_widgets(page)
+        self.paragraph_frame.place_forget()  # In case it was rendered ahead
+        self.frame = self.paragraph_frame
+        # Keep the visible layout first, so a page that is not rendered ahead reuses it (as before look-ahead).
+        self.paragraph_pages.remove(page)
+        self.paragraph_pages.insert(0, page)
+
+    def use_paragraph_widgets(self, page):
+        for name, widget in page.items():
+            setattr(self, name, widget)
+
+    def schedule_prerender(self):
+        """Render the next page ahead once the current page has been drawn and the participant is reading it"""
+        self.cancel_prerender()
+        if self.use_lookahead_rendering and self.current_page + 1 <= self.num_training_pages() and \
+                self.adaptive_training is None:  # With adaptive training, the next pair depends on this page's choice
+            self.lookahead_job = self.root.after(self.lookahead_delay, self.prerender_next_page, self.current_page)
+
+    def cancel_prerender(self):
+        if self.lookahead_job is not None:
+            self.root.after_cancel(self.lookahead_job)
+            self.lookahead_job = None
+
+    def prerender_next_page(self, page_number):
+        """Fill the next training page into the spare paragraph pair layout, under the visible page"""
+        self.lookahead_job = None
+        if self.current_page != page_number or self.frame is not self.paragraph_frame:
+            return  # The participant has already moved on.
+        next_page = page_number + 1
+        with timing.span("prerender", "page", page=next_page):
+            if len(self.paragraph_pages) < 2:
+                self.paragraph_pages.append(self.build_paragraph_page())
+                self.use_paragraph_widgets(self.paragraph_pages[0])  # Building sets them to the new layout
+            page = self.paragraph_pages[1]
+            content = (*self.text[next_page], self.image_paths[next_page - 1])
+            self.fill_paragraph_page(page, *content)
+            # Placed over the visible page at the same size, so the text is wrapped to the width it will be shown at.
+            # Stacked under the visible page, it is laid out but cannot be seen or clicked.
+            frame = page["paragraph_frame"]
+            frame.place(in_=self.frame, x=0, y=0, relwidth=1, relheight=1)
+            frame.lower(self.frame)
+        self.prerendered = (next_page, content, page)
+
+    def take_prerendered_page(self, content):
+        """Return the layout rendered ahead for the current page, or None (it is discarded if it does not match)"""
+        self.cancel_prerender()
+        prerendered, self.prerendered = self.prerendered, None
+        if prerendered is None:
+            return None
+        page_number, prerendered_content, page = prerendered
+        if page_number == self.current_page and prerendered_content == content:
+            return page
+        page["paragraph_frame"].place_forget()
+        return None
+
+    def build_paragraph_page(self):
+        """Build a paragraph pair layout (once per session, plus one for look-ahead rendering; see
+        create_paragraph_page). Returns its widgets by attribute name."""
+        # Page setup
+        self.paragraph_frame = ctk.CTkFrame(self.root)
+        self.retained_frames.add(self.paragraph_frame)
 
         # Create a page with two paragraph options and radio buttons.
 
         # Create a header frame to hold title and image
-        header_frame = ctk.CTkFrame(self.frame, fg_color='transparent')
+        header_frame = ctk.CTkFrame(self.paragraph_frame, fg_color='transparent')
         header_frame.pack(fill='x', pady=(20, 0), padx=50)
 
-        # Load and resize the image
-        ctk_image = CTkImage(light_image=Image.open(self.image_paths[self.current_page - 1]), size=(350, 350))
-
         # Create an image label
-        image_label = ctk.CTkLabel(master=header_frame, image=ctk_image, text='')
+        self.paragraph_image = ctk.CTkLabel(master=header_frame, text='')
 
         # Page title
-        ctkTitle = ctk.CTkLabel(master=header_frame, text=title, font=("Open Sans", 24, "bold"), height=10)
+        self.paragraph_title = ctk.CTkLabel(master=header_frame, text='', font=("Open Sans", 24, "bold"), height=10)
 
         # Pack into frame
-        ctkTitle.pack(padx=0, pady=(0, 10), side='top', anchor='center')
-        image_label.pack(padx=0)
+        self.paragraph_title.pack(padx=0, pady=(0, 10), side='top', anchor='center')
+        self.paragraph_image.pack(padx=0)
 
         # Page instructions
         selectInstructions = ("Please select your preferred paragraph from the two options below."
                               "\n(Remember there is no correct response.)")
-        ctkInstructions = ctk.CTkLabel(master=self.frame, text=selectInstructions, font=("Open Sans", 20))
+        ctkInstructions = ctk.CTkLabel(master=self.paragraph_frame, text=selectInstructions, font=("Open Sans", 20))
         ctkInstructions.pack(pady=(5, 0))
 
-        # Set up radio button variable and trace changes to it
-        radio_var = tk.IntVar(value=0)
+        # Set up radio button variable (shared by every paragraph page, reset to 0 when a page is shown)
+        radio_var = self.paragraph_radio_var = tk.IntVar(value=0)
 
         # Create a divided frame for the text options
-        options_frame = ctk.CTkFrame(self.frame, fg_color='transparent')
+        options_frame = ctk.CTkFrame(self.paragraph_frame, fg_color='transparent')
         options_frame.pack(fill='both', expand=True, padx=60, pady=(10, 5))
 
         # Creating left option frame
@@ -507,8 +945,7 @@ class GUI:
         self.left_text = ctk.CTkTextbox(self.left_option_frame, font=self.text_font,
                                         corner_radius=self.text_box_radius, wrap="word", border_width=0,
                                         border_color="#DBDBDB", cursor='hand')
-        self.left_text.insert(tk.END, paragraph1)
-        self.left_text.configure(state='disabled')  # Disable textbox after all text is inserted
+        self.left_text.configure(state='disabled')
         self.left_text.bind("<Button-1>", lambda event: radio_var.set(1))
         self.left_text.pack(padx=(25, 25), pady=(5, 25), fill='both', expand=True)
         self.left_text.bind("<Enter>", lambda event, t=self.left_text: self.on_enter(event, t))
@@ -527,8 +964,7 @@ class GUI:
         self.right_text = ctk.CTkTextbox(self.right_option_frame, font=self.text_font,
                                          corner_radius=self.text_box_radius, wrap="word", border_width=0,
                                          border_color="#DBDBDB", cursor='hand')
-        self.right_text.insert(tk.END, paragraph2)
-        self.right_text.configure(state='disabled')  # Disable textbox after all text is inserted
+        self.right_text.configure(state='disabled')
         self.right_text.bind("<Button-1>", lambda event: radio_var.set(2))
         self.right_text.pack(padx=(25, 25), pady=(5, 25), fill='both', expand=True)
         self.right_text.bind("<Enter>", lambda event, t=self.right_text: self.on_enter(event, t))
@@ -536,7 +972,7 @@ class GUI:
         self.right_text.bind("<Button-1>", lambda event, t=self.right_text: self.on_click(event, t, radio_var))
 
         # Continue button
-        continue_button_frame = ctk.CTkFrame(self.frame, fg_color='transparent')
+        continue_button_frame = ctk.CTkFrame(self.paragraph_frame, fg_color='transparent')
         continue_button_frame.pack(fill='x', side='top', padx=30, pady=(0, 10))
         # Use the click_next_page method to handle saving and next page generation.
         continue_button = ctk.CTkButton(continue_button_frame, text="Continue",
@@ -546,105 +982,244 @@ class GUI:
                                         font=self.button_font)
         continue_button.pack(pady=20)
 
-        # Handle the refresh button creation - always create the frame for consistency, but only add in the button if
-        # it is a GPT page.
+        # Handle the refresh button creation - always create the button for consistency, but it is only active on
+        # GPT pages (see create_paragraph_page).
 
         # Add a refresh button to the bottom right corner of the button frame
-        refresh_button_frame = ctk.CTkFrame(self.frame, fg_color='transparent')
+        refresh_button_frame = ctk.CTkFrame(self.paragraph_frame, fg_color='transparent')
         refresh_button_frame.pack(fill='x', side='top', padx=60, pady=0)
 
         # Display Participant ID
-        participantID = ctk.CTkLabel(master=refresh_button_frame, text=self.participant_id_display,
-                                     font=("Open Sans", 12))
-
-        if gpt_interaction_num == 0:
-            refresh_button = ctk.CTkButton(refresh_button_frame, text='',
-                                           height=20,
-                                           width=30,
-                                           fg_color='transparent',
-                                           state='disabled')
-            refresh_button.pack(padx=25, pady=10, side='right')
-            participantID.pack(padx=25, pady=10, side='left')
-
-        if gpt_interaction_num > 0:
-            refresh_button = ctk.CTkButton(refresh_button_frame, text="Refresh",
-                                           command=lambda: self.click_refresh(gpt_interaction_num),
-                                           height=20,
-                                           width=30,
-                                           font=self.refresh_button_font,
-                                           fg_color=self.refresh_button_fg_color,
-                                           hover_color=self.refresh_button_hover)
-            refresh_button.pack(padx=25, pady=10, side='right')
-            participantID.pack(padx=25, pady=10, side='left')
-
-        # Start the timer
-        self.startTime = time.time()
+        self.paragraph_participant_id = ctk.CTkLabel(master=refresh_button_frame, text=self.participant_id_display,
+                                                     font=("Open Sans", 12))
+
+        self.refresh_button = ctk.CTkButton(refresh_button_frame, text='',
+                                            height=20,
+                                            width=30,
+                                            font=self.refresh_button_font,
+                                            fg_color='transparent',
+                                            hover_color=self.refresh_button_hover,
+                                            state='disabled')
+        self.refresh_button.pack(padx=25, pady=10, side='right')
+        self.paragraph_participant_id.pack(padx=25, pady=10, side='left')
+
+        return {name: getattr(self, name) for name in PARAGRAPH_PAGE_WIDGETS}
+
+    def gpt_interaction_num(self):
+        '''Return the GPT interaction number of the current page (1 = first page of the test session)'''
+        return self.current_page - len(self.text) + self.num_gpt_interactions + 2
+
+    def regenerated_interactions(self):
+        '''Return the GPT interaction numbers that must be (re)generated from the current page'''
+        if self.gpt_refresh_code > 1:
+            # Refreshing a later test page only regenerates that page's rewrite. The profile is kept.
+            return [self.gpt_interaction_num()]
+        return list(range(self.gpt_interaction_num(), self.num_gpt_interactions + 1))
 
     # When called upon by create_page, interact with GPT-4
     def create_gpt_interaction_page(self):
-        self.startTime = time.time()
+        self.start_loading_timer()
         if self.gpt_refresh_code == -1:
             self.create_loading_page()
         else:
             self.create_loading_page("Loading", "Please wait while we update your options.")
 
+        # Forget any rewrites that are about to be regenerated (and any still running for them, since they were written
+        # for the profile being replaced) and wait for this page's rewrite.
+        for interaction_num in self.regenerated_interactions():
+            self.generated_texts.pop(interaction_num, None)
+            self.streamed_text.pop(interaction_num, None)
+            self.state.cancel(("rewrite", interaction_num))
+        self.awaiting_interaction = self.gpt_interaction_num()
+        if self.gpt_refresh_code != -1:
+            # A resumed session must not bring back what the participant asked to refresh.
+            discarded = {"student_profile": None, "student_profile_opposite": None} if self.gpt_refresh_code == 1 \
+                else {}
+            self.checkpoint("generated_texts", **discarded)
+
+        # In precomputed mode, serve a pregenerated variant for the participant's selections (and a different variant
+        # when the first test page is refreshed).
+        if self.precomputed is not None and (self.student_profile is None or self.gpt_refresh_code == 1):
+            if self.use_precomputed_variant():
+                return
+
+        # Use the speculative job if one was built from exactly the selections the participant submitted.
+        if self.student_profile is None and self.gpt_refresh_code == -1 and self.use_speculative_generation:
+            job = self.speculative_pipeline.claim(self.user_selections, self.user_notSelections,
+                                                  self.paragraph_pair_list[:self.num_training_pages()],
+                                                  self.experiment_version)
+            if job is not None:
+                self.state.submit("profile", job.wait_profile, on_done=self.use_speculative_profile)
+                return
+
         # Test if there is a student profile already generated:
         if self.student_profile is None or self.gpt_refresh_code == 1:
-            # Create profile generation thread
-            profile_thread = threading.Thread(target=self.generate_profile)
-            profile_thread.start()
+            self.generate_profile()
         else:
             # Just continue on
             self.continue_gpt_interaction()
 
     def create_loading_page(self, text_l1=None, text_l2=None):
-        """Create a loading page while GPT is running in the background"""
-        # Create a new frame for the "loading" page
-        self.frame = ctk.CTkFrame(self.root)
-        self.frame.pack(padx=10, pady=10, fill='both', expand=True)
-
+        """Show the loading page while GPT is running in the background"""
+        # The "loading" page is built once and reused.
+        if self.loading_frame is None:
+            self.build_loading_page()
+        self.frame = self.loading_frame
+
+        num_words = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten"]
+        remaining = num_words[self.num_gpt_interactions] if self.num_gpt_interactions < len(num_words) \
+            else str(self.num_gpt_interactions)
         if text_l1 is None:
-            text_l1 = "Great job! Just two more to go!"
+            text_l1 = f"Great job! Just {remaining} more to go!"
         if text_l2 is None:
-            text_l2 = "Please wait while we load the last two."
+            text_l2 = f"Please wait while we load the last {remaining}."
 
         # Page content
-        loading_text_line1 = ctk.CTkLabel(master=self.frame, text=text_l1, font=("Open Sans", 40, "bold"))
-        loading_text_line2 = ctk.CTkLabel(master=self.frame, text=text_l2, font=("Open Sans", 20))
-        self.pattern = ctk.CTkLabel(master=self.frame, text='   ', font=("Consolas", 100))
+        self.loading_text_line1.configure(text=text_l1)
+        self.loading_text_line2.configure(text=text_l2)
+        self.retry_button.pack_forget()
+        self.loading_participant_id.configure(text=self.participant_id_display)
+        self.frame.pack(padx=10, pady=10, fill='both', expand=True)
+
+        # Define a loading text pattern and start updating the loading text
+        self.loading_pattern = itertools.cycle([".  ", ".. ", "...", " ..", "  .", "   ", " . ", "   "])
+        if self.loading_animation is not None:
+            self.root.after_cancel(self.loading_animation)
+        self.update_loading_text()
+
+    def build_loading_page(self):
+        """Build the loading page layout (once per session; see create_loading_page)"""
+        self.loading_frame = ctk.CTkFrame(self.root)
+        self.retained_frames.add(self.loading_frame)
+
+        self.loading_text_line1 = ctk.CTkLabel(master=self.loading_frame, text='', font=("Open Sans", 40, "bold"))
+        self.loading_text_line2 = ctk.CTkLabel(master=self.loading_frame, text='', font=("Open Sans", 20))
+        self.pattern = ctk.CTkLabel(master=self.loading_frame, text='   ', font=("Consolas", 100))
 
         # Continue to display participant ID
-        participantID = ctk.CTkLabel(master=self.frame, text=self.participant_id_display,
-                                     font=("Open Sans", 12))
-        participantID.pack(padx=85, pady=10, side='bottom', anchor='w')
+        self.loading_participant_id = ctk.CTkLabel(master=self.loading_frame, text=self.participant_id_display,
+                                                   font=("Open Sans", 12))
+        self.loading_participant_id.pack(padx=85, pady=10, side='bottom', anchor='w')
 
-        loading_text_line1.pack(expand=False, anchor='center', pady=(100, 0))
-        loading_text_line2.pack(expand=False, anchor='center')
+        self.loading_text_line1.pack(expand=False, anchor='center', pady=(100, 0))
+        self.loading_text_line2.pack(expand=False, anchor='center')
         self.pattern.pack(expand=False, anchor='center', pady=(100, 0))
 
-        # Define a loading text pattern and start updating the loading text
-        self.loading_pattern = itertools.cycle([".  ", ".. ", "...", " ..", "  .", "   ", " . ", "   "])
-        self.update_loading_text()
+        # Only shown when generation fails (see show_generation_error)
+        self.retry_button = ctk.CTkButton(self.loading_frame, text="Try Again", command=self.click_retry,
+                                          height=self.button_height,
+                                          width=self.button_width,
+                                          font=self.button_font)
 
     def update_loading_text(self):
         """Update the loading text in the pattern given earlier"""
         next_text = next(self.loading_pattern)
         self.pattern.configure(text=next_text)
-        self.frame.after(500, self.update_loading_text)
+        self.loading_animation = self.root.after(500, self.update_loading_text)
 
-    def generate_profile(self):
-        # Call on the code "openai_interact_profile.py". Use all student selections to create the profile.
-        actual_profile, opposite_profile = openai_interact_profile.get_student_profile(self.user_selections,
-                                                                                       self.user_notSelections,
-                                                                                       self.paragraph_pair_list)
+    def clear_frame(self):
+        """Remove the current page. Retained pages (the paragraph and loading pages) are hidden for reuse, all other
+        pages are destroyed."""
+        if not hasattr(self, 'frame'):
+            return
+        if self.frame is self.loading_frame and self.loading_animation is not None:
+            self.root.after_cancel(self.loading_animation)
+            self.loading_animation = None
+        if self.frame in self.retained_frames:
+            self.frame.pack_forget()
+        else:
+            self.frame.destroy()
 
-        self.student_profile = actual_profile
-        self.student_profile_opposite = opposite_profile
+    def use_precomputed_variant(self):
+        '''Serve the profile and rewrites from the precomputed table. Returns False if the table has no variant for the
+        participant's selections.'''
+        variant = self.precomputed.sample(self.user_selections, self.experiment_version,
+                                          exclude=self.precomputed_variant)
+        if variant is None:
+            print(f"No precomputed variant for selections {self.user_selections} ({self.experiment_version}). "
+                  f"Generating profile and rewrites now.")
+            return False
+
+        # Log where the generation came from, so sessions can be traced back to the build.
+        provenance = self.precomputed.provenance()
+        self.precomputed_variant = variant["variant"]
+        print(f"Using precomputed variant {variant['variant'] + 1} of {variant['num_variants']} ({variant['id']}) from "
+              f"{self.precomputed.path} (built {provenance['built']}, model {provenance['model']}, "
+              f"backend {provenance['backend']}).")
+        self.log.event("precomputed_variant", dict(provenance, path=self.precomputed.path, id=variant["id"],
+                                                   variant=variant["variant"]))
+
+        self.student_profile = variant["profile"]
+        self.student_profile_opposite = variant["profile_opposite"]
+        self.checkpoint("student_profile", "student_profile_opposite", "precomputed_variant")
+        print("Student Profile: " + self.student_profile)
+        print("Opposite Student Profile: " + self.student_profile_opposite)
+        if self.experiment_version == "Experimental":
+            print("\nExperimental Group - using ACTUAL student profile to generate rewrites.")
+        else:
+            print("\nControl Group - using OPPOSITE student profile to generate rewrites.")
+
+        for interaction_num in self.regenerated_interactions():
+            rewrite = variant["rewrites"][str(interaction_num)]
+            self.rewrite_orders[interaction_num] = rewrite["order"]
+            self.rewrite_generations[interaction_num] = "precomputed"
+            print(f"Rewritten Paragraph for GPT interaction {interaction_num} (precomputed): {rewrite['customized']}")
+            if rewrite["order"] == 'first':
+                print("first  --->  Generic rewrite first, customized rewrite second.")
+            else:
+                print("second  --->  Customized rewrite first, generic rewrite second.")
+            self.root.after(0, self.on_rewrite_ready, interaction_num, (rewrite["paragraph1"], rewrite["paragraph2"]))
+        return True
+
+    def use_speculative_profile(self, job):
+        if not job.profile_succeeded():
+            # The job failed or was invalidated: fall back to generating everything on the loading page.
+            print("Speculative generation unusable. Generating profile and rewrites now.")
+            self.generate_profile()
+            return
 
-        # Update GUI on main thread after generating the final profile.
-        self.root.after(0, self.continue_gpt_interaction)
+        # Lead time > 0: the profile was ready before the loading page started. Lead time < 0: the loading page waited.
+        print(f"Using speculative generation for selections {job.selections} "
+              f"(Speculative Profile Lead Time: {(self.startTime - job.profile_time):.2f} s).")
+        self.student_profile = job.student_profile
+        self.student_profile_opposite = job.student_profile_opposite
+        self.checkpoint("student_profile", "student_profile_opposite")
+        print("Student Profile: " + self.student_profile)
+        print("Opposite Student Profile: " + self.student_profile_opposite)
+        if self.experiment_version == "Experimental":
+            print("\nExperimental Group - using ACTUAL student profile to generate rewrites.")
+        else:
+            print("\nControl Group - using OPPOSITE student profile to generate rewrites.")
+
+        # Pass each speculative rewrite to the main thread as soon as it finishes, so the first test page is shown
+        # without waiting for the others.
+        for interaction_num in range(1, self.num_gpt_interactions + 1):
+            self.rewrite_generations[interaction_num] = self.state.submit(
+                ("rewrite", interaction_num), job.wait_rewrite, interaction_num,
+                on_done=functools.partial(self.use_speculative_rewrite, interaction_num))
+
+    def use_speculative_rewrite(self, interaction_num, generated_text):
+        if generated_text is None:
+            # Generate any rewrite the speculative job could not produce.
+            print(f"Speculative generation missing rewrite {interaction_num}. Generating it now.")
+            self.fetch_gpt_text([interaction_num])
+        else:
+            self.on_rewrite_ready(interaction_num, generated_text)
+
+    def generate_profile(self):
+        # Call on the code "openai_interact_profile.py" (or the session server, see session_client.py). Use all student
+        # selections to create the profile. The request gets copies of the selections, since the main thread keeps
+        # using the lists while it runs.
+        self.state.submit("profile", session_client.get_student_profile, list(self.user_selections),
+                          list(self.user_notSelections), list(self.paragraph_pair_list),
+                          on_done=self.on_profile_ready, on_error=functools.partial(self.on_generation_failed, None))
+
+    def on_profile_ready(self, profiles):
+        self.student_profile, self.student_profile_opposite = profiles
+        self.continue_gpt_interaction()
 
     def continue_gpt_interaction(self):
+        self.checkpoint("student_profile", "student_profile_opposite")
         print("Student Profile: " + self.student_profile)
         print("Opposite Student Profile: " + self.student_profile_opposite)
         try:
@@ -657,68 +1232,179 @@ class GUI:
         except Exception as e:
             print(f"Error: {e}")
 
-        # Start a new thread to fetch GPT-generated text
-        gpt_thread = threading.Thread(target=self.fetch_gpt_text)
-        gpt_thread.start()
+        # Request the GPT-generated texts
+        self.fetch_gpt_text()
 
-    def fetch_gpt_text(self):
-        # Call on the code "openai_interact_rewrite.py" to get the responses from GPT to be displayed on the GPT screen.
-        gpt_interaction_num = self.current_page - len(self.text) + self.num_gpt_interactions + 2
+    def fetch_gpt_text(self, interaction_nums=None):
+        # Call on the code "openai_interact_rewrite.py" to get the responses from GPT to be displayed on the GPT screens.
+        # The rewrites for every remaining test session topic are requested at the same time (each one is its own
+        # request on the session's worker executor) and handed to the main thread as each one finishes, so a page can
+        # be shown as soon as its own rewrite has arrived.
+        if interaction_nums is None:
+            interaction_nums = self.regenerated_interactions()
         try:
-            if self.experiment_version == "Experimental" and self.gpt_refresh_code != 2:
-                self.generated_text_iter1 = openai_interact_rewrite.get_gpt_response(self.student_profile,
-                                                                                     gpt_interaction_num)
-                gpt_interaction_num += 1
-                self.generated_text_iter2 = openai_interact_rewrite.get_gpt_response(self.student_profile,
-                                                                                     gpt_interaction_num)
-            elif self.experiment_version == "Control" and self.gpt_refresh_code != 2:
-                self.generated_text_iter1 = openai_interact_rewrite.get_gpt_response(self.student_profile_opposite,
-                                                                                     gpt_interaction_num)
-                gpt_interaction_num += 1
-                self.generated_text_iter2 = openai_interact_rewrite.get_gpt_response(self.student_profile_opposite,
-                                                                                     gpt_interaction_num)
-            elif self.experiment_version == "Experimental" and self.gpt_refresh_code == 2:
-                self.generated_text_iter2 = openai_interact_rewrite.get_gpt_response(self.student_profile,
-                                                                                     gpt_interaction_num)
-
-            elif self.experiment_version == "Control" and self.gpt_refresh_code == 2:
-                self.generated_text_iter2 = openai_interact_rewrite.get_gpt_response(self.student_profile_opposite,
-                                                                                     gpt_interaction_num)
-
+            if self.experiment_version == "Experimental":
+                rewrite_profile = self.student_profile
+            elif self.experiment_version == "Control":
+                rewrite_profile = self.student_profile_opposite
             else:
                 print(f"\nGUI failed on text generation.")
                 raise ValueError("GUI failed on text generation. Invalid Experiment version.")
         except Exception as e:
             print(f"Error: {e}")
+            return
 
-        self.gpt_paragraph1_iter1 = self.generated_text_iter1[0]
-        self.gpt_paragraph2_iter1 = self.generated_text_iter1[1]
-
-        self.gpt_paragraph1_iter2 = self.generated_text_iter2[0]
-        self.gpt_paragraph2_iter2 = self.generated_text_iter2[1]
-
-        # use after method to update the GUI on the main thread.
-        if self.gpt_refresh_code == 2:
-            self.root.after(0, self.update_gpt_interaction_page, self.gpt_paragraph1_iter2, self.gpt_paragraph2_iter2)
+        for interaction_num in interaction_nums:
+            on_token = None
+            if self.use_streaming:
+                # Decide the presentation order before generation starts, so the streamed text goes in the right
+                # textbox.
+                self.rewrite_orders[interaction_num] = openai_interact_rewrite.choose_order()
+                stream_id = self.stream_ids[interaction_num] = object()
+                on_token = functools.partial(self.put_token, interaction_num, stream_id)
+            # A failed rewrite is handed to on_generation_failed, which offers a retry on the loading page.
+            self.rewrite_generations[interaction_num] = self.state.submit(
+                ("rewrite", interaction_num), session_client.get_gpt_response, rewrite_profile, interaction_num,
+                on_token, self.rewrite_orders.get(interaction_num), self.topics.get(interaction_num),
+                on_done=functools.partial(self.on_rewrite_ready, interaction_num),
+                on_error=functools.partial(self.on_generation_failed, interaction_num))
+
+    def put_token(self, interaction_num, stream_id, text):
+        """Queue a streamed piece of a rewrite for the main thread (called on a worker thread)"""
+        self.token_queue.put((interaction_num, stream_id, text))
+
+    def drain_tokens(self):
+        """Move streamed text from the worker threads into the GUI (runs on the main thread every 50 ms)"""
+        while True:
+            try:
+                interaction_num, stream_id, text = self.token_queue.get_nowait()
+            except queue.Empty:
+                break
+            # Ignore pieces from superseded streams and from rewrites that have already completed.
+            if stream_id is not self.stream_ids.get(interaction_num) or interaction_num in self.generated_texts:
+                continue
+            self.streamed_text[interaction_num] = self.streamed_text.get(interaction_num, "") + text
+
+            if self.awaiting_interaction == interaction_num:
+                # First piece for the page on the loading screen: show the page now.
+                self.show_streaming_page(interaction_num)
+            elif self.streaming_interaction == interaction_num:
+                self.append_streamed_text(text)
+        self.root.after(50, self.drain_tokens)
+
+    def show_streaming_page(self, interaction_num):
+        """Show a test page whose customized rewrite is still streaming in"""
+        generic = self.topic_catalog.get(self.topics[interaction_num]).generic_rewrite
+        partial = self.streamed_text[interaction_num]
+        if self.rewrite_orders[interaction_num] == 'first':
+            paragraph1, paragraph2 = generic, partial
         else:
-            self.root.after(0, self.update_gpt_interaction_page, self.gpt_paragraph1_iter1, self.gpt_paragraph2_iter1)
+            paragraph1, paragraph2 = partial, generic
+
+        self.awaiting_interaction = None
+        self.streaming_interaction = interaction_num
+        self.selection_locked = True
+        self.update_gpt_interaction_page(paragraph1, paragraph2)
+
+    def streaming_text_box(self):
+        # The customized rewrite is on the right if the generic rewrite is first, and on the left otherwise.
+        if self.rewrite_orders[self.streaming_interaction] == 'first':
+            return self.right_text
+        return self.left_text
+
+    def append_streamed_text(self, text):
+        text_box = self.streaming_text_box()
+        text_box.configure(state='normal')
+        text_box.insert(tk.END, text)
+        text_box.configure(state='disabled')
+
+    def on_generation_failed(self, interaction_num, error):
+        """Record a failed profile (interaction_num None) or rewrite, and show the error if the page is waiting on it"""
+        what = "Profile" if interaction_num is None else f"Rewrite for GPT interaction {interaction_num}"
+        print(f"Error: {what} failed ({type(error).__name__}: {error}).")
+        self.log.event("generation_failed", {"interaction": interaction_num,
+                                             "error": f"{type(error).__name__}: {error}"})
+        if interaction_num is not None:
+            self.failed_interactions.add(interaction_num)
+        if self.streaming_interaction is not None and self.streaming_interaction == interaction_num:
+            # The stream broke off: go back to the loading page for this rewrite.
+            self.streamed_text.pop(interaction_num, None)
+            self.streaming_interaction = None
+            self.selection_locked = False
+            self.awaiting_interaction = interaction_num
+            self.clear_frame()
+            self.start_loading_timer()
+            self.create_loading_page("Loading", "Please wait while we load your next paragraphs.")
+        if self.awaiting_interaction is not None and (interaction_num is None
+                                                      or self.awaiting_interaction == interaction_num):
+            self.show_generation_error()
+
+    def show_generation_error(self):
+        """Replace the loading animation with an error message and a "Try Again" button"""
+        if self.loading_animation is not None:
+            self.root.after_cancel(self.loading_animation)
+            self.loading_animation = None
+        self.loading_text_line1.configure(text="Sorry, something went wrong.")
+        self.loading_text_line2.configure(text="We could not load your paragraphs. Please try again, "
+                                               "or ask the researcher for help.")
+        self.pattern.configure(text='   ')
+        self.retry_button.pack(pady=(0, 20))
+
+    def click_retry(self):
+        """Retry the failed generation the loading page is waiting on"""
+        print(f"Retry clicked on page {self.current_page}.")
+        self.create_loading_page("Loading", "Please wait while we load your next paragraphs.")
+        if self.student_profile is None:
+            self.generate_profile()
+            return
+        interaction_nums = sorted((self.failed_interactions | {self.awaiting_interaction}) - {None})
+        self.failed_interactions.clear()
+        self.fetch_gpt_text(interaction_nums)
+
+    def on_rewrite_ready(self, interaction_num, generated_text):
+        """Store a finished rewrite and show it if its page is waiting on the loading page"""
+        self.generated_texts[interaction_num] = generated_text
+        self.checkpoint("generated_texts", "rewrite_orders", "rewrite_generations")
+        self.failed_interactions.discard(interaction_num)
+        if self.awaiting_interaction == interaction_num:
+            self.awaiting_interaction = None
+            self.update_gpt_interaction_page(*generated_text)
+        elif self.streaming_interaction == interaction_num:
+            # The stream is complete: replace the partial text with the final rewrite and unlock selection.
+            text_box = self.streaming_text_box()
+            text_box.configure(state='normal')
+            text_box.delete('1.0', tk.END)
+            text_box.insert(tk.END, generated_text[1] if text_box is self.right_text else generated_text[0])
+            text_box.configure(state='disabled')
+            self.text[self.current_page][1:] = [f"{generated_text[0]}", f"{generated_text[1]}"]
+            self.streaming_interaction = None
+            self.selection_locked = False
+            print(f"Rewrite for GPT interaction {interaction_num} finished streaming "
+                  f"({(timing.now() - self.startTime):.2f} s after the page was shown).")
 
     def update_gpt_interaction_page(self, gpt_paragraph1, gpt_paragraph2):
         # Calculate the time required to complete all GPT-4 interactions (profile generation & generate both test
         # session texts).
-        self.endTime = time.time()
+        self.endTime = timing.now()
         print(f"\n***\nTotal Loading Time: {self.endTime - self.startTime:.2f} s\n***\n")
+        if self.loading_span is not None:
+            self.loading_span.end()
+            self.loading_span = None
 
-        # Destroy the "loading" frame and update the page with GPT content
-        if hasattr(self, 'frame'):
-            self.frame.destroy()
+        # Remove the "loading" frame and update the page with GPT content
+        self.clear_frame()
 
         # Calculate the GPT interaction number
-        gpt_interaction_num = self.current_page - len(self.text) + self.num_gpt_interactions + 2
-        if gpt_interaction_num == 1:
-            title = "Topic 5: Plate Tectonics"
-        elif gpt_interaction_num == 2:
-            title = "Topic 6: Electricity"
+        gpt_interaction_num = self.gpt_interaction_num()
+        if gpt_interaction_num in self.topics:
+            topic = self.topic_catalog.get(self.topics[gpt_interaction_num])
+            title = f"Topic {self.num_training_pages() + gpt_interaction_num}: {topic.title}"
+            # Record the order the participant sees: 'first' if the generic rewrite is Paragraph 1.
+            order = 'first' if gpt_paragraph1 == topic.generic_rewrite else 'second'
+            generation = self.rewrite_generations.get(gpt_interaction_num)
+            print(f"Displayed order for GPT interaction {gpt_interaction_num}: {order} (generation {generation})")
+            self.log.event("rewrite_shown", {"interaction": gpt_interaction_num, "order": order,
+                                             "generation": generation})
         else:
             title = "Title not supplied / Out of Range"
 
@@ -729,24 +1415,22 @@ class GUI:
         self.text[self.current_page] = [f"GPT Interaction {gpt_interaction_num}", f"{gpt_paragraph1}",
                                         f"{gpt_paragraph2}"]
 
-        # Restart timer:
-        self.startTime = time.time()
-
-        # Call create_paragraph_page to build the layout
-        self.create_paragraph_page(title, gpt_paragraph1, gpt_paragraph2, radio_var, gpt_interaction_num)
+        # Call create_paragraph_page to build the layout (this restarts the timer)
+        with timing.span("render", "page", page=self.current_page):
+            self.create_paragraph_page(title, gpt_paragraph1, gpt_paragraph2, radio_var, gpt_interaction_num)
 
     def click_refresh(self, interaction_num):
         # Define common variables
         ttl = 'Confirm Refresh'
         msg = 'Refreshing generated response. OK?'
 
+        if self.selection_locked:
+            return  # Do not refresh while a rewrite is still streaming in.
         if interaction_num != -1:
             print(f"Refresh called on GPT interaction number {interaction_num}.")
             confirmation = messagebox.askokcancel(title=ttl,
                                                   message=msg)
-            if confirmation and interaction_num == 1:
-                self.create_page(interaction_num)
-            elif confirmation and interaction_num == 2:
+            if confirmation:
                 self.create_page(interaction_num)
             else:
                 # If "cancel" is clicked, then return to the page.
@@ -758,8 +1442,7 @@ class GUI:
                                                   message=msg)
             if confirmation:
                 # Destroy the previous frame if it exists
-                if hasattr(self, 'frame'):
-                    self.frame.destroy()
+                self.clear_frame()
                 self.create_close()
             else:
                 # If "cancel" is clicked, then return to the page.
@@ -769,8 +1452,7 @@ class GUI:
     # outputs and provide feedback.
     def break_screen(self):
         # Destroy the previous paragraph pair screen if it exists.
-        if hasattr(self, 'frame'):
-            self.frame.destroy()
+        self.clear_frame()
 
         # Display parameters:
         title = "Keep up the Great Work!"
@@ -794,7 +1476,7 @@ class GUI:
                                  font=('Open Sans', 20), height=10, wraplength=650)
 
         # Add an image
-        ctk_image = CTkImage(light_image=Image.open("Icons/welcome.png"), size=(500, 500))
+        ctk_image = self.icons.get(self.welcome_image_path, self.welcome_image_size)
         image_label = ctk.CTkLabel(master=header_frame, image=ctk_image, text='')
         image_label.pack(padx=0, pady=10)
         ctkTitle2.pack(padx=400, pady=(20, 0), anchor='s')
@@ -813,12 +1495,11 @@ class GUI:
         participantID.pack(padx=85, pady=10, side='bottom', anchor='w')
 
         # Start timer on break page.
-        self.startTime = time.time()
+        self.start_page_timer("break")
 
     def create_close(self):
         # Destroy the previous frame and update the page with GPT content
-        if hasattr(self, 'frame'):
-            self.frame.destroy()
+        self.clear_frame()
 
         # Display parameters
         title = "Which of the following two paragraphs best describes your learning preferences?"
@@ -966,7 +1647,7 @@ class GUI:
             self.right_profile_frame.configure(fg_color=selected_color)
 
         # When the user clicks a radio button, save their choice and print it
-        self.runtimes[self.current_page].append(time.time() - self.startTime)
+        self.runtimes[self.current_page].append(timing.now() - self.startTime)
         print(f"pg {self.current_page}   Option: {radio_var.get()}" +
               f"{self.runtimes[self.current_page][-1]:.2f} s")
         # Update "option_selected" to reflect that one of the two options has been selected.
@@ -982,8 +1663,7 @@ class GUI:
             self.exit_page(likert_rating, response_text)
 
     def exit_page(self, likert_rating, response_text):
-        if hasattr(self, 'frame'):
-            self.frame.destroy()
+        self.clear_frame()
 
         # Create a closing page similar to the welcome page
         self.frame = ctk.CTkFrame(self.root)
@@ -1003,7 +1683,7 @@ class GUI:
                                  font=('Open Sans', 20), height=10, wraplength=650)
 
         # Add an image
-        ctk_image = CTkImage(light_image=Image.open("Icons/welcome.png"), size=(500, 500))
+        ctk_image = self.icons.get(self.welcome_image_path, self.welcome_image_size)
         image_label = ctk.CTkLabel(master=header_frame, image=ctk_image, text='')
         image_label.pack(padx=0, pady=10)
         ctkTitle2.pack(padx=30, pady=0, anchor='s')
@@ -1027,8 +1707,14 @@ class GUI:
         print(f"\n\nQuit GUI called. Saving final outputs:\n*Profile Selection: {likert_rating}\n"
               f"Final Response Text: {response_text}\n\n*Recall: Profile selection = 1 is the left option, "
               f"= 2 is the right option.")
-        self.quitGUI = time.time()
+        self.quitGUI = timing.now()
         print(f"\n\n---\nTotal GUI Runtime (From Instructions Screen): {(self.quitGUI - self.startGUI):.8} s")
+        self.stop_page_timer()
+        self.page_span.end()
+        timing.export(self.session_filename + ".trace.json")  # Per-session trace (see timing.py)
+        self.log.event("session_end", {"profile_selection": likert_rating, "response_text": response_text})
+        self.state.shutdown()
+        self.log.close()  # Write out the rest of the log and restore stdout
         self.root.destroy()
 
     def __len__(self):
@@ -1037,7 +1723,13 @@ class GUI:
 
 
 if __name__ == "__main__":
-    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Learning Preference Survey")
+    parser.add_argument("--resume", metavar="SESSION_LOG", default=None,
+                        help="Continue the session in this .jsonl log (see session_checkpoint.py).")
+    args = parser.parse_args()
 
-    app = GUI()
+    with startup.phase("GUI setup"):
+        app = GUI(resume_path=args.resume)
     app.run()
@@ -0,0 +1,294 @@
+import argparse
+import csv
+import math
+import os
+import random
+
+import token_count
+import topic_catalog
+
+# Adaptive training session. In the study, the training session is the four paragraph pairs of input_paragraphs.csv,
+# shown in order. Each of them contrasts one dimension of the Felder-Silverman model (e.g. the water cycle pair has a
+# step-by-step "sequential" paragraph and a big-picture "global" one). In adaptive mode the pairs come from a larger
+# pool (paragraph_pool.csv), each tagged with the dimension it contrasts and the style of its first paragraph, and the
+# next pair is chosen after every choice:
+# - each dimension has a preference estimate: the probability that the participant prefers its first style (e.g.
+#   "active" for active-reflective). It starts at the dimension's prior (PRIOR, see PRIORS), and a choice moves it
+#   towards the style of the chosen paragraph, by how much depending on CONSISTENCY (how often a participant picks the
+#   paragraph written for the style they prefer);
+# - the next pair is the one whose choice is expected to tell the most about the participant (the largest expected
+#   reduction in the entropy of its dimension's estimate). Ties go to the topic shown the fewest times, then to the
+#   order of the pool (the study's four pairs, one per dimension, come first);
+# - a pair is only shown if its dimension is not settled (estimate at least CONFIDENCE either way) and its choice, with
+#   the pairs left after it (MAX_PAIRS in all, and the pool's unshown pairs of that dimension), can still change which
+#   style the dimension leans to. Training ends when no pair is left to show.
+# With the defaults, a session is never longer than the fixed flow's four pairs. Visual-verbal is settled by its prior
+# (0.82) and gets no pair; the other three dimensions get one pair each, and a choice that agrees with the prior settles
+# its dimension. If a choice goes against the prior, the dimension leans the other way at about 0.63, and the fourth
+# pair goes to the least certain such dimension. Sessions take 3 or 4 pairs, about 3.8 on average (see simulate),
+# and the PROFILER only receives the pairs that were shown. The saving depends on the prior: participants who differ
+# from it are more often classified wrong on the dimensions it settles. With GUI_ADAPTIVE_PRIOR=uniform (no prior),
+# every dimension needs its pair and sessions take the fixed flow's 4.
+#
+# Use it in the GUI:
+#   GUI_ADAPTIVE_POOL=paragraph_pool.csv python GUI.py
+# Simulate sessions to see how many pairs (and profile prompt tokens) they take:
+#   python adaptive_training.py simulate --sessions 1000 --consistency 0.8
+
+POOL_PATH = os.environ.get("GUI_ADAPTIVE_POOL")  # Pool for adaptive training in the GUI (None = the study's pairs).
+DEFAULT_POOL_PATH = "paragraph_pool.csv"
+MAX_PAIRS = int(os.environ.get("GUI_ADAPTIVE_MAX_PAIRS", "4"))
+CONFIDENCE = float(os.environ.get("GUI_ADAPTIVE_CONFIDENCE", "0.8"))
+CONSISTENCY = 0.75
+PRIOR = os.environ.get("GUI_ADAPTIVE_PRIOR", "population")  # A key of PRIORS
+
+# The Felder-Silverman dimensions, as (first style, second style).
+DIMENSIONS = {
+    "active-reflective": ("active", "reflective"),
+    "sensing-intuitive": ("sensing", "intuitive"),
+    "visual-verbal": ("visual", "verbal"),
+    "sequential-global": ("sequential", "global"),
+}
+
+# Starting estimates: {dimension: probability that a participant prefers its first style}. "population" is the share of
+# each first style in the Index of Learning Styles studies summarized by Felder and Spurlin (2005). Those participants
+# were mostly engineering students, so replace the numbers with the study's own once enough sessions exist.
+PRIORS = {
+    "population": {"active-reflective": 0.64, "sensing-intuitive": 0.63, "visual-verbal": 0.82,
+                   "sequential-global": 0.60},
+    "uniform": dict.fromkeys(DIMENSIONS, 0.5),
+}
+
+
+class AdaptiveTrainingError(Exception):
+    """Raised when a paragraph pool cannot be used (bad file, unknown topic or dimension, duplicate pair id)."""
+
+
+class Pair:
+    """One paragraph pair of the pool."""
+
+    def __init__(self, pair_id, topic_id, dimension, paragraph1_style, paragraph1, paragraph2):
+        self.id = pair_id
+        self.topic_id = topic_id
+        self.dimension = dimension
+        self.paragraph1_style = paragraph1_style
+        self.paragraph1 = paragraph1
+        self.paragraph2 = paragraph2
+
+    def style(self, selection):
+        '''The style of the chosen paragraph (selection 1 or 2)'''
+        first, second = DIMENSIONS[self.dimension]
+        paragraph2_style = second if self.paragraph1_style == first else first
+        return self.paragraph1_style if selection == 1 else paragraph2_style
+
+    def page(self, page_number, catalog):
+        '''The pair as a training page of self.text ([title, paragraph 1, paragraph 2])'''
+        return [f"Topic {page_number}: {catalog.get(self.topic_id).title}", self.paragraph1, self.paragraph2]
+
+
+def read_pool(path, catalog=None):
+    '''Return the pairs of a pool file, in file order'''
+    catalog = catalog or topic_catalog.get_catalog()
+    pairs = []
+    try:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                pairs.append(Pair(row["PairId"], row["TopicId"], row["Dimension"], row["Paragraph1Style"],
+                                  row["Paragraph1"], row["Paragraph2"]))
+    except (OSError, KeyError, csv.Error) as e:
+        raise AdaptiveTrainingError(f"{path} is not a valid paragraph pool: {e}")
+
+    seen = set()
+    for pair in pairs:
+        if pair.id in seen:
+            raise AdaptiveTrainingError(f"Pair '{pair.id}' appears twice in {path}.")
+        seen.add(pair.id)
+        if pair.dimension not in DIMENSIONS:
+            raise AdaptiveTrainingError(f"Pair '{pair.id}' in {path} has an unknown dimension '{pair.dimension}'.")
+        if pair.paragraph1_style not in DIMENSIONS[pair.dimension]:
+            raise AdaptiveTrainingError(f"Pair '{pair.id}' in {path}: '{pair.paragraph1_style}' is not a style of "
+                                        f"{pair.dimension}.")
+        try:
+            catalog.get(pair.topic_id)
+        except topic_catalog.TopicCatalogError as e:
+            raise AdaptiveTrainingError(f"Pair '{pair.id}' in {path}: {e}")
+    if not pairs:
+        raise AdaptiveTrainingError(f"{path} has no paragraph pairs.")
+    return pairs
+
+
+def entropy(probability):
+    '''Entropy (in bits) of a yes/no outcome with the given probability'''
+    if probability <= 0 or probability >= 1:
+        return 0.0
+    return -(probability * math.log2(probability) + (1 - probability) * math.log2(1 - probability))
+
+
+class AdaptiveTraining:
+    """Chooses the training pairs of a session from a pool."""
+
+    def __init__(self, path=DEFAULT_POOL_PATH, max_pairs=MAX_PAIRS, confidence=CONFIDENCE, consistency=CONSISTENCY,
+                 prior=PRIOR, catalog=None):
+        self.path = path
+        self.catalog = catalog or topic_catalog.get_catalog()
+        self.pairs = read_pool(path, self.catalog)
+        self.pairs_by_id = {pair.id: pair for pair in self.pairs}
+        self.max_pairs = max_pairs
+        self.confidence = confidence
+        self.consistency = consistency
+        try:
+            self.priors = PRIORS[prior]
+        except KeyError:
+            raise AdaptiveTrainingError(f"Unknown prior '{prior}' (expected one of {', '.join(PRIORS)}).")
+        if self.next_pair([], []) is None:
+            raise AdaptiveTrainingError(f"Every dimension is settled by the '{prior}' prior at confidence "
+                                        f"{confidence}, so no training pair would be shown.")
+
+    def pair(self, pair_id):
+        try:
+            return self.pairs_by_id[pair_id]
+        except KeyError:
+            raise AdaptiveTrainingError(f"Unknown pair '{pair_id}' (not in {self.path}).")
+
+    def icons(self):
+        '''The icons of every topic in the pool, in pool order'''
+        return list(dict.fromkeys(self.catalog.get(pair.topic_id).icon for pair in self.pairs))
+
+    def step(self):
+        '''How far one choice moves a dimension's log-odds'''
+        return math.log(self.consistency / (1 - self.consistency))
+
+    def log_odds(self, pair_ids, selections):
+        '''{dimension: log-odds that the participant prefers its first style}, after the given choices'''
+        log_odds = {dimension: math.log(prior / (1 - prior)) for dimension, prior in self.priors.items()}
+        for pair_id, selection in zip(pair_ids, selections):
+            pair = self.pair(pair_id)
+            if pair.style(selection) == DIMENSIONS[pair.dimension][0]:
+                log_odds[pair.dimension] += self.step()
+            else:
+                log_odds[pair.dimension] -= self.step()
+        return log_odds
+
+    def estimates(self, pair_ids, selections):
+        '''{dimension: probability that the participant prefers its first style}, after the given choices'''
+        return {dimension: 1 / (1 + math.exp(-value))
+                for dimension, value in self.log_odds(pair_ids, selections).items()}
+
+    def is_confident(self, probability):
+        return max(probability, 1 - probability) >= self.confidence - 1e-9
+
+    def expected_information(self, probability):
+        '''Expected entropy reduction (in bits) of a dimension's estimate from one more choice on that dimension'''
+        q = self.consistency
+        first = probability * q + (1 - probability) * (1 - q)  # Chance that the first style's paragraph is chosen
+        after_first = probability * q / first
+        after_second = probability * (1 - q) / (1 - first)
+        return entropy(probability) - first * entropy(after_first) - (1 - first) * entropy(after_second)
+
+    def next_pair(self, pair_ids, selections):
+        '''The pair to show after the given pairs and choices, or None if training is complete'''
+        if len(pair_ids) >= self.max_pairs:
+            return None
+        log_odds = self.log_odds(pair_ids, selections)
+        estimates = self.estimates(pair_ids, selections)
+        shown = set(pair_ids)
+        topic_counts = {}
+        for pair_id in pair_ids:
+            topic_id = self.pair(pair_id).topic_id
+            topic_counts[topic_id] = topic_counts.get(topic_id, 0) + 1
+        # Pairs that can still be shown on each dimension. A dimension's lean can only change (or a tie be decided) if
+        # that many choices against it move its log-odds past zero.
+        left = dict.fromkeys(DIMENSIONS, 0)
+        for pair in self.pairs:
+            if pair.id not in shown:
+                left[pair.dimension] += 1
+
+        best, best_key = None, None
+        for index, pair in enumerate(self.pairs):
+            if pair.id in shown or self.is_confident(estimates[pair.dimension]):
+                continue
+            reach = min(self.max_pairs - len(pair_ids), left[pair.dimension]) * self.step()
+            if abs(log_odds[pair.dimension]) >= reach - 1e-9:
+                continue
+            key = (round(self.expected_information(estimates[pair.dimension]), 9),
+                   -topic_counts.get(pair.topic_id, 0), -index)
+            if best_key is None or key > best_key:
+                best, best_key = pair, key
+        return best
+
+    def describe(self, estimates):
+        '''The estimates as text for the transcript, e.g. "sequential 0.75, visual 0.50, ..."'''
+        parts = []
+        for dimension, probability in estimates.items():
+            first, second = DIMENSIONS[dimension]
+            parts.append(f"{first} {probability:.2f}" if probability >= 0.5 else f"{second} {1 - probability:.2f}")
+        return ", ".join(parts)
+
+
+def simulate(training, sessions, consistency, rng, population):
+    '''Run simulated participants (each with a preferred style per dimension, the first one with the probability in
+    population, who pick the paragraph of that style with probability consistency). Returns the number of pairs of
+    each session and the fraction of dimensions whose final estimate leans the right way.'''
+    lengths = []
+    correct = 0
+    for _ in range(sessions):
+        preferred = {dimension: styles[0] if rng.random() < population[dimension] else styles[1]
+                     for dimension, styles in DIMENSIONS.items()}
+        pair_ids, selections = [], []
+        pair = training.next_pair(pair_ids, selections)
+        while pair is not None:
+            matches = rng.random() < consistency
+            paragraph1_preferred = pair.paragraph1_style == preferred[pair.dimension]
+            pair_ids.append(pair.id)
+            selections.append(1 if matches == paragraph1_preferred else 2)
+            pair = training.next_pair(pair_ids, selections)
+        lengths.append(len(pair_ids))
+        for dimension, probability in training.estimates(pair_ids, selections).items():
+            leaning = DIMENSIONS[dimension][0] if probability > 0.5 else DIMENSIONS[dimension][1]
+            correct += probability != 0.5 and leaning == preferred[dimension]
+    return lengths, correct / (sessions * len(DIMENSIONS))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List a paragraph pool or simulate adaptive training sessions.")
+    parser.add_argument("command", choices=["list", "simulate"])
+    parser.add_argument("--pool", default=POOL_PATH or DEFAULT_POOL_PATH)
+    parser.add_argument("--sessions", type=int, default=1000, help="Simulated sessions")
+    parser.add_argument("--consistency", type=float, default=CONSISTENCY,
+                        help="How often the simulated participants pick the paragraph of their preferred style")
+    parser.add_argument("--max-pairs", type=int, default=MAX_PAIRS)
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    parser.add_argument("--prior", choices=list(PRIORS), default=PRIOR)
+    parser.add_argument("--population", choices=list(PRIORS), default="population",
+                        help="How the simulated participants' preferred styles are drawn")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    training = AdaptiveTraining(args.pool, max_pairs=args.max_pairs, confidence=args.confidence, prior=args.prior)
+    if args.command == "list":
+        for pair in training.pairs:
+            first, second = pair.paragraph1_style, pair.style(2)
+            print(f"{pair.id:<36} {pair.dimension:<18} Paragraph 1: {first:<11} Paragraph 2: {second}")
+    else:
+        population = PRIORS[args.population]
+        lengths, accuracy = simulate(training, args.sessions, args.consistency, random.Random(args.seed), population)
+        # The fixed flow: the study's pairs (first in the pool, one per dimension, each read on its own), with the same
+        # participants.
+        study_pairs = len(DIMENSIONS)
+        study = AdaptiveTraining(args.pool, max_pairs=study_pairs, confidence=1, prior="uniform")
+        _, study_accuracy = simulate(study, args.sessions, args.consistency, random.Random(args.seed), population)
+        # Prompt tokens of one pair as listed for the PROFILER, averaged over the pool.
+        pair_tokens = sum(token_count.count_tokens(f"{pair.paragraph1}\n\n{pair.paragraph2}")
+                          for pair in training.pairs) / len(training.pairs)
+        mean = sum(lengths) / len(lengths)
+        print(f"{args.sessions} simulated sessions (consistency {args.consistency}, {args.population} participants, "
+              f"{args.prior} prior), pool of {len(training.pairs)} pairs:")
+        for count in sorted(set(lengths)):
+            print(f"  {count} pairs: {lengths.count(count) / len(lengths):.1%} of sessions")
+        print(f"Fixed flow:  {study_pairs} pairs (about {study_pairs * pair_tokens:.0f} paragraph tokens in the "
+              f"profile prompt), dimensions leaning the right way {study_accuracy:.1%}")
+        print(f"Adaptive:    {mean:.2f} pairs on average, at most {max(lengths)} "
+              f"({mean / study_pairs - 1:+.0%} pairs and paragraph tokens, about {mean * pair_tokens:.0f}), "
+              f"dimensions leaning the right way {accuracy:.1%}")
+        print(f"Whole pool:  {len(training.pairs)} pairs (about {len(training.pairs) * pair_tokens:.0f} paragraph "
+              f"tokens)")
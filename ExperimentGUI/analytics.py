@@ -0,0 +1,395 @@
+import argparse
+import glob
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Offline analytics for a study: parses the session transcripts (the .txt files the GUI writes) into typed records and
+# stores them as a columnar dataset, then prints summary statistics.
+#
+#   python analytics.py sessions/ -o study.npz            # Parse every transcript in sessions/ and summarize
+#   python analytics.py "data/*/*.txt" -o study.npz --workers 8
+#   python analytics.py study.npz                         # Summarize a dataset parsed earlier
+#
+# Transcripts are parsed in parallel worker processes, one file at a time and line by line, so hundreds of sessions
+# are handled without loading them all at once. Files that are not session transcripts (e.g. batch_runner logs) are
+# skipped. Transcripts from before the session log existed parse the same way: only the printed lines are used.
+#
+# The dataset has two tables, stored as NumPy arrays in one .npz file ("sessions.<column>" and "pages.<column>", read
+# them with np.load). With --parquet, each table is also written as a Parquet file (needs pyarrow).
+#   sessions: one row per transcript (file, participant_id, group, start_time, runtime, profile_run_time,
+#             profile_dwell (time on the closing page), actual_profile_position, profile_selection,
+#             chose_actual_profile, complete, refreshes, retries, resumes)
+#   pages:    one row per training and test page the participant submitted (session = row in sessions, page, test,
+#             dwell, first_select, selects, choice, load_time, custom_position, chose_custom)
+# Times are in seconds (NaN when not recorded). Positions and choices are 1 (left, Paragraph/Option 1), 2 (right), or 0
+# (unknown). chose_custom and chose_actual_profile are 1, 0, or -1 (unknown).
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+CHUNK_SIZE = 8  # Transcripts handed to a worker at a time
+
+SESSION_COLUMNS = {"file": str, "participant_id": str, "group": str, "start_time": float, "runtime": float,
+                   "profile_run_time": float, "profile_dwell": float, "actual_profile_position": int,
+                   "profile_selection": int, "complete": bool, "refreshes": int, "retries": int, "resumes": int}
+PAGE_COLUMNS = {"session": int, "page": int, "test": bool, "dwell": float, "first_select": float, "selects": int,
+                "choice": int, "load_time": float, "custom_position": int}
+NUMPY_TYPES = {str: str, float: np.float64, int: np.int32, bool: np.bool_}
+
+# Lines of the transcript (see GUI.py)
+PARTICIPANT = re.compile(r"^Participant ID: (.*)$")
+GROUP = re.compile(r"^Group: (\w+)")
+START_TIME = re.compile(r"^GUI Start time: ([\d.]+)")
+OPTION_SELECT = re.compile(r"^pg (\d+)\s+Option Select: (\d)\s+([\d.]+) s")
+FINAL_CHOICE = re.compile(r"^pg (\d+)\s+Final choice: Option (\d)")
+# The closing page prints the choice and the time with no space between them, e.g. "pg 7   Option: 10.72 s"
+PROFILE_OPTION = re.compile(r"^pg (\d+)\s+Option: (\d)([\d.]+) s")
+CONTINUE = re.compile(r"^pg (\d+)\s+Continue\s+([\d.]+) s")
+CHOICE_LIST = re.compile(r"^Choice List = \[(.*)\]")
+LOADING_TIME = re.compile(r"^Total Loading Time: ([\d.]+) s")
+REWRITTEN = re.compile(r"^Rewritten Paragraph for GPT interaction (\d+)")
+REWRITE_ORDER = re.compile(r"^(first|second)\s+--->")
+DISPLAYED_ORDER = re.compile(r"^Displayed order for GPT interaction (\d+): (first|second)")
+PROFILER_RUN_TIME = re.compile(r"^Profiler Run Time: ([\d.]+) s")
+PROFILE_ORDER = re.compile(r"^(left|right) --- ")
+PROFILE_SELECTION = re.compile(r"^\*Profile Selection: (\d)")
+RUNTIME = re.compile(r"^Total GUI Runtime \(From Instructions Screen\): ([\d.e+-]+) s")
+
+
+def parse_transcript(path):
+    '''Parse one transcript. Returns (session, pages) as dicts of column values, or None if it is not a session
+    transcript.'''
+    nan = float("nan")
+    session = {"file": os.path.basename(path), "participant_id": "", "group": "", "start_time": nan, "runtime": nan,
+               "profile_run_time": nan, "profile_dwell": nan, "actual_profile_position": 0, "profile_selection": 0,
+               "complete": False, "refreshes": 0, "retries": 0, "resumes": 0}
+    pages = {}  # page number -> page record
+    num_training = None
+    pending_load_time = nan  # Loading time of the page about to be shown
+    # GPT interaction number -> 'first' (generic first) or 'second'. The order of the page the participant saw is
+    # printed when the page is shown; transcripts from before that only have the order of each generated rewrite, and
+    # the last one printed is used (which may belong to a superseded or speculative request).
+    displayed_orders = {}
+    rewrite_orders = {}
+    last_rewrite = None
+
+    def page(number):
+        if number not in pages:
+            pages[number] = {"page": number, "dwell": nan, "first_select": nan, "selects": 0, "choice": 0,
+                             "load_time": pending_load_time, "custom_position": 0}
+        return pages[number]
+
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        first_line = f.readline()
+        match = PARTICIPANT.match(first_line.strip())
+        if match is None:
+            return None
+        session["participant_id"] = match.group(1)
+
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("pg "):
+                match = OPTION_SELECT.match(line)
+                if match:
+                    record = page(int(match.group(1)))
+                    if record["selects"] == 0:
+                        record["first_select"] = float(match.group(3))
+                    record["selects"] += 1
+                    record["choice"] = int(match.group(2))
+                    continue
+                match = FINAL_CHOICE.match(line)
+                if match:
+                    page(int(match.group(1)))["choice"] = int(match.group(2))
+                    continue
+                match = CONTINUE.match(line)
+                if match:
+                    number = int(match.group(1))
+                    record = page(number)
+                    record["dwell"] = float(match.group(2))
+                    if num_training is not None and number > num_training:
+                        order = displayed_orders.get(number - num_training, rewrite_orders.get(number - num_training))
+                        if order is not None:
+                            # The generic rewrite first means the customized rewrite is Paragraph 2.
+                            record["custom_position"] = 2 if order == 'first' else 1
+                    pending_load_time = nan
+                    continue
+                match = PROFILE_OPTION.match(line)
+                if match:
+                    session["profile_dwell"] = float(match.group(3))
+                continue
+
+            match = LOADING_TIME.match(line)
+            if match:
+                pending_load_time = float(match.group(1))
+                continue
+            match = DISPLAYED_ORDER.match(line)
+            if match:
+                displayed_orders[int(match.group(1))] = match.group(2)
+                continue
+            match = REWRITTEN.match(line)
+            if match:
+                last_rewrite = int(match.group(1))
+                continue
+            match = REWRITE_ORDER.match(line)
+            if match and last_rewrite is not None:
+                rewrite_orders[last_rewrite] = match.group(1)
+                last_rewrite = None
+                continue
+            match = CHOICE_LIST.match(line)
+            if match and num_training is None:
+                num_training = match.group(1).count("Paragraph")
+                continue
+            match = GROUP.match(line)
+            if match:
+                session["group"] = match.group(1)
+                continue
+            match = START_TIME.match(line)
+            if match:
+                session["start_time"] = float(match.group(1))
+                continue
+            match = PROFILER_RUN_TIME.match(line)
+            if match:
+                if session["profile_run_time"] != session["profile_run_time"]:  # NaN: keep the first profile's time
+                    session["profile_run_time"] = float(match.group(1))
+                continue
+            match = PROFILE_ORDER.match(line)
+            if match:
+                session["actual_profile_position"] = 1 if match.group(1) == 'left' else 2
+                continue
+            match = PROFILE_SELECTION.match(line)
+            if match:
+                session["profile_selection"] = int(match.group(1))
+                continue
+            match = RUNTIME.match(line)
+            if match:
+                session["runtime"] = float(match.group(1))
+                session["complete"] = True
+                continue
+            if line.startswith("Refresh called"):
+                session["refreshes"] += 1
+            elif line.startswith("Retry clicked"):
+                session["retries"] += 1
+            elif line.startswith("Session resumed"):
+                session["resumes"] += 1
+
+    # Only pages the participant submitted (the closing page has its own columns in the sessions table).
+    submitted = [record for number, record in sorted(pages.items()) if record["dwell"] == record["dwell"]]
+    if num_training is None:
+        # The session stopped before the profile was requested: every submitted page was a training page.
+        num_training = max([record["page"] for record in submitted], default=0)
+    for record in submitted:
+        record["test"] = record["page"] > num_training
+    return session, submitted
+
+
+class Table:
+    """Columns of one table, collected row by row and converted to NumPy arrays at the end."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.values = {name: [] for name in columns}
+
+    def append(self, row):
+        for name in self.columns:
+            self.values[name].append(row[name])
+
+    def arrays(self):
+        return {name: np.array(self.values[name], dtype=NUMPY_TYPES[kind]) for name, kind in self.columns.items()}
+
+
+def transcript_paths(inputs):
+    '''The .txt files named by the inputs (files, directories, or glob patterns)'''
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(glob.glob(os.path.join(item, "**", "*.txt"), recursive=True)))
+        elif any(c in item for c in "*?["):
+            paths.extend(sorted(glob.glob(item, recursive=True)))
+        else:
+            paths.append(item)
+    return paths
+
+
+def build_dataset(paths, workers=DEFAULT_WORKERS):
+    '''Parse transcripts in worker processes. Returns (sessions, pages, skipped) where sessions and pages are dicts of
+    column arrays (see the top of this file).'''
+    sessions = Table(SESSION_COLUMNS)
+    pages = Table(PAGE_COLUMNS)
+    skipped = []
+    if workers > 1 and len(paths) > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(parse_transcript, paths, chunksize=CHUNK_SIZE)
+    else:
+        executor = None
+        results = map(parse_transcript, paths)
+    try:
+        for path, result in zip(paths, results):
+            if result is None:
+                skipped.append(path)
+                continue
+            session, session_pages = result
+            index = len(sessions.values["file"])
+            sessions.append(session)
+            for record in session_pages:
+                record["session"] = index
+                pages.append(record)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    sessions, pages = sessions.arrays(), pages.arrays()
+    add_derived_columns(sessions, pages)
+    return sessions, pages, skipped
+
+
+def add_derived_columns(sessions, pages):
+    '''Whether the participant chose the customized rewrite and the actual profile (1, 0, or -1 if unknown)'''
+    known = (pages["custom_position"] > 0) & (pages["choice"] > 0)
+    pages["chose_custom"] = np.where(known, (pages["choice"] == pages["custom_position"]).astype(np.int32), -1)
+    known = (sessions["actual_profile_position"] > 0) & (sessions["profile_selection"] > 0)
+    sessions["chose_actual_profile"] = np.where(
+        known, (sessions["profile_selection"] == sessions["actual_profile_position"]).astype(np.int32), -1)
+
+
+def save_dataset(path, sessions, pages):
+    arrays = {f"sessions.{name}": values for name, values in sessions.items()}
+    arrays.update({f"pages.{name}": values for name, values in pages.items()})
+    np.savez_compressed(path, **arrays)
+
+
+def load_dataset(path):
+    sessions = {}
+    pages = {}
+    with np.load(path, allow_pickle=False) as data:
+        for key in data.files:
+            table, name = key.split(".", 1)
+            (sessions if table == "sessions" else pages)[name] = data[key]
+    return sessions, pages
+
+
+def save_parquet(path, sessions, pages):
+    '''Write each table as a Parquet file next to path (<stem>.sessions.parquet and <stem>.pages.parquet)'''
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise SystemExit("--parquet needs the pyarrow package (pip install pyarrow).")
+    stem = os.path.splitext(path)[0]
+    written = []
+    for name, table in (("sessions", sessions), ("pages", pages)):
+        table_path = f"{stem}.{name}.parquet"
+        pyarrow.parquet.write_table(pyarrow.table(table), table_path)
+        written.append(table_path)
+    return written
+
+
+def describe(values):
+    '''n, mean, median, 90th percentile, and max of the non-NaN values'''
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return {"n": 0, "mean": np.nan, "median": np.nan, "p90": np.nan, "max": np.nan}
+    return {"n": len(values), "mean": values.mean(), "median": np.median(values), "p90": np.percentile(values, 90),
+            "max": values.max()}
+
+
+def rate(flags):
+    '''Fraction of the known (>= 0) values that are 1, and how many are known'''
+    known = flags[flags >= 0]
+    return (known.mean() if len(known) else np.nan), len(known)
+
+
+def summarize(sessions, pages):
+    '''Summary statistics of a dataset, as a dict'''
+    summary = {"sessions": len(sessions["file"]), "complete": int(sessions["complete"].sum())}
+
+    # Dwell time and choice rate of every page number (grouped with one sort instead of a loop over the rows).
+    page_numbers, inverse = np.unique(pages["page"], return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(page_numbers))
+    first = np.bincount(inverse, weights=pages["choice"] == 1, minlength=len(page_numbers))
+    chosen = np.bincount(inverse, weights=pages["choice"] > 0, minlength=len(page_numbers))
+    order = np.argsort(inverse, kind="stable")
+    dwell_by_page = np.split(pages["dwell"][order], np.cumsum(counts)[:-1])
+    test_by_page = np.bincount(inverse, weights=pages["test"], minlength=len(page_numbers)) > counts / 2
+    summary["pages"] = [{"page": int(number), "test": bool(test), "dwell": describe(dwell),
+                         "paragraph_1_rate": first[i] / chosen[i] if chosen[i] else np.nan}
+                        for i, (number, test, dwell) in enumerate(zip(page_numbers, test_by_page, dwell_by_page))]
+
+    # Load time of the test pages (the first test page includes the profile, unless it was generated speculatively).
+    test = pages["test"]
+    first_page = np.full(len(sessions["file"]), np.iinfo(np.int32).max, dtype=np.int32)
+    np.minimum.at(first_page, pages["session"][test], pages["page"][test])
+    first_test = test & (pages["page"] == first_page[pages["session"]])
+    summary["load_time"] = {"first_test_page": describe(pages["load_time"][first_test]),
+                            "later_test_pages": describe(pages["load_time"][test & ~first_test])}
+    summary["profile_run_time"] = describe(sessions["profile_run_time"])
+    summary["profile_dwell"] = describe(sessions["profile_dwell"])
+
+    # Choice rates by group.
+    groups = {}
+    page_groups = sessions["group"][pages["session"]] if len(pages["session"]) else np.array([], dtype=str)
+    for group in np.unique(sessions["group"]):
+        custom_rate, custom_n = rate(pages["chose_custom"][test & (page_groups == group)])
+        actual_rate, actual_n = rate(sessions["chose_actual_profile"][sessions["group"] == group])
+        groups[str(group) or "(none)"] = {"sessions": int((sessions["group"] == group).sum()),
+                                          "custom_rewrite_rate": custom_rate, "custom_rewrite_n": custom_n,
+                                          "actual_profile_rate": actual_rate, "actual_profile_n": actual_n}
+    summary["groups"] = groups
+    return summary
+
+
+def print_summary(summary):
+    def seconds(stats):
+        if not stats["n"]:
+            return "-"
+        return (f"n {stats['n']}, mean {stats['mean']:.2f} s, median {stats['median']:.2f} s, "
+                f"p90 {stats['p90']:.2f} s, max {stats['max']:.2f} s")
+
+    def fraction(value):
+        return "-" if value != value else f"{value:.0%}"
+
+    print(f"Sessions: {summary['sessions']} ({summary['complete']} complete)\n")
+    print("Dwell time by page:")
+    for page in summary["pages"]:
+        kind = "test" if page["test"] else "training"
+        print(f"  pg {page['page']:<3} {kind:<9} {seconds(page['dwell'])}, "
+              f"Paragraph 1 chosen {fraction(page['paragraph_1_rate'])}")
+    print(f"\nLoad time, first test page: {seconds(summary['load_time']['first_test_page'])}")
+    print(f"Load time, later test pages: {seconds(summary['load_time']['later_test_pages'])}")
+    print(f"Profiler run time: {seconds(summary['profile_run_time'])}")
+    print(f"Time on the closing page: {seconds(summary['profile_dwell'])}")
+    print("\nBy group:")
+    for group, stats in summary["groups"].items():
+        print(f"  {group:<13} {stats['sessions']} sessions, customized rewrite chosen "
+              f"{fraction(stats['custom_rewrite_rate'])} of {stats['custom_rewrite_n']} test pages, actual profile "
+              f"chosen {fraction(stats['actual_profile_rate'])} of {stats['actual_profile_n']} sessions")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parse session transcripts into a columnar dataset and summarize it.")
+    parser.add_argument("inputs", nargs="+", help="Transcripts, directories of transcripts, glob patterns, or one .npz "
+                                                  "dataset to summarize.")
+    parser.add_argument("-o", "--output", default=None, help="Write the dataset to this .npz file.")
+    parser.add_argument("--parquet", action="store_true", help="Also write the tables as Parquet files.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Parser processes.")
+    args = parser.parse_args()
+
+    if len(args.inputs) == 1 and args.inputs[0].endswith(".npz"):
+        sessions, pages = load_dataset(args.inputs[0])
+    else:
+        paths = transcript_paths(args.inputs)
+        sessions, pages, skipped = build_dataset(paths, args.workers)
+        print(f"Parsed {len(sessions['file'])} transcripts ({len(pages['page'])} pages) from {len(paths)} files"
+              + (f", skipped {len(skipped)} that are not session transcripts" if skipped else "") + ".")
+        if args.output:
+            save_dataset(args.output, sessions, pages)
+            print(f"Wrote {args.output}")
+            if args.parquet:
+                print("Wrote " + ", ".join(save_parquet(args.output, sessions, pages)))
+        print()
+    if not len(sessions["file"]):
+        sys.exit("No sessions to summarize.")
+    print_summary(summarize(sessions, pages))
@@ -0,0 +1,209 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai_interact_profile
+import openai_interact_rewrite
+import paragraph_csv
+import request_scheduler
+import timing
+from event_log import EventLog
+
+# Headless batch runner: generates the student profiles and test session rewrites for many simulated participants
+# without the GUI, e.g. to pre-generate and audit the materials for every possible training session.
+#
+#   python batch_runner.py --all-patterns -o batch.jsonl
+#   python batch_runner.py choices.jsonl -o batch.jsonl --workers 4 --max-concurrent 8 --requests-per-minute 60
+#
+# Input: one choice vector per line, either a JSON object
+#   {"id": "P01", "selections": [1, 2, 2, 1], "group": "Control"}
+# a JSON list ([1, 2, 2, 1]), or a bare string of choices ("1221" or "1 2 2 1"). 1 = Paragraph 1, 2 = Paragraph 2.
+# --all-patterns generates all 2^n selection patterns over the n paragraph pairs in input_paragraphs.csv instead.
+#
+# Output: one JSON line per participant, written as soon as that participant is done. The output file is also the
+# checkpoint: running the same command again skips every participant that already has a successful record, so an
+# interrupted run (or one with failed participants) can simply be restarted. Everything the PROFILER and REWRITE
+# modules print goes to <output>.log.jsonl / <output>.log.txt (see event_log.py) instead of the console.
+#
+# Concurrency: --workers participants are processed at the same time, and each participant's rewrites are requested in
+# parallel. Across all of them, at most --max-concurrent requests are in flight and requests are started no faster than
+# --requests-per-minute. Retries and deadlines are handled by the shared request scheduler (see request_scheduler.py),
+# so a rate-limit error slows down every worker, not just the one that received it.
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_CONCURRENT = 8
+DEFAULT_REQUESTS_PER_MINUTE = 60
+
+
+def load_paragraph_pairs(path="input_paragraphs.csv"):
+    '''Return the training session paragraph pairs as they appear in the PROFILER prompt'''
+    return [openai_interact_profile.paragraph_pair_text(*page)
+            for _, page in sorted(paragraph_csv.read_paragraph_pages(path).items())]
+
+
+def all_patterns(num_pairs):
+    '''Every possible list of training selections (1 or 2 for each pair)'''
+    return [list(pattern) for pattern in itertools.product([1, 2], repeat=num_pairs)]
+
+
+def parse_choice_vector(line, line_num, default_group):
+    line = line.strip()
+    if line.startswith("{") or line.startswith("["):
+        entry = json.loads(line)
+    else:
+        entry = [int(c) for c in line.replace(",", " ").split()] if " " in line or "," in line \
+            else [int(c) for c in line]
+    if isinstance(entry, list):
+        entry = {"selections": entry}
+    entry.setdefault("id", f"line-{line_num}")
+    entry.setdefault("group", default_group)
+    return entry
+
+
+def load_choice_vectors(path, default_group):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [parse_choice_vector(line, i, default_group) for i, line in enumerate(f, start=1) if line.strip()]
+
+
+def pattern_participants(num_pairs, groups):
+    return [{"id": f"{''.join(map(str, pattern))}-{group}", "selections": pattern, "group": group}
+            for group in groups for pattern in all_patterns(num_pairs)]
+
+
+def completed_ids(output_path):
+    '''Return the ids of the participants that already have a successful record in the output file'''
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut short by an interrupted run. That participant is run again.
+            if record.get("error") is None:
+                done.add(record["id"])
+    return done
+
+
+def run_participant(participant, paragraph_pairs, interaction_nums, seed=None):
+    '''Generate the profiles and rewrites for one simulated participant. Returns the output record.'''
+    selections = [int(s) for s in participant["selections"]]
+    if len(selections) != len(paragraph_pairs) or any(s not in (1, 2) for s in selections):
+        raise ValueError(f"Selections {selections} do not match the {len(paragraph_pairs)} paragraph pairs.")
+    notSelections = [3 - s for s in selections]
+    group = participant["group"]
+    if group not in ("Experimental", "Control"):
+        raise ValueError("Invalid experiment version. Must be either 'Experimental' or Control'.")
+
+    span = timing.begin("participant", "batch", id=participant["id"])
+    profile, profile_opposite = openai_interact_profile.get_student_profile(selections, notSelections,
+                                                                           paragraph_pairs)
+    profile_time = span.elapsed()
+
+    # Experimental group rewrites use the actual profile, the Control group uses the opposite profile.
+    rewrite_profile = profile if group == "Experimental" else profile_opposite
+    rng = random.Random(f"{seed}-{participant['id']}") if seed is not None else random
+    orders = {interaction_num: rng.choice(['first', 'second']) for interaction_num in interaction_nums}
+    rewrites = {}
+    for interaction_num, future in openai_interact_rewrite.get_gpt_responses(rewrite_profile, interaction_nums,
+                                                                             choices=orders):
+        paragraph1, paragraph2 = future.result()
+        rewrites[str(interaction_num)] = {
+            "order": orders[interaction_num],
+            "paragraph1": paragraph1,
+            "paragraph2": paragraph2,
+            "customized": paragraph2 if orders[interaction_num] == 'first' else paragraph1,
+        }
+
+    return {"id": participant["id"], "group": group, "selections": selections, "notSelections": notSelections,
+            "profile": profile, "profile_opposite": profile_opposite,
+            "rewrites": {key: rewrites[key] for key in sorted(rewrites, key=int)},
+            "profile_time": round(profile_time, 3), "run_time": round(span.end(), 3), "error": None}
+
+
+def run_batch(participants, output_path, paragraph_pairs, interaction_nums, workers=DEFAULT_WORKERS, seed=None,
+              progress=None):
+    """Run every participant that is not already in output_path, appending one record per participant as each
+    finishes. Returns (succeeded, failed) counts."""
+    done = completed_ids(output_path)
+    pending = [p for p in participants if p["id"] not in done]
+    progress = progress or sys.stdout
+    progress.write(f"{len(participants)} participants, {len(participants) - len(pending)} already done, "
+                   f"{len(pending)} to run.\n")
+
+    succeeded = failed = 0
+    write_lock = threading.Lock()
+    with open(output_path, 'a', encoding='utf-8') as out, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_participant, p, paragraph_pairs, interaction_nums, seed): p for p in pending}
+        for future in as_completed(futures):
+            participant = futures[future]
+            try:
+                record = future.result()
+                succeeded += 1
+            except Exception as e:
+                record = {"id": participant["id"], "group": participant.get("group"),
+                          "selections": participant.get("selections"), "error": f"{type(e).__name__}: {e}"}
+                failed += 1
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+            progress.write(f"[{succeeded + failed}/{len(pending)}] {participant['id']}: "
+                           f"{'failed - ' + record['error'] if record['error'] else 'done'}\n")
+    return succeeded, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate profiles and rewrites for many simulated participants.")
+    parser.add_argument("choices", nargs="?", help="File of choice vectors (one per line).")
+    parser.add_argument("-o", "--output", default="batch_output.jsonl", help="JSONL output (and checkpoint) file.")
+    parser.add_argument("--all-patterns", action="store_true",
+                        help="Run every possible selection pattern instead of a choices file.")
+    parser.add_argument("--group", choices=["Experimental", "Control", "both"], default="Experimental",
+                        help="Group for choice vectors that do not give one (and for --all-patterns).")
+    parser.add_argument("--paragraphs", default="input_paragraphs.csv")
+    parser.add_argument("--interactions", default=None,
+                        help="Comma-separated test session topics to rewrite (default: all of them).")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Participants run at the same time.")
+    parser.add_argument("--max-concurrent", type=int, default=DEFAULT_MAX_CONCURRENT,
+                        help="Requests in flight at the same time, across all participants.")
+    parser.add_argument("--requests-per-minute", type=float, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help="Maximum request rate (0 for no limit).")
+    parser.add_argument("--seed", default=None, help="Seed for the presentation order of the rewrites.")
+    parser.add_argument("--trace", action="store_true", help="Also write <output>.trace.json (see timing.py).")
+    args = parser.parse_args()
+
+    if not args.choices and not args.all_patterns:
+        parser.error("Give a choices file or --all-patterns.")
+
+    paragraph_pairs = load_paragraph_pairs(args.paragraphs)
+    groups = ["Experimental", "Control"] if args.group == "both" else [args.group]
+    if args.all_patterns:
+        participants = pattern_participants(len(paragraph_pairs), groups)
+    else:
+        participants = load_choice_vectors(args.choices, groups[0])
+    if args.interactions:
+        interaction_nums = [int(n) for n in args.interactions.split(",")]
+    else:
+        interaction_nums = list(range(1, openai_interact_rewrite.num_topics() + 1))
+
+    request_scheduler.get_scheduler().configure(requests_per_minute=args.requests_per_minute,
+                                                max_concurrent=args.max_concurrent)
+
+    base = os.path.splitext(args.output)[0]
+    log = EventLog(base + ".log.jsonl", transcript_path=base + ".log.txt")
+    log.capture_stdout()
+    try:
+        succeeded, failed = run_batch(participants, args.output, paragraph_pairs, interaction_nums, args.workers,
+                                      args.seed, progress=log.stdout)
+    finally:
+        log.close()
+    if args.trace:
+        timing.export(base + ".trace.json")
+    print(f"Done: {succeeded} succeeded, {failed} failed. Output in {args.output}.")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,271 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import batch_runner
+import completion_cache
+import llm_backend
+import openai_interact_profile
+import openai_interact_rewrite
+import request_scheduler
+import timing
+import token_count
+from event_log import EventLog
+
+# Benchmarks for the PROFILER and REWRITE paths, with stored baselines so a change that makes sessions slower or more
+# expensive shows up before it reaches participants.
+#
+#   python benchmark.py                    # Run and compare with benchmark_baseline.json
+#   python benchmark.py --save-baseline    # Run and store the results as the new baseline
+#   python benchmark.py --check            # Exit with an error if anything regressed (e.g. before committing)
+#
+# Benchmarks (no API access is needed; requests go to an instant stub or the LLM stand-in, and the cache is off):
+# - profile / rewrite: one get_student_profile / get_gpt_response call with an instant backend, so the time is prompt
+#   assembly, printing, and the request pipeline (cache check and request scheduler). The printed output goes to a
+#   sink that only counts it ("log_bytes").
+# - pipeline: one llm_backend.chat_completion call with an instant backend (the per-request part of the above).
+# - logging: the same profile and rewrite calls with the output captured by an EventLog, as in a session. The
+#   overhead is the difference from the counting sink.
+# - tokens: prompt tokens of every request in a session (see token_count.py), per model and in total, and of the
+#   profile requests in the compact profiler context. Token counts are exact when tiktoken is installed and estimated
+#   otherwise; the baseline records which.
+# - end_to_end: the profile and all rewrites for one session against the LLM stand-in with a fixed latency, compared to
+#   the shortest possible time (the requests that must run one after another).
+#
+# Times are the fastest of --repeat runs (the end-to-end session: of a tenth as many, at least 5), which is far less
+# noisy than the median for sub-millisecond calls. Only the exact metrics (token counts, request counts, log sizes)
+# fail --check: any increase is a regression. Times are reported as warnings when they are more than --tolerance times
+# the baseline and TIME_FLOOR_MS above it (END_TO_END_FLOOR_MS for end_to_end, whose runs wait on threads); a
+# warning is a reason to run again and look, not proof of a slowdown. Times depend on the machine, so save a baseline
+# on the machine that will run the comparison, and only after --check has passed there a few times in a row.
+
+BASELINE_PATH = "benchmark_baseline.json"
+DEFAULT_REPEAT = 200
+DEFAULT_TOLERANCE = 2.0  # A time warns when it is more than this many times the baseline ...
+TIME_FLOOR_MS = 1.0  # ... and more than this many ms above it
+END_TO_END_FLOOR_MS = 20.0
+STAND_IN_LATENCY = 0.2  # Seconds per request in the end-to-end benchmark
+SELECTIONS = [1, 2, 1, 2]
+STUB_PROFILE = "You are a student who likes to learn one step at a time. You prefer facts and real examples."
+
+
+class InstantBackend:
+    """Backend that answers at once with a fixed text and records the messages of every request."""
+
+    cache_namespace = "benchmark"
+
+    def __init__(self):
+        self.requests = []
+
+    def chat_completion(self, model, messages, timeout=None, **params):
+        self.requests.append(messages)
+        return STUB_PROFILE if llm_backend.StandInBackend.request_kind(messages) == "profile" else "Reworked text."
+
+    def stream_chat_completion(self, model, messages, timeout=None, **params):
+        yield self.chat_completion(model, messages, timeout, **params)
+
+
+class CountingSink:
+    """sys.stdout replacement that throws the output away and counts it."""
+
+    def __init__(self):
+        self.chars = 0
+
+    def write(self, text):
+        self.chars += len(text)
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def best_ms(func, repeat):
+    '''Shortest wall time of func() over repeat runs, in milliseconds'''
+    times = []
+    for _ in range(repeat):
+        start = timing.now()
+        func()
+        times.append((timing.now() - start) * 1000)
+    return min(times)
+
+
+def with_stdout(stream, func):
+    previous = sys.stdout
+    sys.stdout = stream
+    try:
+        return func()
+    finally:
+        sys.stdout = previous
+
+
+def run_benchmarks(repeat=DEFAULT_REPEAT):
+    '''Run every benchmark. Returns {metric: {"value", "unit"}}.'''
+    paragraph_pairs = batch_runner.load_paragraph_pairs()
+    not_selections = [3 - s for s in SELECTIONS]
+    interaction_nums = list(range(1, openai_interact_rewrite.num_topics() + 1))
+    results = {}
+
+    def record(name, value, unit):
+        results[name] = {"value": round(value, 4) if unit == "ms" else value, "unit": unit}
+
+    backend = InstantBackend()
+    llm_backend.set_backend(backend)
+
+    def profile():
+        return openai_interact_profile.get_student_profile(SELECTIONS, not_selections, paragraph_pairs)
+
+    def rewrite():
+        return openai_interact_rewrite.get_gpt_response(STUB_PROFILE, 1, choice='first')
+
+    # Warm up (imports, first-use eviction pass, scheduler threads) before timing anything.
+    with_stdout(CountingSink(), lambda: (profile(), rewrite()))
+
+    # Prompt assembly, printing to a counting sink, and the request pipeline.
+    for name, func in (("profile", profile), ("rewrite", rewrite)):
+        sink = CountingSink()
+        record(f"{name}.call_ms", with_stdout(sink, lambda: best_ms(func, repeat)), "ms")
+        record(f"{name}.log_bytes", sink.chars // repeat, "chars")
+    message = [{"role": "system", "content": "rework"}, {"role": "user", "content": "benchmark"}]
+    record("pipeline.call_ms", best_ms(lambda: llm_backend.chat_completion(message), repeat), "ms")
+
+    # Logging overhead: the same calls with the output captured by a session log.
+    with tempfile.TemporaryDirectory() as directory:
+        log = EventLog(os.path.join(directory, "benchmark.jsonl"), transcript_path=os.path.join(directory, "b.txt"))
+        log.capture_stdout()
+        try:
+            logged = {name: best_ms(func, repeat) for name, func in (("profile", profile), ("rewrite", rewrite))}
+        finally:
+            log.close()
+    for name, value in logged.items():
+        record(f"logging.{name}_overhead_ms", value - results[f"{name}.call_ms"]["value"], "ms")
+
+    # Prompt tokens of one session: the profile requests and one rewrite request per test topic.
+    backend.requests.clear()
+    with_stdout(CountingSink(), lambda: (profile(), [openai_interact_rewrite.get_gpt_response(STUB_PROFILE, n)
+                                                     for n in interaction_nums]))
+    profile_tokens = rewrite_tokens = 0
+    for messages in backend.requests:
+        tokens = token_count.count_message_tokens(messages)
+        if llm_backend.StandInBackend.request_kind(messages) == "profile":
+            profile_tokens += tokens
+        else:
+            rewrite_tokens += tokens
+    record("tokens.profile", profile_tokens, "tokens")
+    record("tokens.rewrite", rewrite_tokens, "tokens")
+    record("tokens.session", profile_tokens + rewrite_tokens, "tokens")
+    record("tokens.requests", len(backend.requests), "requests")
+
+    # The same profile requests with the pairs sent once, in the system message (see PROFILE_CONTEXT).
+    backend.requests.clear()
+    context = openai_interact_profile.PROFILE_CONTEXT
+    openai_interact_profile.PROFILE_CONTEXT = "compact"
+    try:
+        with_stdout(CountingSink(), profile)
+    finally:
+        openai_interact_profile.PROFILE_CONTEXT = context
+    record("tokens.profile_compact", sum(token_count.count_message_tokens(messages) for messages in backend.requests),
+           "tokens")
+
+    # End to end against the stand-in. The profile requests run one after another (sequential mode), then the
+    # rewrites run at the same time.
+    llm_backend.set_backend(llm_backend.StandInBackend(latency=STAND_IN_LATENCY, jitter=0, error_rate=0))
+
+    def session():
+        actual, opposite = openai_interact_profile.get_student_profile(SELECTIONS, not_selections, paragraph_pairs)
+        for _, future in openai_interact_rewrite.get_gpt_responses(actual, interaction_nums):
+            future.result()
+
+    session_ms = with_stdout(CountingSink(), lambda: best_ms(session, max(5, repeat // 10)))
+    profile_requests = 2 if openai_interact_profile.PROFILE_MODE == "sequential" else 1
+    record("end_to_end.session_ms", session_ms, "ms")
+    record("end_to_end.overhead_ms", session_ms - (profile_requests + 1) * STAND_IN_LATENCY * 1000, "ms")
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    '''Compare results with a baseline. Returns (rows, regressions, warnings) where each row is (metric, baseline, now,
+    note), regressions are the exact metrics that grew and warnings the times that grew past tolerance.'''
+    rows = []
+    regressions = []
+    warnings = []
+    for name, result in results.items():
+        value = result["value"]
+        old = baseline.get(name, {}).get("value")
+        if old is None:
+            rows.append((name, None, value, "new"))
+            continue
+        if result["unit"] == "ms":
+            floor = END_TO_END_FLOOR_MS if name.startswith("end_to_end.") else TIME_FLOOR_MS
+            slower = value > max(old, 0) * tolerance and value - old > floor
+            note = "slower (warning)" if slower else ""
+            if slower:
+                warnings.append(name)
+        else:
+            note = "REGRESSION" if value > old else ("improved" if value < old else "")
+            if value > old:
+                regressions.append(name)
+        rows.append((name, old, value, note))
+    return rows, regressions, warnings
+
+
+def environment():
+    return {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine(),
+            "token_count": token_count.method(), "profile_mode": openai_interact_profile.PROFILE_MODE,
+            "profile_context": openai_interact_profile.PROFILE_CONTEXT,
+            "model": llm_backend.MODEL, "date": time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark prompt assembly, token counts, logging, and latency.")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline.")
+    parser.add_argument("--check", action="store_true", help="Exit with an error if a token count or log size regressed.")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Runs per timed benchmark.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Factor over the baseline before a time is reported as slower.")
+    parser.add_argument("--json", default=None, help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    # Benchmarks must not read or fill the completion cache, and must not be rate limited.
+    completion_cache.CACHE_MODE = "off"
+    request_scheduler.get_scheduler().configure(requests_per_minute=0, max_concurrent=64, hedge_percentile=0)
+
+    env = environment()
+    results = run_benchmarks(args.repeat)
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    regressions, warnings = [], []
+    if baseline is not None:
+        if baseline["environment"]["token_count"] != env["token_count"]:
+            print(f"Note: token counts in the baseline were made with {baseline['environment']['token_count']}, "
+                  f"now with {env['token_count']}.")
+        rows, regressions, warnings = compare(results, baseline["results"], args.tolerance)
+        print(f"{'Benchmark':<32}{'baseline':>12}{'now':>12}  ")
+        for name, old, value, note in rows:
+            print(f"{name:<32}{old if old is not None else '-':>12}{value:>12}  {note}")
+        print(f"\nBaseline from {baseline['environment']['date']} ({baseline['environment']['platform']}, "
+              f"Python {baseline['environment']['python']}).")
+    else:
+        for name, result in results.items():
+            print(f"{name:<32}{result['value']:>12} {result['unit']}")
+
+    output = {"environment": env, "results": results}
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2)
+        print(f"Saved baseline to {args.baseline}.")
+    if warnings:
+        print(f"\n{len(warnings)} time(s) slower than the baseline (not a failure): {', '.join(warnings)}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+    sys.exit(1 if args.check and regressions else 0)
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import timing
+
+# On-disk, content-addressed cache for PROFILER and REWRITE completions. Each completion is stored in its own JSON file
+# named after a hash of the model name, the messages, and the sampling parameters, so identical requests (pilot runs,
+# dry runs, and replays) can be served without calling GPT-4 again.
+#
+# Cache modes (set with the GUI_CACHE_MODE environment variable, or by changing CACHE_MODE below):
+# "off"     - never read or write the cache.
+# "fresh"   - (default, use for real participants) always generate a new completion, and store it in the cache.
+# "cache"   - (use for rehearsals) serve completions from the cache. Misses are generated and stored.
+# "offline" - (use for tests without network access) serve completions from the cache only. Misses raise an error.
+CACHE_MODE = os.environ.get("GUI_CACHE_MODE", "fresh")
+CACHE_DIR = os.environ.get("GUI_CACHE_DIR", "completion_cache")
+
+# Eviction: entries older than CACHE_MAX_AGE_DAYS are removed, then the oldest entries are removed until the cache is
+# under CACHE_MAX_BYTES. Eviction runs when the cache is first used and every EVICT_EVERY writes.
+CACHE_MAX_AGE_DAYS = 30
+CACHE_MAX_BYTES = 50 * 1024 * 1024
+EVICT_EVERY = 50
+
+_lock = threading.Lock()
+_writes_since_eviction = None  # None until the first eviction pass has run.
+
+
+class CacheMissError(Exception):
+    """Raised in "offline" mode when a completion is not in the cache."""
+
+
+def cache_key(model, messages, params, namespace=None):
+    '''Return the hex digest identifying a completion request. Backends other than the OpenAI API use their own
+    namespace so their completions are never served in place of real ones.'''
+    request = {"model": model, "messages": messages, "params": params}
+    if namespace is not None:
+        request["namespace"] = namespace
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def cache_path(key):
+    # Spread the files over 256 sub-folders so no single folder gets too large.
+    return os.path.join(CACHE_DIR, key[:2], key + ".json")
+
+
+def load(key):
+    '''Return the cached completion text for the key, or None if it is missing or has expired'''
+    path = cache_path(key)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if time.time() - entry["created"] > CACHE_MAX_AGE_DAYS * 86400:
+        return None
+    return entry["content"]
+
+
+def store(key, model, messages, params, content):
+    '''Write a completion to the cache (atomically, so readers never see a partial file)'''
+    global _writes_since_eviction
+    path = cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    entry = {"model": model, "messages": messages, "params": params, "content": content, "created": time.time()}
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entry, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+    with _lock:
+        _writes_since_eviction = (_writes_since_eviction or 0) + 1
+        run_eviction = _writes_since_eviction >= EVICT_EVERY
+        if run_eviction:
+            _writes_since_eviction = 0
+    if run_eviction:
+        evict()
+
+
+def evict(max_age_days=None, max_bytes=None):
+    '''Remove expired entries, then the oldest entries until the cache fits in max_bytes. Returns the number removed.'''
+    max_age_days = CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+
+    now = time.time()
+    entries = []
+    removed = 0
+    for folder, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # Expired entries and temporary files left over from a crash are removed first. Entries are never modified
+            # after they are written, so the modification time is the creation time.
+            if now - stat.st_mtime > max_age_days * 86400 or (name.endswith(".tmp") and now - stat.st_mtime > 3600):
+                removed += remove(path)
+            elif name.endswith(".json"):
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        removed += remove(path)
+        total -= size
+    return removed
+
+
+def remove(path):
+    try:
+        os.remove(path)
+        return 1
+    except OSError:
+        return 0
+
+
+def create_chat_completion(backend, model, messages, **params):
+    """Return the content of a chat completion from the backend (see llm_backend.py), going through the cache
+    according to CACHE_MODE.
+
+    params are the sampling parameters of the request (e.g. temperature). They are part of the cache key, so a request
+    with different sampling parameters is never served a cached completion."""
+    global _writes_since_eviction
+    if CACHE_MODE == "off":
+        return backend.chat_completion(model, messages, **params)
+
+    if _writes_since_eviction is None:
+        with _lock:
+            first_use = _writes_since_eviction is None
+            _writes_since_eviction = 0
+        if first_use:
+            evict()
+
+    key = cache_key(model, messages, params, getattr(backend, "cache_namespace", None))
+    if CACHE_MODE in ("cache", "offline"):
+        with timing.span("cache lookup", "cache") as span:
+            content = load(key)
+            span.args["hit"] = content is not None
+        if content is not None:
+            print(f"Completion served from cache (key {key[:12]}).")
+            return content
+        if CACHE_MODE == "offline":
+            raise CacheMissError(f"No cached completion for key {key[:12]} (GUI_CACHE_MODE is 'offline').")
+
+    content = backend.chat_completion(model, messages, **params)
+    with timing.span("cache store", "cache"):
+        store(key, model, messages, params, content)
+    return content
+
+
+def stream_chat_completion(backend, model, messages, **params):
+    """Streaming version of create_chat_completion. Yields the completion text piece by piece. A cached completion is
+    yielded in one piece, and a streamed completion is only stored once it has been received in full."""
+    if CACHE_MODE == "off":
+        yield from backend.stream_chat_completion(model, messages, **params)
+        return
+
+    key = cache_key(model, messages, params, getattr(backend, "cache_namespace", None))
+    if CACHE_MODE in ("cache", "offline"):
+        content = load(key)
+        if content is not None:
+            print(f"Completion served from cache (key {key[:12]}).")
+            yield content
+            return
+        if CACHE_MODE == "offline":
+            raise CacheMissError(f"No cached completion for key {key[:12]} (GUI_CACHE_MODE is 'offline').")
+
+    parts = []
+    for part in backend.stream_chat_completion(model, messages, **params):
+        parts.append(part)
+        yield part
+    store(key, model, messages, params, "".join(parts))
@@ -0,0 +1,192 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+# Structured session log. Every event is one JSON line:
+#   {"seq": 12, "t": 35.204117, "page": 3, "thread": "MainThread", "event": "choice", "payload": {...}}
+# where "t" is a monotonic timestamp in seconds since the log was opened (the wall-clock start time is stored in the
+# "log_start" event). Events are handed to a background writer thread, so the Tk main thread and the GPT worker
+# threads never wait on the disk. The writer flushes in batches and fsyncs at page boundaries.
+#
+# Everything printed during the session is captured as "print" events (see capture_stdout), and the human-readable
+# transcript (the .txt file the GUI has always produced) is rendered from those events by the writer thread. A
+# transcript can also be rebuilt from a .jsonl log after the fact:
+#   python event_log.py "2024-01-01 10-00-00 ID-P01.jsonl"
+
+# The writer flushes after FLUSH_BATCH events or FLUSH_INTERVAL seconds, whichever comes first.
+FLUSH_BATCH = 64
+FLUSH_INTERVAL = 1.0
+
+_SYNC = object()  # Queue marker: flush and fsync both files.
+_CLOSE = object()  # Queue marker: flush, fsync, and stop the writer.
+
+
+class EventLog:
+    """JSONL event log with a background writer thread and a transcript rendered from the "print" events."""
+
+    def __init__(self, path, transcript_path=None):
+        self.path = path
+        self.transcript_path = transcript_path
+        self.start = time.monotonic()
+        self.page = None
+        self.seq = 0
+        self.seq_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.synced = threading.Condition()
+        self.syncs_requested = 0
+        self.syncs_done = 0
+        self.closed = False
+        self.stdout = None  # The stream replaced by capture_stdout
+
+        self.file = open(path, 'a', encoding='utf-8')
+        self.transcript = open(transcript_path, 'a', encoding='utf-8') if transcript_path else None
+        self.writer = threading.Thread(target=self.write_loop, name="event-log-writer", daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+        self.event("log_start", {"wall_time": time.time(), "pid": os.getpid()})
+
+    def event(self, event, payload=None, page=None):
+        '''Queue an event (safe to call from any thread; never blocks on I/O)'''
+        if self.closed:
+            return
+        with self.seq_lock:  # Keeps the file in seq order
+            self.seq += 1
+            self.queue.put({"seq": self.seq,
+                            "t": round(time.monotonic() - self.start, 6),
+                            "page": self.page if page is None else page,
+                            "thread": threading.current_thread().name,
+                            "event": event,
+                            "payload": payload if payload is not None else {}})
+
+    def page_boundary(self, page, wait=False):
+        '''Record a page transition and make everything logged so far durable (fsync). With wait=True, block until the
+        fsync has completed.'''
+        self.page = page
+        self.event("page", {"page": page})
+        self.sync(wait)
+
+    def sync(self, wait=False):
+        if self.closed:
+            return
+        with self.synced:
+            self.syncs_requested += 1
+            ticket = self.syncs_requested
+        self.queue.put(_SYNC)
+        if wait:
+            with self.synced:
+                self.synced.wait_for(lambda: self.syncs_done >= ticket)
+
+    def capture_stdout(self):
+        '''Route print() output into the log as "print" events'''
+        if self.stdout is None:
+            self.stdout = sys.stdout
+            sys.stdout = LogStream(self)
+
+    def close(self):
+        '''Restore stdout, write out every queued event, and close the files'''
+        if self.closed:
+            return
+        if self.stdout is not None:
+            sys.stdout.flush()
+            sys.stdout = self.stdout
+        self.event("log_end")
+        self.closed = True
+        self.queue.put(_CLOSE)
+        self.writer.join()
+
+    def write_loop(self):
+        batch = 0
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                item = None
+
+            if item is _SYNC or item is _CLOSE:
+                self.flush(fsync=True)
+                batch = 0
+                last_flush = time.monotonic()
+                with self.synced:
+                    self.syncs_done += 1 if item is _SYNC else 0
+                    self.synced.notify_all()
+                if item is _CLOSE:
+                    self.file.close()
+                    if self.transcript:
+                        self.transcript.close()
+                    return
+                continue
+
+            if item is not None:
+                self.file.write(json.dumps(item, ensure_ascii=False) + "\n")
+                if self.transcript:
+                    self.transcript.write(render_event(item))
+                batch += 1
+
+            if batch and (batch >= FLUSH_BATCH or time.monotonic() - last_flush >= FLUSH_INTERVAL):
+                self.flush()
+                batch = 0
+                last_flush = time.monotonic()
+
+    def flush(self, fsync=False):
+        for f in (self.file, self.transcript):
+            if f is None:
+                continue
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+
+
+class LogStream:
+    """File-like stand-in for sys.stdout that turns printed lines into "print" events.
+
+    print() writes its arguments and its line ending in separate calls, so text is buffered per thread until a write
+    ends with a newline. This keeps lines printed by different threads from being interleaved."""
+
+    def __init__(self, log):
+        self.log = log
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", "") + text
+        if buffer.endswith("\n"):
+            self.log.event("print", {"text": buffer})
+            buffer = ""
+        self.local.buffer = buffer
+        return len(text)
+
+    def flush(self):
+        buffer = getattr(self.local, "buffer", "")
+        if buffer:
+            self.log.event("print", {"text": buffer})
+            self.local.buffer = ""
+
+
+def render_event(record):
+    '''Return the transcript text for one event (only printed output appears in the transcript)'''
+    if record["event"] == "print":
+        return record["payload"]["text"]
+    return ""
+
+
+def render_transcript(log_path, transcript_path):
+    '''Rebuild the human-readable transcript from a JSONL event log (e.g. after a crash)'''
+    with open(log_path, 'r', encoding='utf-8') as log, open(transcript_path, 'w', encoding='utf-8') as transcript:
+        for line in log:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # A line cut short by a crash. Everything before it is intact.
+            transcript.write(render_event(record))
+
+
+if __name__ == "__main__":
+    for log_path in sys.argv[1:]:
+        transcript_path = os.path.splitext(log_path)[0] + ".txt"
+        render_transcript(log_path, transcript_path)
+        print(f"Wrote {transcript_path}")
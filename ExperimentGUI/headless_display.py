@@ -0,0 +1,306 @@
+import heapq
+import itertools
+import threading
+import types
+
+import timing
+
+# A stand-in for the parts of tkinter and customtkinter the GUI uses, so the real page flow in GUI.py can run without a
+# display (see load_test.py). Widgets keep their options, text, bindings, and pack state in memory instead of drawing
+# anything, and the root window runs an after() event loop with the same rules as Tk's: callbacks run one at a time on
+# the thread that called mainloop(), in order of their due time, and may be scheduled from any thread.
+#
+#   display = HeadlessDisplay()
+#   display.install(GUI)  # Replace the GUI module's ctk, tk, and messagebox with the headless versions
+#
+# Message boxes return display.answers[name] (askyesno and askokcancel answer yes by default) and are counted in
+# display.dialogs, so a script can tell when the GUI refused to move on ("Please select an option...").
+# The display also measures how late each after() callback runs (display.lag): a callback that runs long after its due
+# time means the main thread was busy, which is what a participant sees as a frozen window.
+
+END = "end"
+
+
+class Variable:
+    def __init__(self, master=None, value=None):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class IntVar(Variable):
+    def __init__(self, master=None, value=0):
+        super().__init__(master, value)
+
+
+class StringVar(Variable):
+    def __init__(self, master=None, value=""):
+        super().__init__(master, value)
+
+
+class Widget:
+    """A widget that records what the GUI does to it."""
+
+    def __init__(self, master=None, **options):
+        self.master = master
+        self.options = options
+        self.children = []
+        self.bindings = {}
+        self.packed = False
+        self.placed = False  # Placed under another page (look-ahead rendering): laid out, but not on the screen
+        self.destroyed = False
+        if master is not None:
+            self.display = master.display
+            master.children.append(self)
+            self.display.live_widgets += 1
+            self.display.created_widgets += 1
+
+    def configure(self, **options):
+        self.options.update(options)
+
+    config = configure
+
+    def cget(self, name):
+        return self.options.get(name)
+
+    def pack(self, **options):
+        self.packed = True
+
+    def pack_forget(self):
+        self.packed = False
+
+    grid = pack
+    grid_forget = pack_forget
+
+    def place(self, **options):
+        self.placed = True
+
+    def place_forget(self):
+        self.placed = False
+
+    def lower(self, below=None):
+        pass
+
+    tkraise = lower
+
+    def grid_rowconfigure(self, *args, **kwargs):
+        pass
+
+    grid_columnconfigure = grid_rowconfigure
+
+    def bind(self, sequence, command, add=True):
+        # customtkinter adds bindings instead of replacing them, so every callback for the event runs.
+        self.bindings.setdefault(sequence, []).append(command)
+
+    def fire(self, sequence, event=None):
+        '''Run the callbacks bound to an event, as if the participant had triggered it'''
+        for command in list(self.bindings.get(sequence, [])):
+            command(event)
+
+    def destroy(self):
+        for child in list(self.children):
+            child.destroy()
+        if not self.destroyed:
+            self.destroyed = True
+            self.packed = False
+            if self.master is not None:
+                self.display.live_widgets -= 1
+                self.master.children.remove(self)
+
+    def visible(self):
+        '''True if the widget and all of its parents are packed (what would be on the screen)'''
+        widget = self
+        while widget.master is not None:
+            if not widget.packed or widget.destroyed:
+                return False
+            widget = widget.master
+        return not widget.destroyed
+
+    def walk(self):
+        yield self
+        for child in list(self.children):
+            yield from child.walk()
+
+
+class CTkFrame(Widget):
+    pass
+
+
+class CTkLabel(Widget):
+    pass
+
+
+class CTkButton(Widget):
+    def invoke(self):
+        '''Click the button'''
+        command = self.options.get("command")
+        if command is not None and self.options.get("state") != 'disabled':
+            return command()
+
+
+class CTkOptionMenu(Widget):
+    pass
+
+
+class CTkEntry(Widget):
+    def __init__(self, master=None, **options):
+        super().__init__(master, **options)
+        self.text = ""
+
+    def get(self):
+        return self.text
+
+    def insert(self, index, text):
+        self.text = self.text + text if index in (END, "end") else text + self.text
+
+    def delete(self, first, last=None):
+        self.text = ""
+
+
+class CTkTextbox(Widget):
+    def __init__(self, master=None, **options):
+        super().__init__(master, **options)
+        self.text = ""
+
+    def get(self, first="1.0", last=END):
+        return self.text + "\n"  # Tk always ends the text with a newline.
+
+    def insert(self, index, text):
+        if self.options.get("state") == 'disabled':
+            return  # Like Tk, a disabled textbox ignores edits.
+        self.text = text + self.text if index == "1.0" else self.text + text
+
+    def delete(self, first, last=None):
+        if self.options.get("state") != 'disabled':
+            self.text = ""
+
+    def see(self, index):
+        pass
+
+
+class CTk(Widget):
+    """The root window, with the after() event loop."""
+
+    def __init__(self, display):
+        self.display = display
+        super().__init__(None)
+        self.lock = threading.Condition()
+        self.queue = []  # (due time, after id) heap
+        self.callbacks = {}  # after id -> (function, args)
+        self.ids = itertools.count(1)
+        self.running = False
+        self.main_thread = None
+
+    def title(self, text=None):
+        pass
+
+    def geometry(self, spec=None):
+        pass
+
+    def after(self, ms, func=None, *args):
+        with self.lock:
+            after_id = f"after#{next(self.ids)}"
+            self.callbacks[after_id] = (func, args)
+            heapq.heappush(self.queue, (timing.now() + ms / 1000, after_id))
+            self.lock.notify()
+        return after_id
+
+    def after_cancel(self, after_id):
+        with self.lock:
+            self.callbacks.pop(after_id, None)
+
+    def mainloop(self):
+        '''Run callbacks as they come due until destroy() is called'''
+        self.running = True
+        self.main_thread = threading.current_thread()
+        while self.running:
+            with self.lock:
+                if not self.queue:
+                    self.lock.wait(0.1)
+                    continue
+                due, after_id = self.queue[0]
+                delay = due - timing.now()
+                if delay > 0:
+                    self.lock.wait(delay)
+                    continue
+                heapq.heappop(self.queue)
+                callback = self.callbacks.pop(after_id, None)
+            if callback is None:
+                continue  # Cancelled
+            self.display.record_lag(timing.now() - due)
+            func, args = callback
+            func(*args)
+
+    def destroy(self):
+        self.running = False
+        with self.lock:
+            self.queue.clear()
+            self.callbacks.clear()
+            self.lock.notify()
+        super().destroy()
+
+
+class HeadlessDisplay:
+    """One headless "screen": creates the ctk, tk, and messagebox stand-ins and keeps the statistics for them."""
+
+    def __init__(self, answers=None):
+        self.answers = {"askyesno": True, "askokcancel": True, "showinfo": "ok"}
+        self.answers.update(answers or {})
+        self.dialogs = {}  # message box title -> number of times shown
+        self.live_widgets = 0
+        self.created_widgets = 0
+        self.lag = []  # Seconds each after() callback ran late
+        self.root = None
+
+        display = self
+
+        def make_root(*args, **kwargs):
+            display.root = CTk(display)
+            return display.root
+
+        class ScalingTracker:
+            @staticmethod
+            def get_window_scaling(window):
+                return 1.0
+
+        self.ctk = types.SimpleNamespace(CTk=make_root, CTkFrame=CTkFrame, CTkLabel=CTkLabel, CTkButton=CTkButton,
+                                         CTkEntry=CTkEntry, CTkTextbox=CTkTextbox, CTkOptionMenu=CTkOptionMenu,
+                                         StringVar=StringVar, IntVar=IntVar, ScalingTracker=ScalingTracker,
+                                         set_appearance_mode=lambda mode: None)
+        self.tk = types.SimpleNamespace(IntVar=IntVar, StringVar=StringVar, END=END)
+        self.messagebox = types.SimpleNamespace(askyesno=self.dialog("askyesno"),
+                                                askokcancel=self.dialog("askokcancel"),
+                                                showinfo=self.dialog("showinfo"))
+
+    def dialog(self, kind):
+        def show(title=None, message=None, **options):
+            self.dialogs[title] = self.dialogs.get(title, 0) + 1
+            return self.answers[kind]
+        return show
+
+    def install(self, gui_module):
+        '''Make a GUI module (GUI.py) create its windows and dialogs on this display'''
+        gui_module.ctk = self.ctk
+        gui_module.tk = self.tk
+        gui_module.messagebox = self.messagebox
+
+    def record_lag(self, seconds):
+        self.lag.append(max(0.0, seconds))
+
+    def visible_widgets(self, kind=None):
+        '''Widgets currently on the screen (optionally only those of one class)'''
+        if self.root is None:
+            return []
+        return [widget for widget in self.root.walk() if widget is not self.root and widget.visible()
+                and (kind is None or isinstance(widget, kind))]
+
+    def button(self, *texts):
+        '''The first visible, enabled button with one of the given texts (None if there is none)'''
+        for widget in self.visible_widgets(CTkButton):
+            if widget.cget("text") in texts and widget.cget("state") != 'disabled':
+                return widget
+        return None
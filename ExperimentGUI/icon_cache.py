@@ -0,0 +1,80 @@
+import threading
+
+from PIL import Image
+from customtkinter import CTkImage
+
+
+# The icons in Icons/ are 1024x1024 PNGs (1-2.5 MB each) but are only displayed at 500x500 or 350x350. Decoding them
+# every time a page is built stalls page transitions and keeps full-resolution copies in memory. The IconCache decodes
+# each icon once, downscales it to the size it is displayed at, and reuses the resulting CTkImage for every page.
+
+
+class IconCache:
+    """Decoded, pre-scaled icons shared by all pages of the GUI."""
+
+    def __init__(self, scaling=1.0):
+        # scaling: the window scaling factor (e.g. 1.5 on a display set to 150%). Icons are downscaled to the displayed
+        # size times this factor so they stay sharp when customtkinter scales them.
+        self.scaling = scaling
+        self.lock = threading.Lock()
+        self.images = {}  # (path, size) -> downscaled PIL image
+        self.loading = {}  # (path, size) -> threading.Event, set once the icon is decoded or has failed
+        self.ctk_images = {}  # (path, size) -> CTkImage. Only touched on the main thread.
+
+    def load(self, path, size):
+        '''Decode and downscale one icon (safe to call from any thread)'''
+        key = (path, tuple(size))
+        with self.lock:
+            if key in self.images:
+                return self.images[key]
+            event = self.loading.get(key)
+            owner = event is None
+            if owner:
+                event = self.loading[key] = threading.Event()
+                event.error = None
+
+        # Another thread is already decoding this icon: wait for it instead of decoding it twice, and raise its error if
+        # the decode failed.
+        if not owner:
+            event.wait()
+            if event.error is not None:
+                raise event.error
+            return self.images[key]
+
+        try:
+            pixel_size = (round(size[0] * self.scaling), round(size[1] * self.scaling))
+            with Image.open(path) as image:
+                image = image.convert("RGBA")
+                if image.size != pixel_size:
+                    image = image.resize(pixel_size, Image.LANCZOS)
+            with self.lock:
+                self.images[key] = image
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            # A failed icon is not cached: the next call decodes it again (e.g. once the file has been replaced).
+            with self.lock:
+                del self.loading[key]
+            event.set()
+        return image
+
+    def preload(self, requests):
+        '''Decode the given (path, size) icons on a background thread'''
+        requests = list(requests)
+
+        def worker():
+            for path, size in requests:
+                try:
+                    self.load(path, size)
+                except OSError as e:
+                    print(f"Icon preload failed for {path}: {e}")
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def get(self, path, size):
+        '''Return the CTkImage for the icon at the displayed size (call from the main thread)'''
+        key = (path, tuple(size))
+        if key not in self.ctk_images:
+            self.ctk_images[key] = CTkImage(light_image=self.load(path, size), size=size)
+        return self.ctk_images[key]
@@ -0,0 +1,254 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import completion_cache
+import request_scheduler
+import timing
+import token_count
+
+# Both GPT-4 models (PROFILER and REWRITE) send their requests through this module. The backend is selected with the
+# GUI_LLM_BACKEND environment variable:
+# "openai"   - (default) the OpenAI API. You will need to have an api_key variable from OpenAI to use this backend.
+#              Unless set as the OPENAI_API_KEY environment variable (recommended), you may set GUI_OPENAI_API_KEY.
+# "stand-in" - an in-process stand-in with configurable latency and canned/templated responses. No network or
+#              credentials are needed, so the GUI's loading and threading paths can be exercised offline.
+# "http"     - any server speaking the chat-completions protocol at GUI_LLM_BASE_URL, e.g. the local stand-in server
+#              started with "python stand_in_server.py".
+# Requests are sent through the shared request scheduler (deadlines, retries, rate limiting, and hedging; see
+# request_scheduler.py) after the completion cache has been checked.
+BACKEND = os.environ.get("GUI_LLM_BACKEND", "openai")
+BASE_URL = os.environ.get("GUI_LLM_BASE_URL", "http://127.0.0.1:8765/v1")
+
+# Note: In this study, the version of GPT-4 used was "gpt-4-1106-preview". This model version may need to be updated
+# in the future should it be removed from OpenAI's API (set GUI_LLM_MODEL to override it).
+MODEL = os.environ.get("GUI_LLM_MODEL", "gpt-4-1106-preview")
+
+# Stand-in settings. Latency is in seconds per request; the actual latency is drawn uniformly from
+# [latency * (1 - jitter), latency * (1 + jitter)] using a seed derived from the request, so runs are reproducible.
+# When streaming, the first token arrives after STAND_IN_FIRST_TOKEN_FRACTION of the latency and the remaining tokens
+# are spread over the rest.
+STAND_IN_LATENCY = float(os.environ.get("GUI_STAND_IN_LATENCY", "1.0"))
+STAND_IN_JITTER = float(os.environ.get("GUI_STAND_IN_JITTER", "0.25"))
+STAND_IN_FIRST_TOKEN_FRACTION = 0.3
+# Extra latency per 1000 prompt tokens, so longer prompts take longer as they do with the real API (0 = no effect).
+STAND_IN_LATENCY_PER_1K_TOKENS = float(os.environ.get("GUI_STAND_IN_LATENCY_PER_1K_TOKENS", "0"))
+STAND_IN_RESPONSES = os.environ.get("GUI_STAND_IN_RESPONSES")  # Optional JSON file of response templates.
+# Fraction of stand-in requests that fail with a rate-limit (429) or server (500) error, to exercise the retry paths.
+STAND_IN_ERROR_RATE = float(os.environ.get("GUI_STAND_IN_ERROR_RATE", "0"))
+
+
+class StandInError(Exception):
+    """A simulated API error from the stand-in backend."""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+        self.response = None
+
+
+class OpenAIBackend:
+    """Chat completions from the OpenAI API (or any server speaking the same protocol at base_url)."""
+
+    def __init__(self, base_url=None, api_key=None):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.client = None
+        self.lock = threading.Lock()
+        # Completions from a different server must not be served from the cache as OpenAI completions.
+        self.cache_namespace = base_url
+
+    def get_client(self):
+        # The OpenAI SDK is imported and the client created on first use, so importing the GUI does not need
+        # credentials or network access.
+        with self.lock:
+            if self.client is None:
+                from openai import OpenAI  # Written using OpenAI API version 1.9.0
+                # Retries are handled by the request scheduler, so the SDK's own retries are turned off.
+                self.client = OpenAI(base_url=self.base_url, api_key=self.api_key, max_retries=0)
+            return self.client
+
+    def chat_completion(self, model, messages, timeout=None, **params):
+        # timeout: seconds for this attempt (set by the request scheduler from the request's deadline).
+        if timeout is not None:
+            params["timeout"] = timeout
+        # The raw response is requested so the time spent waiting on the server (network) can be told apart from the
+        # time spent parsing the response.
+        client = self.get_client()
+        with timing.span("network", "http", model=model):
+            response = client.chat.completions.with_raw_response.create(model=model, messages=messages, **params)
+        with timing.span("parse", "http"):
+            return response.parse().choices[0].message.content
+
+    def stream_chat_completion(self, model, messages, timeout=None, **params):
+        if timeout is not None:
+            params["timeout"] = timeout
+        with timing.span("stream", "http", model=model) as span:
+            with timing.span("network", "http", model=model):
+                stream = self.get_client().chat.completions.create(model=model, messages=messages, stream=True,
+                                                                   **params)
+            first_chunk = True
+            for chunk in stream:
+                if first_chunk:
+                    span.args["first_chunk"] = span.elapsed()
+                    first_chunk = False
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+
+class StandInBackend:
+    """Deterministic offline stand-in for the chat-completions API.
+
+    Requests are recognized by their system message. PROFILER requests get a profile assembled from canned sentences,
+    REWRITE requests get a template filled with the paragraph being reworked. The choice of sentences and the simulated
+    latency depend only on the request, so the same request always gets the same response."""
+
+    cache_namespace = "stand-in"
+
+    default_responses = {
+        "profile": ["You are a student who {0}. You {1}. You {2}.",
+                    "You learn best when {3}. You {1}. You {2}."],
+        "profile_sentences": [["likes to learn one step at a time", "likes to see the big picture first",
+                               "enjoys trying things out", "likes to think things through first"],
+                              ["prefer facts and real examples", "enjoy ideas and possibilities",
+                               "remember what you see in pictures and diagrams",
+                               "remember what you read and hear"],
+                              ["like to work with others", "like to work on your own",
+                               "like clear and simple explanations", "like to connect new ideas to what you know"],
+                              ["information comes in a clear order", "you can see how everything fits together",
+                               "you can try an example yourself", "you have time to reflect"]],
+        "rewrite": ["{paragraph}"],
+        "default": ["This is a stand-in response."],
+    }
+
+    def __init__(self, latency=None, jitter=None, responses=None, error_rate=None, latency_per_1k_tokens=None):
+        self.latency = STAND_IN_LATENCY if latency is None else latency
+        self.jitter = STAND_IN_JITTER if jitter is None else jitter
+        self.latency_per_1k_tokens = STAND_IN_LATENCY_PER_1K_TOKENS if latency_per_1k_tokens is None \
+            else latency_per_1k_tokens
+        self.error_rate = STAND_IN_ERROR_RATE if error_rate is None else error_rate
+        self.responses = dict(self.default_responses)
+        if responses is None and STAND_IN_RESPONSES:
+            with open(STAND_IN_RESPONSES, 'r', encoding='utf-8') as f:
+                responses = json.load(f)
+        if responses:
+            self.responses.update(responses)
+
+    @staticmethod
+    def request_kind(messages):
+        system_msg = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        if "learning profile" in system_msg or "Given a student's responses" in system_msg:
+            return "profile"
+        if "rework" in system_msg:
+            return "rewrite"
+        return "default"
+
+    def request_rng(self, model, messages):
+        seed = hashlib.sha256(json.dumps([model, messages], sort_keys=True).encode("utf-8")).hexdigest()
+        return random.Random(seed)
+
+    def request_latency(self, rng, messages):
+        latency = self.latency * (1 + rng.uniform(-self.jitter, self.jitter))
+        if self.latency_per_1k_tokens:
+            latency += token_count.count_message_tokens(messages) / 1000 * self.latency_per_1k_tokens
+        return max(0.0, latency)
+
+    def simulate_request(self, latency, timeout, wait_fraction=1.0):
+        # Errors are drawn independently of the request, so a retried request can succeed.
+        if self.error_rate and random.random() < self.error_rate:
+            time.sleep(latency * 0.1)
+            status_code = random.choice([429, 500])
+            raise StandInError(status_code, f"Simulated stand-in error ({status_code}).")
+        if timeout is not None and latency * wait_fraction > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Stand-in request timed out after {timeout:.2f} s.")
+        time.sleep(latency * wait_fraction)
+
+    def chat_completion(self, model, messages, timeout=None, **params):
+        rng = self.request_rng(model, messages)
+        with timing.span("network", "stand-in"):
+            self.simulate_request(self.request_latency(rng, messages), timeout)
+        with timing.span("parse", "stand-in"):
+            return self.generate(messages, rng)
+
+    def stream_chat_completion(self, model, messages, timeout=None, **params):
+        rng = self.request_rng(model, messages)
+        latency = self.request_latency(rng, messages)
+        tokens = re.findall(r"\S+\s*|\s+", self.generate(messages, rng))
+        self.simulate_request(latency, timeout, STAND_IN_FIRST_TOKEN_FRACTION)
+        for i, token in enumerate(tokens):
+            if i > 0:
+                time.sleep(latency * (1 - STAND_IN_FIRST_TOKEN_FRACTION) / len(tokens))
+            yield token
+
+    def generate(self, messages, rng):
+        kind = self.request_kind(messages)
+        template = rng.choice(self.responses[kind])
+        if kind == "profile":
+            sentences = [rng.choice(options) for options in self.responses["profile_sentences"]]
+            return template.format(*sentences)
+        if kind == "rewrite":
+            # The paragraph to rework is the last [...] block of the REWRITE user message (the latest one that has a
+            # paragraph, so a follow-up asking for a shorter rework gets the paragraph again).
+            blocks = []
+            for message in reversed(messages):
+                if message["role"] == "user":
+                    blocks = re.findall(r"\[(.*?)\]", message["content"], flags=re.DOTALL)
+                    if blocks:
+                        break
+            return template.format(paragraph=blocks[-1] if blocks else "")
+        return template
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    '''Return the backend selected by GUI_LLM_BACKEND (created once and shared by every module and thread)'''
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            if BACKEND == "openai":
+                _backend = OpenAIBackend(api_key=os.environ.get("GUI_OPENAI_API_KEY"))
+            elif BACKEND == "stand-in":
+                _backend = StandInBackend()
+            elif BACKEND == "http":
+                _backend = OpenAIBackend(base_url=BASE_URL, api_key=os.environ.get("GUI_OPENAI_API_KEY", "stand-in"))
+            else:
+                raise ValueError(f"Invalid GUI_LLM_BACKEND '{BACKEND}'. Must be 'openai', 'stand-in', or 'http'.")
+        return _backend
+
+
+def warm_up():
+    '''Create the backend and its client now (e.g. while the participant ID is entered) instead of on the first
+    request. For the OpenAI backend this imports the SDK, which takes a moment.'''
+    backend = get_backend()
+    if hasattr(backend, "get_client"):
+        backend.get_client()
+
+
+def set_backend(backend):
+    '''Use the given backend for all further requests (e.g. a StandInBackend with custom latency)'''
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def scheduled_backend():
+    return request_scheduler.ScheduledBackend(get_backend(), request_scheduler.get_scheduler())
+
+
+def chat_completion(messages, model=None, **params):
+    '''Return the content of a chat completion from the selected backend (through the completion cache and the request
+    scheduler)'''
+    return completion_cache.create_chat_completion(scheduled_backend(), model or MODEL, messages, **params)
+
+
+def stream_chat_completion(messages, model=None, **params):
+    '''Yield the content of a chat completion from the selected backend piece by piece as it is generated'''
+    return completion_cache.stream_chat_completion(scheduled_backend(), model or MODEL, messages, **params)
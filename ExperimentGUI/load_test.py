@@ -0,0 +1,382 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import timing
+
+# Headless load test: runs complete GUI sessions (participant ID screen to "Save & Exit") with scripted participants,
+# many at a time, to reproduce what a full classroom does to the GUI and the generation backend.
+#
+#   python load_test.py --sessions 30 --processes 6 --dwell 2
+#   python load_test.py --sessions 30 --processes 6 --session-server http://127.0.0.1:8770  # Through session_server.py
+#
+# Each session runs the real page flow in GUI.py (click_next_page, create_page, create_gpt_interaction_page, the loading
+# page, speculative generation, retries, ...) on a headless display (see headless_display.py). The participant reads
+# each page for --dwell seconds (+/- --jitter), clicks one of the two paragraphs, and continues --confirm seconds later.
+# Generation uses the local LLM stand-in (GUI_LLM_BACKEND=stand-in, see llm_backend.py) unless another backend is set
+# in the environment, and the completion cache is off (GUI_CACHE_MODE=off) so every session makes its own requests.
+#
+# Sessions are spread over --processes worker processes. Each worker runs its sessions one after another, like a
+# station running one participant after another, so memory that grows from session to session shows up as growth.
+#
+# Report (printed, and written to <output>/report.json with every session's measurements):
+# - Page latency: time from the participant's click to the next page being ready to use (including any time spent on
+#   the loading page), as percentiles per page. Checked every POLL_INTERVAL seconds.
+# - Main-thread lag: how late the GUI's after() callbacks ran. A high value means the window was frozen.
+# - Threads: the most threads alive at once during a session, and threads left behind when a session ends.
+# - Memory: the worker process's resident memory after each session, and the growth from the first session to the last.
+# - Widgets alive on the last page (pages that are never destroyed pile up), message boxes shown, retries, and
+#   sessions that stalled (did not finish within --session-timeout).
+# The session logs (.jsonl, .txt, .trace.json) are moved to <output>/sessions/.
+
+DEFAULT_PROCESSES = 4
+DEFAULT_DWELL = 1.0
+DEFAULT_SESSION_TIMEOUT = 600
+POLL_INTERVAL = 0.01  # Seconds between checks while waiting for a page.
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, p):
+    '''Nearest-rank percentile (None for no values)'''
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))]
+
+
+def rss_mb():
+    '''Resident memory of this process in MB (None if it cannot be read on this platform)'''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Peak, not current (KB on Linux, bytes on macOS)
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+class ScriptedParticipant:
+    """Clicks through one GUI session on a headless display, timing every page transition."""
+
+    def __init__(self, gui, display, participant_id, group, choices, dwell, jitter, confirm, rng):
+        self.gui = gui
+        self.display = display
+        self.participant_id = participant_id
+        self.group = group
+        self.choices = list(choices)
+        self.dwell = dwell
+        self.jitter = jitter
+        self.confirm = confirm
+        self.rng = rng
+
+        self.pages = []  # One entry per page reached: {"page", "latency", "render", "loading"}
+        self.action_time = None  # When the participant last clicked to move on
+        self.render_time = 0
+        self.saw_loading = False
+        self.retries = 0
+        self.peak_threads = threading.active_count()
+        self.current = None  # Page the participant is on (None while waiting for one)
+        self.finished = False
+        self.widgets_at_exit = None  # Widgets alive on the last page (widgets that are never destroyed pile up)
+
+    def start(self):
+        self.gui.root.after(0, self.poll)
+
+    def delay(self):
+        return max(0.0, self.rng.uniform(self.dwell * (1 - self.jitter), self.dwell * (1 + self.jitter)))
+
+    def later(self, seconds, func, *args):
+        self.gui.root.after(int(seconds * 1000), func, *args)
+
+    def page_name(self):
+        '''Name of the page on the screen, or None if it is the loading page (or nothing is shown yet)'''
+        gui = self.gui
+        if gui.loading_frame is not None and gui.loading_frame.visible():
+            return None
+        if gui.paragraph_frame is not None and gui.paragraph_frame.visible():
+            if gui.current_page <= gui.num_training_pages():
+                return f"training {gui.current_page}"
+            return f"test {gui.gpt_interaction_num()}"
+        if gui.participant_id_entry is not None and gui.participant_id_entry.visible():
+            return "participant id"
+        if self.display.button("Accept & Continue"):
+            return "instructions"
+        if self.display.button("Save & Exit"):
+            return "exit"
+        if self.display.button("Submit"):
+            return "close"
+        if self.display.button("Continue"):
+            return "welcome" if gui.current_page == 0 and gui.startGUI == 0 else "break"
+        return None
+
+    def poll(self):
+        '''Wait for the next page, then read it for a while and act on it'''
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+        name = self.page_name()
+        if name is None:
+            if self.display.button("Try Again"):
+                self.retries += 1
+                self.later(self.delay(), self.act, self.display.button("Try Again"))
+                return
+            self.saw_loading = self.saw_loading or self.gui.loading_frame is not None and \
+                self.gui.loading_frame.visible()
+            self.later(POLL_INTERVAL, self.poll)
+            return
+
+        if self.action_time is not None:
+            self.pages.append({"page": name, "latency": timing.now() - self.action_time, "render": self.render_time,
+                               "loading": self.saw_loading})
+        self.current = name
+        self.saw_loading = False
+        self.later(self.delay(), self.read, name)
+
+    def read(self, name):
+        '''The participant has read the page: fill it in'''
+        display = self.display
+        if name == "participant id":
+            self.gui.participant_id_entry.insert("end", self.participant_id)
+            self.gui.experiment_version_entry.set(self.group)
+            self.later(0, self.act, display.button("Submit"))
+        elif name.startswith("training") or name.startswith("test"):
+            if self.gui.selection_locked:
+                self.later(POLL_INTERVAL, self.read, name)  # Still streaming: selection is locked.
+                return
+            choice = self.choices.pop(0) if name.startswith("training") and self.choices else self.rng.choice([1, 2])
+            (self.gui.left_text if choice == 1 else self.gui.right_text).fire("<Button-1>")
+            self.later(self.confirm, self.act, display.button("Continue"))
+        elif name == "close":
+            textboxes = [w for w in display.visible_widgets() if w.bindings.get("<Button-1>")]
+            self.rng.choice(textboxes).fire("<Button-1>")
+            self.later(self.confirm, self.act, display.button("Submit"))
+        else:
+            if name == "exit":
+                self.widgets_at_exit = display.live_widgets
+            self.later(0, self.act, display.button("Continue", "Accept & Continue", "Save & Exit"))
+
+    def act(self, button):
+        '''Click a button (this usually builds the next page right away, on the main thread)'''
+        if self.current == "exit":
+            self.finished = True
+        self.current = None
+        self.action_time = timing.now()
+        button.invoke()
+        self.render_time = timing.now() - self.action_time
+        if not self.finished:
+            self.poll()
+
+
+def run_session(participant_id, group, choices, dwell, jitter, confirm, streaming, session_timeout, sessions_dir,
+                seed=None):
+    '''Run one GUI session headlessly and return its measurements'''
+    import GUI
+    from headless_display import HeadlessDisplay
+
+    display = HeadlessDisplay()
+    display.install(GUI)
+    threads_before = threading.active_count()
+    started = timing.now()
+    gui = GUI.GUI()
+    if streaming:
+        gui.use_streaming = True
+    participant = ScriptedParticipant(gui, display, participant_id, group, choices, dwell, jitter, confirm,
+                                      random.Random(seed))
+    stalled = []
+
+    def watchdog():
+        if not participant.finished:
+            stalled.append(participant.current or "loading")
+            if gui.log is not None:
+                gui.log.close()
+            gui.root.destroy()
+
+    gui.root.after(int(session_timeout * 1000), watchdog)
+    participant.start()
+    error = None
+    try:
+        gui.run()
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if gui.log is not None:
+            gui.log.close()
+    run_time = timing.now() - started
+
+    # Leave the session's background threads a moment to finish before counting the ones left behind.
+    time.sleep(0.5)
+    threads_after = threading.active_count()
+    if gui.session_filename and sessions_dir:
+        for extension in (".jsonl", ".txt", ".trace.json"):
+            if os.path.exists(gui.session_filename + extension):
+                shutil.move(gui.session_filename + extension,
+                            os.path.join(sessions_dir, os.path.basename(gui.session_filename + extension)))
+    # Each station process normally runs a single session, so start the next session with an empty trace.
+    with timing.tracer.lock:
+        timing.tracer.events.clear()
+
+    if stalled:
+        error = f"Stalled on {stalled[0]} (no progress within {session_timeout} s)"
+    lag = display.lag
+    return {"id": participant_id, "group": group, "error": error, "run_time": round(run_time, 3),
+            "pages": participant.pages, "retries": participant.retries, "dialogs": display.dialogs,
+            "lag_p99": percentile(lag, 99), "lag_max": max(lag) if lag else None,
+            "peak_threads": participant.peak_threads, "threads_left": threads_after - threads_before,
+            "widgets_created": display.created_widgets, "widgets_at_exit": participant.widgets_at_exit}
+
+
+def run_worker(worker, sessions, options):
+    '''Run sessions one after another in this process. Returns their results and the memory after each one.'''
+    os.environ.setdefault("GUI_LLM_BACKEND", "stand-in")
+    os.environ.setdefault("GUI_CACHE_MODE", "off")
+    if options.get("session_server"):
+        os.environ["GUI_SESSION_SERVER"] = options["session_server"]
+    results = []
+    memory = [rss_mb()]
+    for session in sessions:
+        result = run_session(session["id"], session["group"], session["choices"], options["dwell"],
+                             options["jitter"], options["confirm"], options["streaming"],
+                             options["session_timeout"], options["sessions_dir"], seed=session["seed"])
+        result["worker"] = worker
+        results.append(result)
+        memory.append(rss_mb())
+    return results, memory
+
+
+def summarize(results, memory_by_worker):
+    '''Aggregate the session results into the report'''
+    by_page = {}
+    for result in results:
+        for page in result["pages"]:
+            by_page.setdefault(page["page"], []).append(page)
+
+    def stats(values):
+        entry = {f"p{p}": percentile(values, p) for p in PERCENTILES}
+        entry["max"] = max(values) if values else None
+        return entry
+
+    pages = {}
+    for name, entries in by_page.items():
+        pages[name] = dict(stats([e["latency"] for e in entries]), n=len(entries),
+                           render_p99=percentile([e["render"] for e in entries], 99),
+                           loading=sum(1 for e in entries if e["loading"]))
+
+    growth = [memory[-1] - memory[1] for memory in memory_by_worker if len(memory) > 2 and None not in memory]
+    dialogs = {}
+    for result in results:
+        for title, count in result["dialogs"].items():
+            dialogs[title] = dialogs.get(title, 0) + count
+    lags = [r["lag_max"] for r in results if r["lag_max"] is not None]
+    return {
+        "sessions": len(results),
+        "failed": [{"id": r["id"], "error": r["error"]} for r in results if r["error"]],
+        "pages": pages,
+        "main_thread_lag": {"p99_of_sessions": percentile([r["lag_p99"] for r in results if r["lag_p99"] is not None],
+                                                          99),
+                            "max": max(lags) if lags else None},
+        "threads": {"peak": max((r["peak_threads"] for r in results), default=None),
+                    "left_after_session_max": max((r["threads_left"] for r in results), default=None)},
+        "memory_mb": {"per_worker": [[round(m, 1) if m is not None else None for m in memory]
+                                     for memory in memory_by_worker],
+                      "growth_after_first_session_max": round(max(growth), 1) if growth else None},
+        "widgets_at_exit_max": max((r["widgets_at_exit"] or 0 for r in results), default=None),
+        "retries": sum(r["retries"] for r in results),
+        "dialogs": dialogs,
+    }
+
+
+def print_report(report, out):
+    def ms(value):
+        return f"{value * 1000:9.1f}" if value is not None else f"{'-':>9}"
+
+    def page_order(name):
+        order = ["participant id", "welcome", "instructions", "training", "test", "break", "close", "exit"]
+        kind, _, num = name.partition(" ")
+        return (order.index(kind) if kind in order else len(order), int(num) if num.isdigit() else 0)
+
+    out.write(f"\n{report['sessions']} sessions, {len(report['failed'])} failed\n\n")
+    out.write(f"{'Page latency (ms)':<20}{'n':>5}" + "".join(f"{'p' + str(p):>9}" for p in PERCENTILES) +
+              f"{'max':>9}{'render p99':>12}{'loading':>9}\n")
+    for name in sorted(report["pages"], key=page_order):
+        entry = report["pages"][name]
+        out.write(f"{name:<20}{entry['n']:>5}" + "".join(ms(entry[f'p{p}']) for p in PERCENTILES) +
+                  f"{ms(entry['max'])}{ms(entry['render_p99']):>12}{entry['loading']:>9}\n")
+    lag = report["main_thread_lag"]
+    out.write(f"\nMain-thread lag (ms): p99 {ms(lag['p99_of_sessions']).strip()}, max {ms(lag['max']).strip()}\n")
+    out.write(f"Threads: peak {report['threads']['peak']}, "
+              f"left after a session (max) {report['threads']['left_after_session_max']}\n")
+    out.write(f"Memory growth after the first session (max per worker): "
+              f"{report['memory_mb']['growth_after_first_session_max']} MB\n")
+    out.write(f"Widgets alive on the last page (max): {report['widgets_at_exit_max']}\n")
+    out.write(f"Retries: {report['retries']}, message boxes: {report['dialogs'] or 'none'}\n")
+    for failure in report["failed"]:
+        out.write(f"FAILED {failure['id']}: {failure['error']}\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many scripted GUI sessions headlessly and report latencies.")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--processes", type=int, default=DEFAULT_PROCESSES, help="Sessions run at the same time.")
+    parser.add_argument("--group", choices=["Experimental", "Control", "both"], default="both")
+    parser.add_argument("--dwell", type=float, default=DEFAULT_DWELL, help="Seconds spent reading each page.")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Random variation of the dwell time (fraction).")
+    parser.add_argument("--confirm", type=float, default=0.3,
+                        help="Seconds between clicking a paragraph and clicking Continue.")
+    parser.add_argument("--streaming", action="store_true", help="Run the GUI in streaming mode (as GUI_STREAMING=1 does).")
+    parser.add_argument("--session-server", default=None, help="Generate through a session server at this URL.")
+    parser.add_argument("--session-timeout", type=float, default=DEFAULT_SESSION_TIMEOUT,
+                        help="Seconds after which a session that has not finished counts as stalled.")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("-o", "--output", default=None, help="Output directory (default: loadtest <time>).")
+    args = parser.parse_args()
+
+    output = args.output or f"loadtest {time.strftime('%Y-%m-%d %H-%M-%S')}"
+    sessions_dir = os.path.join(output, "sessions")
+    os.makedirs(sessions_dir, exist_ok=True)
+
+    import batch_runner
+    num_pairs = len(batch_runner.load_paragraph_pairs())
+    rng = random.Random(args.seed)
+    groups = ["Experimental", "Control"] if args.group == "both" else [args.group]
+    run_id = time.strftime('%H%M%S')
+    sessions = [{"id": f"load-{run_id}-{i + 1:03}", "group": groups[i % len(groups)],
+                 "choices": [rng.choice([1, 2]) for _ in range(num_pairs)], "seed": rng.random()}
+                for i in range(args.sessions)]
+    options = {"dwell": args.dwell, "jitter": args.jitter, "confirm": args.confirm, "streaming": args.streaming,
+               "session_server": args.session_server, "session_timeout": args.session_timeout,
+               "sessions_dir": sessions_dir}
+
+    processes = max(1, min(args.processes, len(sessions)))
+    print(f"Running {len(sessions)} sessions in {processes} processes "
+          f"(backend {os.environ.get('GUI_LLM_BACKEND', 'stand-in')}, "
+          f"{'session server ' + args.session_server if args.session_server else 'local generation'}).")
+    results = []
+    memory_by_worker = []
+    # Fresh interpreters (spawn) so every worker starts like a station does, and reads the GUI_* settings itself.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        futures = [executor.submit(run_worker, worker, sessions[worker::processes], options)
+                   for worker in range(processes)]
+        for future in as_completed(futures):
+            worker_results, memory = future.result()
+            results.extend(worker_results)
+            memory_by_worker.append(memory)
+            for result in worker_results:
+                print(f"{result['id']}: {'FAILED - ' + result['error'] if result['error'] else 'done'} "
+                      f"({result['run_time']:.1f} s)")
+
+    report = summarize(results, memory_by_worker)
+    with open(os.path.join(output, "report.json"), 'w', encoding='utf-8') as f:
+        json.dump({"options": dict(options, sessions=len(sessions), processes=processes), "summary": report,
+                   "sessions": sorted(results, key=lambda r: r["id"])}, f, indent=2)
+    print_report(report, sys.stdout)
+    print(f"\nReport and session logs in {output}/")
+    sys.exit(1 if report["failed"] else 0)
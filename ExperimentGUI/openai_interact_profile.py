@@ -1,21 +1,98 @@
 # Written using OpenAI API version 1.9.0
-from openai import OpenAI
-import time
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
 
-# You will need to have an api_key variable from OpenAI to run this code.
-# Unless set as an environment variable (recommended), you may use client = OpenAI(api_key = ...).
-client = OpenAI()
+import llm_backend
+import timing
+import token_count
+
+# Requests are sent through llm_backend.py. With the default "openai" backend, you will need to have an api_key
+# variable from OpenAI to run this code (see llm_backend.py).
 
 # Note about variables:
 # Selections = True Choices for the True Profile
 # notSelections = Opposite Choices for the Opposite Profile
 
 # Note: In this study, the version of GPT-4 used was "gpt-4-1106-preview". This model version may need to be updated
-# in the future should it be removed from OpenAI's API.
+# in the future should it be removed from OpenAI's API (see MODEL in llm_backend.py).
+
+# Profile generation mode (set with GUI_PROFILE_MODE):
+# "sequential" - (used in the study) the opposite profile is generated after the actual profile, with the actual profile
+#                supplied as an assistant turn so that the two profiles come out distinct.
+# "concurrent" - both profiles are requested at the same time. The lexical overlap of the two results is then measured
+#                locally (Jaccard similarity of word shingles), and the sequential opposite call is only made when the
+#                overlap is above PROFILE_OVERLAP_THRESHOLD (set with GUI_PROFILE_OVERLAP_THRESHOLD).
+PROFILE_MODE = os.environ.get("GUI_PROFILE_MODE", "sequential")
+# Shingle Jaccard similarity above which the two profiles are too similar.
+PROFILE_OVERLAP_THRESHOLD = float(os.environ.get("GUI_PROFILE_OVERLAP_THRESHOLD", "0.2"))
+SHINGLE_SIZE = 3  # Number of words per shingle.
+
+# Profiler context (how the training paragraph pairs are sent, set with GUI_PROFILE_CONTEXT):
+# "inline"  - (used in the study) every PROFILER user message lists all of the paragraph pairs, so the request for the
+#             opposite profile carries them twice (in the first user message and again in the follow-up).
+# "compact" - the pairs are sent once per request, as a numbered table at the end of the system message, and the user
+#             messages only list the choices by pair number. The system message is then identical for every PROFILER
+#             request of every participant, so it is a stable prefix the API can serve from its prompt cache (OpenAI
+#             caches repeated prompt prefixes of 1024 tokens or more).
+# "auto"    - "inline" unless the largest inline request would be over PROFILE_TOKEN_BUDGET prompt tokens (e.g. after
+#             adding training pairs), then "compact".
+# Prompt tokens are counted locally before anything is sent (see token_count.py). Each session logs the tokens sent,
+# the tokens the inline prompts would have used, and an estimate of the time saved.
+PROFILE_CONTEXT = os.environ.get("GUI_PROFILE_CONTEXT", "inline")
+PROFILE_TOKEN_BUDGET = 2000
+# Rough time GPT-4 takes to read 1000 prompt tokens, only used for the estimate of time saved. Calibrate it from the
+# Profiler Run Times of your own sessions in each mode.
+PREFILL_SECONDS_PER_1K_TOKENS = 0.2
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    '''Return the set of lowercase word shingles (n-grams) in the text'''
+    words = re.findall(r"[a-z0-9']+", text.lower())
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def shingle_overlap(text_a, text_b, size=SHINGLE_SIZE):
+    '''Jaccard similarity of the word shingles of two texts (0 = nothing shared, 1 = identical)'''
+    shingles_a = shingles(text_a, size)
+    shingles_b = shingles(text_b, size)
+    if not shingles_a and not shingles_b:
+        return 1.0
+    return len(shingles_a & shingles_b) / len(shingles_a | shingles_b)
+
+
+def paragraph_pair_text(title, paragraph1, paragraph2):
+    '''Return a training page as it is listed in the PROFILER prompt (one entry of paragraph_pair_list)'''
+    return f"{title} \n\nParagraph 1:\n{paragraph1}\n\nParagraph 2:\n{paragraph2}"
+
+
+def pair_count_text(paragraph_pair_list):
+    '''The number of paragraph pairs as it is written in the PROFILER prompt ("four" in the study)'''
+    num_words = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten"]
+    count = len(paragraph_pair_list)
+    return num_words[count] if count < len(num_words) else str(count)
+
+
+def paragraph_pair_table(paragraph_pair_list):
+    '''Return the paragraph pairs as the numbered table used in "compact" mode'''
+    return "\n\n".join(f"Pair {i + 1}. {pair}" for i, pair in enumerate(paragraph_pair_list))
+
+
+def profile_messages(profiler_sys_msg, profiler_user_msg, previous_profile=None, follow_up_user_msg=None):
+    '''Return the messages of one PROFILER request (see generate_profile)'''
+    messages = [{"role": "system", "content": profiler_sys_msg},
+                {"role": "user", "content": profiler_user_msg}]
+    if previous_profile is not None:
+        messages += [{"role": "assistant", "content": previous_profile},
+                     {"role": "user", "content": follow_up_user_msg}]
+    return messages
+
 
 def get_student_profile(selections, notSelections, paragraph_pair_list):
     print("\n***\nInitializing Profiler:")
-    start_time = time.time()
+    profile_span = timing.begin("profile", "gpt", mode=PROFILE_MODE)
 
     # System message for the PROFILER model
     profiler_sys_msg = ("You are an experienced science teacher who frequently works with middle school students and "
@@ -56,44 +133,126 @@ def get_student_profile(selections, notSelections, paragraph_pair_list):
 
     # The true and opposite profiles are generated in sequence to ensure that the language used in both profiles does
     # not overlap significantly. Goal is to create two distinct profiles.
-    actual_profiler_user_msg = ("The student was given the following four pairs of paragraphs: \n\n" +
+    # The study has four training pairs; adaptive training (see adaptive_training.py) shows a varying number.
+    pair_count = pair_count_text(paragraph_pair_list)
+    actual_profiler_user_msg = (f"The student was given the following {pair_count} pairs of paragraphs: \n\n" +
                                 f"{paragraph_pair_list}" +
                                 "\n\n The student chose these paragraphs in accordance with their learning style: \n\n"
                                 + choice_str)
 
-    opp_profiler_user_msg = ("Another student was given the same four pairs of paragraphs: \n\n" +
+    opp_profiler_user_msg = (f"Another student was given the same {pair_count} pairs of paragraphs: \n\n" +
                              f"{paragraph_pair_list}" +
                              "\n\nThis student chose these paragraphs in accordance with their learning style:\n\n" +
                              opp_choice_str)
 
-    print(f"Actual Profiler user message: {actual_profiler_user_msg}")
-    print(f"Opposite Profiler user message: {opp_profiler_user_msg}")
-
-    # Generate the true profile.
-    predict_profile_actual = client.chat.completions.create(model="gpt-4-1106-preview",
-                                                            messages=[{"role": "system",
-                                                                       "content": profiler_sys_msg},
-                                                                      {"role": "user",
-                                                                       "content": actual_profiler_user_msg}]
-                                                            ).choices[0].message.content
-
-    # Generate the opposite profile.
-    predict_profile_opposite = client.chat.completions.create(model="gpt-4-1106-preview",
-                                                              messages=[{"role": "system",
-                                                                         "content": profiler_sys_msg},
-                                                                        {"role": "user",
-                                                                         "content": actual_profiler_user_msg},
-                                                                        {"role": "assistant",
-                                                                         "content": predict_profile_actual},
-                                                                        {"role": "user",
-                                                                         "content": opp_profiler_user_msg}]
-                                                              ).choices[0].message.content
+    # The opposite prompt cannot refer to "the same" pairs when it is sent on its own (concurrent mode).
+    opp_profiler_standalone_msg = (f"The student was given the following {pair_count} pairs of paragraphs: \n\n" +
+                                   f"{paragraph_pair_list}" +
+                                   "\n\n The student chose these paragraphs in accordance with their learning "
+                                   "style: \n\n" + opp_choice_str)
+    inline_prompts = (profiler_sys_msg, actual_profiler_user_msg, opp_profiler_user_msg, opp_profiler_standalone_msg)
+
+    # Compact prompts list the pairs once, in the system message (see PROFILE_CONTEXT).
+    num_pairs = len(paragraph_pair_list)
+    pair_table = paragraph_pair_table(paragraph_pair_list)
+    compact_prompts = (profiler_sys_msg + f"\n\nThe students were given the following {num_pairs} pairs of "
+                                          f"paragraphs:\n\n" + pair_table,
+                       "The student chose these paragraphs in accordance with their learning style: \n\n" + choice_str,
+                       f"Another student was given the same {num_pairs} pairs of paragraphs. This student chose these "
+                       f"paragraphs in accordance with their learning style:\n\n" + opp_choice_str,
+                       "The student chose these paragraphs in accordance with their learning style: \n\n" +
+                       opp_choice_str)
+
+    context = PROFILE_CONTEXT
+    if context == "auto":
+        # The opposite profile request is the largest (its assistant turn is not known yet and is left out here).
+        largest = token_count.count_message_tokens(profile_messages(profiler_sys_msg, actual_profiler_user_msg, "",
+                                                                    opp_profiler_user_msg))
+        context = "compact" if largest > PROFILE_TOKEN_BUDGET else "inline"
+    elif context not in ("inline", "compact"):
+        raise ValueError(f"Invalid PROFILE_CONTEXT '{context}'. Must be 'inline', 'compact', or 'auto'.")
+    if PROFILE_MODE not in ("sequential", "concurrent"):
+        raise ValueError(f"Invalid PROFILE_MODE '{PROFILE_MODE}'. Must be 'sequential' or 'concurrent'.")
+    prompts = compact_prompts if context == "compact" else inline_prompts
+    sys_msg, user_msg, follow_up_msg, standalone_msg = prompts
+
+    if context == "compact":
+        print(f"Profiler paragraph pair table (compact context, sent at the end of the system message): {pair_table}")
+    print(f"Actual Profiler user message: {user_msg}")
+    print(f"Opposite Profiler user message: {follow_up_msg}")
+
+    # Prompt tokens are counted before each request is sent, along with what the same request would use inline.
+    request_tokens = []  # (tokens sent, inline tokens) for each request
+
+    def count_request(standalone=False, previous_profile=None):
+        counts = []
+        for p_sys, p_user, p_follow_up, p_standalone in (prompts, inline_prompts):
+            if counts and prompts is inline_prompts:
+                counts.append(counts[0])  # Inline context: the request is the inline request, no need to count twice.
+                break
+            counts.append(token_count.count_message_tokens(profile_messages(
+                p_sys, p_standalone if standalone else p_user, previous_profile, p_follow_up)))
+        request_tokens.append(tuple(counts))
+
+    if PROFILE_MODE == "concurrent":
+        print(f"Opposite Profiler user message (concurrent): {standalone_msg}")
+
+        # Generate the true and opposite profiles at the same time.
+        count_request()
+        count_request(standalone=True)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            actual_future = executor.submit(generate_profile, sys_msg, user_msg)
+            opposite_future = executor.submit(generate_profile, sys_msg, standalone_msg)
+            predict_profile_actual = actual_future.result()
+            predict_profile_opposite = opposite_future.result()
+
+        # Only pay for the dependent call if the two profiles are not distinct enough.
+        overlap = shingle_overlap(predict_profile_actual, predict_profile_opposite)
+        if overlap > PROFILE_OVERLAP_THRESHOLD:
+            print(f"Concurrent profiles too similar (overlap {overlap:.3f} > {PROFILE_OVERLAP_THRESHOLD}). "
+                  f"Discarded opposite profile: {predict_profile_opposite}")
+            count_request(previous_profile=predict_profile_actual)
+            predict_profile_opposite = generate_profile(sys_msg, user_msg, predict_profile_actual, follow_up_msg)
+            profile_path = "concurrent + sequential follow-up"
+        else:
+            profile_path = "concurrent"
+    else:
+        # Generate the true profile.
+        count_request()
+        predict_profile_actual = generate_profile(sys_msg, user_msg)
+
+        # Generate the opposite profile.
+        count_request(previous_profile=predict_profile_actual)
+        predict_profile_opposite = generate_profile(sys_msg, user_msg, predict_profile_actual, follow_up_msg)
+        profile_path = "sequential"
 
     # Print the profiles to the save file.
     print(f"Generated student profile (actual): {predict_profile_actual}")
     print(f"Generated student profile (opposite): {predict_profile_opposite}")
 
-    stop_time = time.time()
-    print(f"Profiler Run Time: {(stop_time - start_time):.2f} s\n***\n")
+    sent_tokens = sum(sent for sent, inline in request_tokens)
+    inline_tokens = sum(inline for sent, inline in request_tokens)
+    run_time = profile_span.end(path=profile_path, context=context, prompt_tokens=sent_tokens,
+                                inline_tokens=inline_tokens)
+    # Record the path taken so sessions can be compared (how often the follow-up call is needed vs. time saved).
+    print(f"Profile Path: {profile_path} (shingle overlap "
+          f"{shingle_overlap(predict_profile_actual, predict_profile_opposite):.3f}, "
+          f"threshold {PROFILE_OVERLAP_THRESHOLD})")
+    print(f"Profiler Prompt Tokens: {sent_tokens} in {len(request_tokens)} requests ({context} context, counted with "
+          f"{token_count.method()})")
+    if context == "compact":
+        saved = inline_tokens - sent_tokens
+        print(f"Profiler Token Savings: {saved} of {inline_tokens} inline prompt tokens "
+              f"({saved / inline_tokens:.0%}), an estimated {saved / 1000 * PREFILL_SECONDS_PER_1K_TOKENS:.2f} s")
+    print(f"Profiler Run Time: {run_time:.2f} s\n***\n")
 
     return predict_profile_actual, predict_profile_opposite
+
+
+def generate_profile(profiler_sys_msg, profiler_user_msg, previous_profile=None, follow_up_user_msg=None):
+    """Make one PROFILER call. If a previous profile is given, it is sent back as an assistant turn followed by the
+    follow-up user message (this is how the opposite profile is kept distinct from the actual profile)."""
+    messages = profile_messages(profiler_sys_msg, profiler_user_msg, previous_profile, follow_up_user_msg)
+
+    with timing.span("profile call", "gpt", follow_up=previous_profile is not None):
+        return llm_backend.chat_completion(messages)
@@ -1,47 +1,85 @@
 # Written using OpenAI API version 1.9.0
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import os
 import random
-import time
 
-# You will need to have an api_key variable from OpenAI to run this code.
-# Unless set as an environment variable (recommended), you may use client = OpenAI(api_key = ...).
-client = OpenAI()
+import llm_backend
+import timing
+import topic_catalog
+
+# Requests are sent through llm_backend.py. With the default "openai" backend, you will need to have an api_key
+# variable from OpenAI to run this code (see llm_backend.py).
+
+# The original texts (retrieved from Wikipedia, with links to the page versions used) and their generic rewrites
+# (produced previously from the original texts by GPT-4) are in the topic catalog, topics.json (see topic_catalog.py).
+
+# Every rewrite is scored locally (length, readability, and similarity to the original and generic texts; see
+# rewrite_scoring.py) and the scores are printed with it. GUI_REWRITE_GATE selects what happens next:
+# "score"      - (default, as in the study) only print the scores.
+# "regenerate" - a rewrite that is not shorter than the length limit (rewrite_scoring.MAX_WORDS words) is sent back to
+#                the REWRITE model with a request to shorten it, up to REWRITE_GATE_ATTEMPTS times, so the
+#                researcher does not have to spot it and press Refresh. If every attempt is too long, the shortest is
+#                kept. When streaming, the shortened rewrite replaces the streamed text once it arrives.
+# "off"        - do not score rewrites.
+REWRITE_GATE = os.environ.get("GUI_REWRITE_GATE", "score")
+REWRITE_GATE_ATTEMPTS = int(os.environ.get("GUI_REWRITE_GATE_ATTEMPTS", "2"))
+
+# Streaming: the GUI shows each test page as soon as its customized rewrite starts arriving, and fills the text in as it
+# is generated (see on_token below and GUI.drain_tokens). Off by default, as in the study. Set GUI_STREAMING=1 to turn
+# it on.
+STREAMING = os.environ.get("GUI_STREAMING", "0") == "1"
+
+
+def scoring():
+    '''The rewrite scoring module, imported on first use since it loads NumPy (see rewrite_scoring.py)'''
+    import rewrite_scoring
+    return rewrite_scoring
+
+
+def warm_up_scoring():
+    '''Load the scoring module and its word weights ahead of the first rewrite (see startup.py)'''
+    if REWRITE_GATE != "off":
+        scoring().reference_corpus()
+
+
+def gate_rewrite(generation, topic, messages, interaction_num, log):
+    '''Score a rewrite and, in "regenerate" mode, ask for a shorter one while it is over the length limit. Returns the
+    rewrite to use and its scores.'''
+    rewrite_scoring = scoring()
+    scores = rewrite_scoring.score(generation, topic.id)
+    attempts = [(scores["words"], generation, scores)]
+    while REWRITE_GATE == "regenerate" and not scores["within_limit"] and len(attempts) <= REWRITE_GATE_ATTEMPTS:
+        log.append(f"Rewrite attempt {len(attempts)} for GPT interaction {interaction_num} is too long "
+                   f"({scores['words']} words, limit {rewrite_scoring.MAX_WORDS}); regenerating.")
+        messages = messages + [{"role": "assistant", "content": generation},
+                               {"role": "user", "content": rewrite_scoring.length_correction(scores["words"])}]
+        with timing.span("regenerate", "gpt", interaction=interaction_num, attempt=len(attempts) + 1):
+            generation = llm_backend.chat_completion(messages=messages)
+        scores = rewrite_scoring.score(generation, topic.id)
+        attempts.append((scores["words"], generation, scores))
+    if not scores["within_limit"] and len(attempts) > 1:
+        _, generation, scores = min(attempts, key=lambda attempt: attempt[0])
+        log.append(f"Every attempt for GPT interaction {interaction_num} was too long; keeping the shortest.")
+    return generation, scores
+
+
+def choose_order():
+    '''Randomly choose whether the generic rewrite is presented first or second (see get_gpt_response)'''
+    possibilities = ['first', 'second']  # Defines the possibilities for position of original text.
+    return random.choice(possibilities)
+
 
 # Note: The GUI gives
-def get_gpt_response(student_profile, interaction_num):
-    print("\n***\nInitializing Rewrite Bot:")
-    start_time = time.time()
-
-    # These are the original texts retrieved from Wikipedia, used as input to the GUI.
-    # References for original_texts (provided as weblinks to the stable versions of the Wikipedia pages):
-    # Plate Tectonics - https://en.wikipedia.org/w/index.php?title=Plate_tectonics&oldid=1191104944
-    # Electricity - https://en.wikipedia.org/w/index.php?title=Electricity&oldid=1191110291
-    original_texts = ["Earth's lithosphere, the rigid outer shell of the planet including the crust and upper mantle, "
-                      "is fractured into seven or eight major plates (depending on how they are defined) and many "
-                      "minor plates or 'platelets'. Where the plates meet, their relative motion determines the type "
-                      "of plate boundary (or fault): convergent, divergent, or transform. Faults tend to be "
-                      "geologically active, experiencing earthquakes, volcanic activity, mountain-building, and "
-                      "oceanic trench formation.",
-                      "The movement of electric charge is known as an electric current, the intensity of which is "
-                      "usually measured in amperes. Electric current can flow through some things, electrical "
-                      "conductors, but will not flow through an electrical insulator. By historical convention, "
-                      "a positive current is defined as having the same direction of flow as any positive charge it "
-                      "contains, or to flow from the most positive part of a circuit to the most negative part. "
-                      "Current defined in this manner is called conventional current."]
-
-    # These generic rewrites were produced previously from the original_texts above by GPT-4.
-    generic_rewrites = ["The Earth's lithosphere, composed of the crust and part of the mantle, is segmented into "
-                        "seven or eight principal plates and numerous smaller ones. These plates intersect at "
-                        "boundaries where their movement relative to each other characterizes the boundary type: "
-                        "convergent, divergent, or transform. Boundaries where plates interact are often sites of "
-                        "geological activity, such as earthquakes, volcanism, the creation of mountains, and the "
-                        "development of oceanic trenches.",
-                        "Electric current refers to the flow of electric charge, typically measured in amperes. "
-                        "Certain materials, known as electrical conductors, allow the passage of electric current, "
-                        "whereas electrical insulators do not support such flow. Traditionally, positive current is "
-                        "described as moving in the same direction as any contained positive charge or from the "
-                        "positive to the negative end of a circuit. This type of current is known as conventional "
-                        "current."]
+def get_gpt_response(student_profile, interaction_num, on_token=None, choice=None, topic_id=None):
+    # topic_id: the topic to rewrite (see topic_catalog.py). By default, the study's topic for this GPT interaction.
+    # on_token: if given, the rewrite is streamed and on_token(text) is called with each new piece of the generation.
+    # choice: the presentation order ('first' or 'second', from choose_order). When streaming, the GUI must know which
+    #         textbox receives the customized rewrite before generation starts, so it decides the order beforehand.
+    # Rewrites for several topics may run at the same time (see get_gpt_responses), so the output for one rewrite is
+    # collected here and printed to the save file as a single block instead of interleaving with the others.
+    topic = topic_catalog.get_catalog().test_topic(interaction_num, topic_id)
+    log = ["\n***\nInitializing Rewrite Bot:"]
+    rewrite_span = timing.begin("rewrite", "gpt", interaction=interaction_num, streamed=on_token is not None)
 
     # System message for the REWRITE model
     rewrite_system = ("You are an experienced middle school science teacher who is capable of reworking scientific "
@@ -61,38 +99,91 @@ def get_gpt_response(student_profile, interaction_num):
                       "(i.e., do not use big words) and must remain academic in tone. Do not mention the student's "
                       "profile, simply provide your rework.")
 
-    print(f"Rewrite Bot System Message: {rewrite_system}")
+    log.append(f"Rewrite Bot System Message: {rewrite_system}")
 
     rewrite_user_msg = f"The student profile is as follows:\n[{student_profile}]\n\n"
     rewrite_user_msg += (f"Here is the paragraph you need to "
-                         f"rework for the student:\n[{original_texts[interaction_num - 1]}]")
-    print("Original wikipedia text GPT rewrote this time: " + original_texts[interaction_num - 1])
-    print("Generic GPT Rewrite text: " + generic_rewrites[interaction_num - 1])
-    print(f"Rewrite Bot User Message: {rewrite_user_msg}")
-
-    generation = client.chat.completions.create(model="gpt-4-1106-preview",
-                                                messages=[{"role": "system",
-                                                           "content": rewrite_system},
-                                                          {"role": "user",
-                                                           "content": rewrite_user_msg}]
-                                                ).choices[0].message.content
-    print(f"Rewritten Paragraph for GPT interaction {interaction_num}: {generation}")
+                         f"rework for the student:\n[{topic.original_text}]")
+    log.append(f"Rewrite topic: {topic.id} ({topic.title})")
+    log.append("Original wikipedia text GPT rewrote this time: " + topic.original_text)
+    log.append("Generic GPT Rewrite text: " + topic.generic_rewrite)
+    log.append(f"Rewrite Bot User Message: {rewrite_user_msg}")
+
+    messages = [{"role": "system", "content": rewrite_system},
+                {"role": "user", "content": rewrite_user_msg}]
+    try:
+        if on_token is None:
+            generation = llm_backend.chat_completion(messages=messages)
+        else:
+            pieces = []
+            first_piece_time = None
+            for piece in llm_backend.stream_chat_completion(messages=messages):
+                if first_piece_time is None:
+                    first_piece_time = rewrite_span.elapsed()
+                    timing.instant("first piece", "gpt", interaction=interaction_num)
+                pieces.append(piece)
+                on_token(piece)
+            generation = "".join(pieces)
+            log.append(f"Rewrite streamed for GPT interaction {interaction_num}: first piece after "
+                       f"{(first_piece_time or rewrite_span.elapsed()):.2f} s")
+        scores = None
+        if REWRITE_GATE != "off":
+            generation, scores = gate_rewrite(generation, topic, messages, interaction_num, log)
+    except Exception as e:
+        rewrite_span.end(error=str(e))
+        print("\n".join(log))
+        raise
+    log.append(f"Rewritten Paragraph for GPT interaction {interaction_num}: {generation}")
+    if scores is not None:
+        log.append(f"Rewrite Score: {scoring().describe(scores)}")
 
     # Present the original vs rewritten paragraph in a random order, but save that order so we know for data analysis.
-    possibilities = ['first', 'second']  # Defines the possibilities for position of original text.
-    choice = random.choice(possibilities)
+    if choice is None:
+        choice = choose_order()
 
     if choice == 'first':
-        paragraph1 = generic_rewrites[interaction_num - 1]
+        paragraph1 = topic.generic_rewrite
         paragraph2 = generation
         order = "Generic rewrite first, customized rewrite second."
     else:
         paragraph1 = generation
-        paragraph2 = generic_rewrites[interaction_num - 1]
+        paragraph2 = topic.generic_rewrite
         order = "Customized rewrite first, generic rewrite second."
-    print(choice + "  --->  " + order)
+    log.append(choice + "  --->  " + order)
 
-    stop_time = time.time()
-    print(f"Rewrite Run Time: {(stop_time - start_time):.2f} s\n***")
+    log.append(f"Rewrite Run Time: {rewrite_span.end():.2f} s\n***")
+    print("\n".join(log))
 
     return paragraph1, paragraph2
+
+
+def get_gpt_responses(student_profile, interaction_nums, max_workers=None, on_token=None, choices=None, topics=None):
+    """Request the rewrites for several test session topics at the same time.
+
+    Yields (interaction_num, future) pairs in the order the rewrites finish. future.result() returns the same
+    (paragraph1, paragraph2) tuple as get_gpt_response, or raises the error from that call. If on_token is given, the
+    rewrites are streamed and on_token(interaction_num, text) is called with each new piece. choices maps an
+    interaction number to its presentation order and topics maps it to its topic id (see get_gpt_response)."""
+    interaction_nums = list(interaction_nums)
+    if not interaction_nums:
+        return
+    choices = choices or {}
+    topics = topics or {}
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(interaction_nums))
+    futures = {}
+    for interaction_num in interaction_nums:
+        token_callback = None
+        if on_token is not None:
+            token_callback = lambda piece, n=interaction_num: on_token(n, piece)
+        futures[executor.submit(get_gpt_response, student_profile, interaction_num, token_callback,
+                                choices.get(interaction_num), topics.get(interaction_num))] = interaction_num
+    try:
+        for future in as_completed(futures):
+            yield futures[future], future
+    finally:
+        executor.shutdown(wait=False)
+
+
+def num_topics():
+    """Return the number of test session topics in the study (see topic_catalog.py)"""
+    return len(topic_catalog.get_catalog().test_topic_ids)
@@ -0,0 +1,24 @@
+import csv
+
+# Reader for input_paragraphs.csv with the standard csv module, so the GUI does not have to import pandas (about half a
+# second at startup) to read four rows. The file was written by pandas: each row starts with an index column that has
+# no name in the header, so rows have one more field than the header. Like pandas.read_csv, that first field is taken
+# as the row index.
+
+
+def read_paragraph_pages(path="input_paragraphs.csv"):
+    '''Return {row index: [title, paragraph 1, paragraph 2]} for the training pages in the file'''
+    pages = {}
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        columns = [header.index(name) for name in ("PageTitle", "Paragraph1", "Paragraph2")]
+        for row_num, row in enumerate(reader, start=1):
+            if not row:
+                continue
+            if len(row) == len(header) + 1:
+                index, row = int(row[0]), row[1:]  # Unnamed index column
+            else:
+                index = row_num
+            pages[index] = [row[column] for column in columns]
+    return pages
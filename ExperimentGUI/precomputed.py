@@ -0,0 +1,208 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import batch_runner
+import completion_cache
+import llm_backend
+import openai_interact_rewrite
+import request_scheduler
+import topic_catalog
+from event_log import EventLog
+
+# Precomputed profiles and rewrites. With four binary training choices there are only 16 selection patterns, so the
+# profile and test session rewrites can be generated ahead of time: N variants for every pattern and group. In
+# "precomputed" mode the GUI serves a randomly chosen variant for the participant's selections instead of calling
+# GPT-4, so the test session loads immediately and no API access is needed during the session.
+#
+# Build a table (this calls GPT-4 for every variant, see batch_runner.py for the concurrency options):
+#   python precomputed.py build --variants 5 --group both -o precomputed.bin
+# Inspect a table:
+#   python precomputed.py info precomputed.bin
+# Use it in the GUI:
+#   GUI_PRECOMPUTED=precomputed.bin python GUI.py
+#
+# File format: the magic bytes, the header length (8 bytes, little-endian), a JSON header, then one zlib-compressed
+# JSON record per variant. The header holds the provenance of the build and an index from "<selections>|<group>" (e.g.
+# "1221|Control") to the (offset, length) of each variant, so a variant is found with one dict lookup and read with
+# one seek. Records are only read when they are served.
+#
+# Refreshing the first test page serves a different variant (profile and rewrites). Refreshing a later test page
+# regenerates that page's rewrite live from the variant's profile, which needs API access.
+
+PRECOMPUTED_PATH = os.environ.get("GUI_PRECOMPUTED")  # Table to serve from in the GUI (None = precomputed mode off).
+MAGIC = b"PRECOMP1"
+
+
+class PrecomputedTableError(Exception):
+    """Raised when a precomputed table cannot be used (bad file, or built from different paragraphs)."""
+
+
+def inputs_hash(paragraph_pairs):
+    '''Hash of everything a variant was generated from (other than the selections), to detect out-of-date tables'''
+    topics = [topic_catalog.get_catalog().get(topic_id) for topic_id in topic_catalog.get_catalog().test_topic_ids]
+    inputs = {"paragraph_pairs": list(paragraph_pairs),
+              "original_texts": [topic.original_text for topic in topics],
+              "generic_rewrites": [topic.generic_rewrite for topic in topics]}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def pattern_key(selections, group):
+    return "".join(str(int(s)) for s in selections) + "|" + group
+
+
+class PrecomputedTable:
+    """Random access to the variants in a precomputed table file."""
+
+    def __init__(self, path, paragraph_pairs=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'rb')
+        try:
+            if self.file.read(len(MAGIC)) != MAGIC:
+                raise PrecomputedTableError(f"{path} is not a precomputed table.")
+            header_length, = struct.unpack("<Q", self.file.read(8))
+            self.header = json.loads(self.file.read(header_length).decode("utf-8"))
+        except (struct.error, ValueError) as e:
+            self.file.close()
+            raise PrecomputedTableError(f"{path} is not a valid precomputed table: {e}")
+        self.data_start = len(MAGIC) + 8 + header_length
+        self.index = self.header["index"]
+
+        if paragraph_pairs is not None and self.header["inputs_hash"] != inputs_hash(paragraph_pairs):
+            self.file.close()
+            raise PrecomputedTableError(f"{path} was built from different paragraphs or rewrite texts. Rebuild it.")
+
+    def has(self, selections, group):
+        return pattern_key(selections, group) in self.index
+
+    def num_variants(self, selections, group):
+        return len(self.index.get(pattern_key(selections, group), []))
+
+    def read(self, offset, length):
+        with self.lock:
+            self.file.seek(self.data_start + offset)
+            data = self.file.read(length)
+        return json.loads(zlib.decompress(data).decode("utf-8"))
+
+    def sample(self, selections, group, exclude=None, rng=random):
+        '''Return a random variant for the selections and group (None if the table has none). exclude: a variant
+        number not to serve again (e.g. on refresh), unless it is the only one.'''
+        entries = self.index.get(pattern_key(selections, group))
+        if not entries:
+            return None
+        choices = [i for i in range(len(entries)) if i != exclude] or list(range(len(entries)))
+        variant = rng.choice(choices)
+        record = self.read(*entries[variant])
+        record["variant"] = variant
+        record["num_variants"] = len(entries)
+        return record
+
+    def provenance(self):
+        return {key: self.header[key] for key in ("built", "model", "backend", "variants", "inputs_hash")}
+
+    def close(self):
+        self.file.close()
+
+
+def pack(records, output_path, paragraph_pairs, variants):
+    '''Write batch_runner records to a precomputed table file. Returns the number of records written.'''
+    index = {}
+    blobs = []
+    offset = 0
+    for record in records:
+        key = pattern_key(record["selections"], record["group"])
+        if len(index.get(key, [])) >= variants:
+            continue
+        record = {k: record[k] for k in ("id", "group", "selections", "profile", "profile_opposite", "rewrites",
+                                         "run_time")}
+        blob = zlib.compress(json.dumps(record, ensure_ascii=False).encode("utf-8"), 9)
+        index.setdefault(key, []).append([offset, len(blob)])
+        blobs.append(blob)
+        offset += len(blob)
+
+    header = {"built": time.strftime('%Y-%m-%d %H:%M:%S'), "model": llm_backend.MODEL,
+              "backend": llm_backend.BACKEND, "cache_mode": completion_cache.CACHE_MODE, "variants": variants,
+              "inputs_hash": inputs_hash(paragraph_pairs), "index": index}
+    header_data = json.dumps(header, sort_keys=True).encode("utf-8")
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_data)))
+        f.write(header_data)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, output_path)
+    return len(blobs)
+
+
+def build(output_path, variants, groups, paragraphs_path="input_paragraphs.csv", workers=batch_runner.DEFAULT_WORKERS,
+          progress=None):
+    """Generate the variants with the batch runner and pack them into a table. Generation is checkpointed in
+    <output>.staging.jsonl, so an interrupted build resumes where it stopped."""
+    paragraph_pairs = batch_runner.load_paragraph_pairs(paragraphs_path)
+    participants = [dict(p, id=f"{p['id']}-v{variant}")
+                    for p in batch_runner.pattern_participants(len(paragraph_pairs), groups)
+                    for variant in range(variants)]
+    interaction_nums = list(range(1, openai_interact_rewrite.num_topics() + 1))
+    staging_path = os.path.splitext(output_path)[0] + ".staging.jsonl"
+    succeeded, failed = batch_runner.run_batch(participants, staging_path, paragraph_pairs, interaction_nums, workers,
+                                               progress=progress)
+
+    with open(staging_path, 'r', encoding='utf-8') as f:
+        records = []
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("error") is None:
+                records.append(record)
+    return pack(records, output_path, paragraph_pairs, variants), failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect a precomputed profile/rewrite table.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Generate the variants and write the table.")
+    build_parser.add_argument("-o", "--output", default="precomputed.bin")
+    build_parser.add_argument("--variants", type=int, default=5, help="Variants per selection pattern and group.")
+    build_parser.add_argument("--group", choices=["Experimental", "Control", "both"], default="both")
+    build_parser.add_argument("--paragraphs", default="input_paragraphs.csv")
+    build_parser.add_argument("--workers", type=int, default=batch_runner.DEFAULT_WORKERS)
+    build_parser.add_argument("--max-concurrent", type=int, default=batch_runner.DEFAULT_MAX_CONCURRENT)
+    build_parser.add_argument("--requests-per-minute", type=float, default=batch_runner.DEFAULT_REQUESTS_PER_MINUTE)
+    info_parser = subparsers.add_parser("info", help="Show the provenance and contents of a table.")
+    info_parser.add_argument("table")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        table = PrecomputedTable(args.table)
+        print(json.dumps(table.provenance(), indent=2))
+        for key, entries in sorted(table.index.items()):
+            print(f"{key:>20}: {len(entries)} variants")
+        sys.exit(0)
+
+    if completion_cache.CACHE_MODE in ("cache", "offline"):
+        print(f"Warning: GUI_CACHE_MODE is '{completion_cache.CACHE_MODE}', so the variants of a pattern will be "
+              f"served from the same cached completions.")
+    request_scheduler.get_scheduler().configure(requests_per_minute=args.requests_per_minute,
+                                                max_concurrent=args.max_concurrent)
+    groups = ["Experimental", "Control"] if args.group == "both" else [args.group]
+    base = os.path.splitext(args.output)[0]
+    log = EventLog(base + ".log.jsonl", transcript_path=base + ".log.txt")
+    log.capture_stdout()
+    try:
+        written, failed = build(args.output, args.variants, groups, args.paragraphs, args.workers,
+                                progress=log.stdout)
+    finally:
+        log.close()
+    print(f"Wrote {written} variants to {args.output} ({failed} failed; rerun the same command to retry them).")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,278 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import timing
+
+# Every PROFILER and REWRITE request goes through one shared RequestScheduler (see llm_backend.py), so the limits below
+# hold across every thread and every session running in this process (the GUI, the batch runner, or the session
+# server). Cached completions are served before the scheduler is reached and do not count against the limits.
+#
+# - Deadline:   each request has REQUEST_DEADLINE seconds in total, across all of its attempts. Each attempt is given
+#               the time that is left as its timeout, and RequestDeadlineExceeded is raised once the time is up.
+# - Retries:    rate-limit (429), server (5xx), timeout, and connection errors are retried up to MAX_RETRIES times with
+#               jittered exponential backoff (a random delay between 0 and RETRY_BASE_DELAY * 2^attempt, capped at
+#               RETRY_MAX_DELAY). A Retry-After header from the server is honoured. A 429 also holds back every other
+#               request, since they share the same quota.
+# - Rate limit: a token bucket refilled at REQUESTS_PER_MINUTE (bursts of up to RATE_BURST requests), and at most
+#               MAX_CONCURRENT requests in flight.
+# - Hedging:    (optional) if an attempt is still running after HEDGE_PERCENTILE of recent request latencies, an
+#               identical request is sent and whichever finishes first is used. This trims the tail latency of the
+#               loading page at the cost of some duplicate requests. Hedging starts once HEDGE_MIN_SAMPLES latencies
+#               have been seen, and a hedge is only sent if the rate limit allows it right away.
+# All of these can be set with environment variables (GUI_REQUEST_DEADLINE, etc.) or with RequestScheduler.configure.
+REQUEST_DEADLINE = float(os.environ.get("GUI_REQUEST_DEADLINE", "120"))
+MAX_RETRIES = int(os.environ.get("GUI_MAX_RETRIES", "4"))
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 20.0
+REQUESTS_PER_MINUTE = float(os.environ.get("GUI_REQUESTS_PER_MINUTE", "120"))  # 0 = no rate limit
+RATE_BURST = int(os.environ.get("GUI_RATE_BURST", "10"))
+MAX_CONCURRENT = int(os.environ.get("GUI_MAX_CONCURRENT", "16"))
+HEDGE_PERCENTILE = float(os.environ.get("GUI_HEDGE_PERCENTILE", "0"))  # e.g. 95. 0 = no hedging
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200  # Number of recent latencies the hedging percentile is computed from.
+
+
+class RequestDeadlineExceeded(TimeoutError):
+    """Raised when a request has not succeeded within its deadline."""
+
+
+class TokenBucket:
+    """Token bucket rate limiter (thread-safe)."""
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = timing.now()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = timing.now()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        '''Take a token if one is available right now'''
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self, deadline):
+        '''Wait for a token. Returns False if none becomes available before the deadline (a timing.now() value).'''
+        if self.rate <= 0:
+            return True
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait_time = (1 - self.tokens) / self.rate
+            if timing.now() + wait_time > deadline:
+                return False
+            time.sleep(wait_time)
+
+    def drain(self, seconds):
+        '''Hold back all requests for the given time (after a rate-limit error)'''
+        if self.rate <= 0:
+            return
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class RequestScheduler:
+    """Deadlines, retries, rate limiting, and hedging for completion requests (see the notes at the top)."""
+
+    def __init__(self, deadline=REQUEST_DEADLINE, max_retries=MAX_RETRIES, requests_per_minute=REQUESTS_PER_MINUTE,
+                 burst=RATE_BURST, max_concurrent=MAX_CONCURRENT, hedge_percentile=HEDGE_PERCENTILE):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="request")
+        self.stats = {"requests": 0, "attempts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0}
+        self.configure(deadline, max_retries, requests_per_minute, burst, max_concurrent, hedge_percentile)
+
+    def configure(self, deadline=None, max_retries=None, requests_per_minute=None, burst=None, max_concurrent=None,
+                  hedge_percentile=None):
+        '''Change the limits (arguments left as None keep their current value)'''
+        with self.lock:
+            self.deadline = deadline if deadline is not None else self.deadline
+            self.max_retries = max_retries if max_retries is not None else self.max_retries
+            self.hedge_percentile = hedge_percentile if hedge_percentile is not None else self.hedge_percentile
+            if requests_per_minute is not None or burst is not None:
+                self.bucket = TokenBucket(
+                    requests_per_minute if requests_per_minute is not None else self.bucket.rate * 60,
+                    burst if burst is not None else self.bucket.capacity)
+            if max_concurrent is not None:
+                self.semaphore = threading.BoundedSemaphore(max_concurrent)
+
+    def hedge_delay(self):
+        '''Seconds after which a hedge is sent (None if hedging is off or there are too few samples)'''
+        if not self.hedge_percentile:
+            return None
+        with self.lock:
+            if len(self.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * self.hedge_percentile / 100))]
+
+    def run(self, call, deadline=None):
+        '''Run call(timeout) under the scheduler's policies and return its result'''
+        deadline = timing.now() + (self.deadline if deadline is None else deadline)
+        with self.lock:
+            self.stats["requests"] += 1
+        for attempt in range(self.max_retries + 1):
+            if not self.bucket.acquire(deadline):
+                self.fail()
+                raise RequestDeadlineExceeded("Request deadline exceeded while waiting for the rate limit.")
+            try:
+                return self.attempt(call, deadline)
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                remaining = deadline - timing.now()
+                if delay is None or attempt == self.max_retries or remaining <= 0:
+                    self.fail()
+                    if remaining <= 0 and not isinstance(e, RequestDeadlineExceeded):
+                        raise RequestDeadlineExceeded(f"Request deadline exceeded ({type(e).__name__}: {e}).") from e
+                    raise
+                delay = min(delay, remaining)
+                print(f"Request failed ({type(e).__name__}: {e}). Retrying in {delay:.1f} s "
+                      f"(attempt {attempt + 1} of {self.max_retries}).")
+                with self.lock:
+                    self.stats["retries"] += 1
+                if getattr(e, "status_code", None) == 429:
+                    self.bucket.drain(delay)
+                with timing.span("retry backoff", "scheduler", attempt=attempt + 1):
+                    time.sleep(delay)
+
+    def attempt(self, call, deadline):
+        primary = self.executor.submit(self.timed_call, call, deadline)
+        futures = [primary]
+        hedge_after = self.hedge_delay()
+        if hedge_after is not None:
+            done, _ = wait(futures, timeout=max(0.0, min(hedge_after, deadline - timing.now())))
+            if not done and deadline > timing.now() and self.bucket.try_acquire():
+                timing.instant("hedge", "scheduler", after=hedge_after)
+                with self.lock:
+                    self.stats["hedges"] += 1
+                futures.append(self.executor.submit(self.timed_call, call, deadline))
+
+        error = None
+        while futures:
+            done, _ = wait(futures, timeout=max(0.0, deadline - timing.now()), return_when=FIRST_COMPLETED)
+            if not done:
+                raise RequestDeadlineExceeded("Request deadline exceeded while waiting for a response.")
+            for future in done:
+                futures.remove(future)
+                if future.exception() is None:
+                    if future is not primary:
+                        with self.lock:
+                            self.stats["hedge_wins"] += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def timed_call(self, call, deadline):
+        with self.semaphore:
+            timeout = deadline - timing.now()
+            if timeout <= 0:
+                raise RequestDeadlineExceeded("Request deadline exceeded before the request was sent.")
+            with self.lock:
+                self.stats["attempts"] += 1
+            with timing.span("attempt", "scheduler") as span:
+                result = call(timeout)
+            with self.lock:
+                self.latencies.append(span.elapsed())
+            return result
+
+    def fail(self):
+        with self.lock:
+            self.stats["failures"] += 1
+
+    def run_stream(self, call, deadline=None):
+        '''Yield from call(timeout). Retries only happen before the first piece has been yielded (no hedging).'''
+        deadline = timing.now() + (self.deadline if deadline is None else deadline)
+        with self.lock:
+            self.stats["requests"] += 1
+        for attempt in range(self.max_retries + 1):
+            if not self.bucket.acquire(deadline):
+                self.fail()
+                raise RequestDeadlineExceeded("Request deadline exceeded while waiting for the rate limit.")
+            started = False
+            try:
+                with self.semaphore:
+                    with self.lock:
+                        self.stats["attempts"] += 1
+                    for piece in call(max(0.0, deadline - timing.now())):
+                        started = True
+                        yield piece
+                return
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                remaining = deadline - timing.now()
+                if started or delay is None or attempt == self.max_retries or remaining <= 0:
+                    self.fail()
+                    raise
+                print(f"Streamed request failed ({type(e).__name__}: {e}). Retrying in {min(delay, remaining):.1f} s "
+                      f"(attempt {attempt + 1} of {self.max_retries}).")
+                with self.lock:
+                    self.stats["retries"] += 1
+                if getattr(e, "status_code", None) == 429:
+                    self.bucket.drain(delay)
+                time.sleep(min(delay, remaining))
+
+
+def retry_delay(error, attempt):
+    '''Return the number of seconds to wait before retrying after the error, or None if it should not be retried'''
+    status = getattr(error, "status_code", None)
+    retryable = status == 429 or (status is not None and status >= 500) or isinstance(error, (ConnectionError,
+                                                                                              TimeoutError)) or \
+        type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+    if not retryable or isinstance(error, RequestDeadlineExceeded):
+        return None
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class ScheduledBackend:
+    """Sends a backend's requests (see llm_backend.py) through a RequestScheduler."""
+
+    def __init__(self, backend, scheduler):
+        self.backend = backend
+        self.scheduler = scheduler
+        self.cache_namespace = getattr(backend, "cache_namespace", None)
+
+    def chat_completion(self, model, messages, **params):
+        return self.scheduler.run(lambda timeout: self.backend.chat_completion(model, messages, timeout=timeout,
+                                                                               **params))
+
+    def stream_chat_completion(self, model, messages, **params):
+        return self.scheduler.run_stream(lambda timeout: self.backend.stream_chat_completion(model, messages,
+                                                                                             timeout=timeout,
+                                                                                             **params))
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    '''Return the scheduler shared by every request in this process'''
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
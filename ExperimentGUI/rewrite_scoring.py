@@ -0,0 +1,277 @@
+import argparse
+import csv
+import functools
+import os
+import re
+import sys
+
+import numpy as np
+
+import analytics
+import paragraph_csv
+import topic_catalog
+
+# Local scoring of the customized rewrites: length, readability, and similarity to the original text and to the
+# generic rewrite. No request is sent anywhere, so scoring a rewrite takes about a millisecond.
+#
+# Inline: every rewrite is scored as it is generated (see openai_interact_rewrite.py) and the scores are printed in the
+# transcript ("Rewrite Score: ..."). Set GUI_REWRITE_GATE to "regenerate" to have a rewrite that is not shorter than
+# MAX_WORDS words sent back to the REWRITE model with a request to shorten it.
+#
+# Bulk: score the rewrites of archived sessions (transcripts, or folders of them) and write one row per rewrite:
+#   python rewrite_scoring.py sessions/ -o rewrite_scores.csv
+#
+# Scores (one value per rewrite; a batch of rewrites is scored at once with NumPy arrays):
+#   words                  words as a reader counts them (the REWRITE system message asks for less than one hundred)
+#   sentences, grade_level, reading_ease
+#                          Flesch-Kincaid grade level and Flesch reading ease (syllables are estimated from spelling)
+#   length_ratio           words of the rewrite / words of the original text (the system message asks for about 1)
+#   similarity_original, similarity_generic
+#                          TF-IDF cosine similarity of the words (0 = no words in common, 1 = the same word counts)
+#   copied_original        fraction of the rewrite's word pairs (bigrams) that appear in the original text
+#   within_limit           words < MAX_WORDS
+# Word weights (IDF) come from a fixed reference corpus (the topic catalog texts and the training paragraphs), so a
+# rewrite gets the same scores inline and in bulk.
+
+MAX_WORDS = int(os.environ.get("GUI_REWRITE_MAX_WORDS", "100"))
+TRAINING_PARAGRAPHS = "input_paragraphs.csv"
+
+SCORE_COLUMNS = ("words", "sentences", "grade_level", "reading_ease", "length_ratio", "similarity_original",
+                 "similarity_generic", "copied_original", "within_limit")
+
+TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+SENTENCE_END = re.compile(r"[.!?]+(?=\s|$)")
+VOWEL_GROUP = re.compile(r"[aeiouy]+")
+WORD = re.compile(r"\S*[^\W_]\S*")  # Non-space characters with at least one letter or digit
+
+
+def tokens(text):
+    return TOKEN.findall(text.lower().replace("’", "'"))
+
+
+def word_count(text):
+    '''Words as a reader counts them (so "mountain-building" is one word)'''
+    return len(WORD.findall(text))
+
+
+def sentence_count(text):
+    return max(1, len(SENTENCE_END.findall(text.strip())))
+
+
+@functools.lru_cache(maxsize=None)
+def syllable_count(token):
+    '''Estimated syllables of a word: groups of vowels, not counting a silent final e'''
+    if token.isdigit():
+        return 1
+    count = len(VOWEL_GROUP.findall(token))
+    if count > 1 and token.endswith("e") and not token.endswith(("le", "ee", "ye")):
+        count -= 1
+    return max(1, count)
+
+
+@functools.lru_cache(maxsize=1)
+def reference_corpus():
+    '''(number of documents, {word: documents containing it}) of the topic catalog texts and training paragraphs'''
+    documents = []
+    catalog = topic_catalog.get_catalog()
+    for topic_id in catalog.rewritable_ids():
+        topic = catalog.get(topic_id)
+        documents += [topic.original_text, topic.generic_rewrite]
+    if os.path.exists(TRAINING_PARAGRAPHS):
+        for _, paragraph1, paragraph2 in paragraph_csv.read_paragraph_pages(TRAINING_PARAGRAPHS).values():
+            documents += [paragraph1, paragraph2]
+    document_frequency = {}
+    for document in documents:
+        for token in set(tokens(document)):
+            document_frequency[token] = document_frequency.get(token, 0) + 1
+    return len(documents), document_frequency
+
+
+class Vocabulary:
+    """Integer ids for the words (or word pairs) of a batch."""
+
+    def __init__(self):
+        self.ids = {}
+
+    def lookup(self, token_lists):
+        '''(row, id) arrays with one entry per token, where row is the index of the token's list'''
+        rows = np.repeat(np.arange(len(token_lists)), [len(token_list) for token_list in token_lists])
+        ids = np.fromiter((self.ids.setdefault(token, len(self.ids)) for token_list in token_lists
+                           for token in token_list), dtype=np.int64, count=len(rows))
+        return rows, ids
+
+
+def term_counts(rows, ids, size):
+    '''The distinct (row, id) pairs, encoded as row * size + id, and how often each occurs'''
+    return np.unique(rows * size + ids, return_counts=True)
+
+
+def cosine_similarity(a, b, weights, size, num_rows):
+    '''Row-by-row cosine similarity of two sets of weighted term counts (from term_counts)'''
+    a_keys, a_counts = a
+    b_keys, b_counts = b
+    a_weights = a_counts * weights[a_keys % size]
+    b_weights = b_counts * weights[b_keys % size]
+    _, a_shared, b_shared = np.intersect1d(a_keys, b_keys, assume_unique=True, return_indices=True)
+    dot = np.bincount(a_keys[a_shared] // size, weights=a_weights[a_shared] * b_weights[b_shared], minlength=num_rows)
+    a_norm = np.sqrt(np.bincount(a_keys // size, weights=a_weights ** 2, minlength=num_rows))
+    b_norm = np.sqrt(np.bincount(b_keys // size, weights=b_weights ** 2, minlength=num_rows))
+    norms = a_norm * b_norm
+    return np.divide(dot, norms, out=np.zeros(num_rows), where=norms > 0)
+
+
+def word_pairs(token_list):
+    return [f"{first} {second}" for first, second in zip(token_list, token_list[1:])]
+
+
+def score_batch(generations, topic_ids):
+    '''Score rewrites of the given topics. Returns {score name: array with one value per rewrite}.'''
+    catalog = topic_catalog.get_catalog()
+    num_rows = len(generations)
+    topics = {topic_id: catalog.get(topic_id) for topic_id in set(topic_ids)}
+    topic_tokens = {topic_id: (tokens(topic.original_text), tokens(topic.generic_rewrite))
+                    for topic_id, topic in topics.items()}
+
+    generation_tokens = [tokens(generation) for generation in generations]
+    original_tokens = [topic_tokens[topic_id][0] for topic_id in topic_ids]
+    generic_tokens = [topic_tokens[topic_id][1] for topic_id in topic_ids]
+
+    # Words: TF-IDF cosine similarity and readability.
+    words = Vocabulary()
+    generation_rows, generation_ids = words.lookup(generation_tokens)
+    original = words.lookup(original_tokens)
+    generic = words.lookup(generic_tokens)
+    size = max(1, len(words.ids))
+    num_documents, document_frequency = reference_corpus()
+    vocabulary = list(words.ids)
+    frequency = np.array([document_frequency.get(token, 0) for token in vocabulary], dtype=np.float64)
+    idf = np.log((1 + num_documents) / (1 + frequency)) + 1
+    generation_counts = term_counts(generation_rows, generation_ids, size)
+    similarity_original = cosine_similarity(generation_counts, term_counts(*original, size), idf, size, num_rows)
+    similarity_generic = cosine_similarity(generation_counts, term_counts(*generic, size), idf, size, num_rows)
+
+    syllables = np.array([syllable_count(token) for token in vocabulary], dtype=np.float64)
+    num_tokens = np.bincount(generation_rows, minlength=num_rows)
+    num_syllables = np.bincount(generation_rows, weights=syllables[generation_ids], minlength=num_rows)
+    sentences = np.array([sentence_count(generation) for generation in generations], dtype=np.int32)
+    words_per_sentence = num_tokens / sentences
+    syllables_per_word = num_syllables / np.maximum(num_tokens, 1)
+
+    # Word pairs: how much of the rewrite was copied from the original text.
+    pairs = Vocabulary()
+    generation_pairs = pairs.lookup([word_pairs(token_list) for token_list in generation_tokens])
+    original_pairs = pairs.lookup([word_pairs(token_list) for token_list in original_tokens])
+    size = max(1, len(pairs.ids))
+    generation_keys, _ = term_counts(*generation_pairs, size)
+    original_keys, _ = term_counts(*original_pairs, size)
+    copied = np.bincount(generation_keys[np.isin(generation_keys, original_keys)] // size, minlength=num_rows)
+    distinct_pairs = np.bincount(generation_keys // size, minlength=num_rows)
+
+    word_counts = np.array([word_count(generation) for generation in generations], dtype=np.int32)
+    original_words = {topic_id: word_count(topic.original_text) for topic_id, topic in topics.items()}
+    return {"words": word_counts,
+            "sentences": sentences,
+            "grade_level": 0.39 * words_per_sentence + 11.8 * syllables_per_word - 15.59,
+            "reading_ease": 206.835 - 1.015 * words_per_sentence - 84.6 * syllables_per_word,
+            "length_ratio": word_counts / np.array([original_words[topic_id] for topic_id in topic_ids]),
+            "similarity_original": similarity_original,
+            "similarity_generic": similarity_generic,
+            "copied_original": np.divide(copied, distinct_pairs, out=np.zeros(num_rows), where=distinct_pairs > 0),
+            "within_limit": word_counts < MAX_WORDS}
+
+
+def score(generation, topic_id):
+    '''Scores of one rewrite, as {score name: value}'''
+    return {name: values[0].item() for name, values in score_batch([generation], [topic_id]).items()}
+
+
+def describe(scores):
+    return (f"{scores['words']} words (limit {MAX_WORDS}), {scores['sentences']} sentences, grade level "
+            f"{scores['grade_level']:.1f}, reading ease {scores['reading_ease']:.0f}, length ratio "
+            f"{scores['length_ratio']:.2f}, similarity to original {scores['similarity_original']:.2f}, "
+            f"to generic rewrite {scores['similarity_generic']:.2f}, word pairs copied from original "
+            f"{scores['copied_original']:.0%}")
+
+
+def length_correction(words):
+    '''Follow-up message asking the REWRITE model to shorten a rewrite that is over the length limit'''
+    return (f"Your rework is {words} words long, but it must be less than {MAX_WORDS} words long. Rework the paragraph "
+            f"again as one short paragraph of less than {MAX_WORDS} words. Simply provide your rework.")
+
+
+# Lines of the transcript (see openai_interact_rewrite.py)
+REWRITE_TOPIC = re.compile(r"^Rewrite topic: (\S+) \(")
+REWRITTEN = re.compile(r"^Rewritten Paragraph for GPT interaction (\d+): (.*)$")
+REWRITE_ORDER = re.compile(r"^(first|second)\s+--->")
+
+
+def read_rewrites(path):
+    '''[(participant_id, interaction_num, topic_id, rewrite)] of every rewrite in a transcript'''
+    catalog = topic_catalog.get_catalog()
+    rewrites = []
+    participant_id = None
+    topic_id = None
+    current = None  # [interaction_num, topic_id, lines] of the rewrite being read
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if participant_id is None:
+                if not line.startswith("Participant ID: "):
+                    return []  # Not a session transcript
+                participant_id = line[len("Participant ID: "):]
+                continue
+            if current is not None:
+                if REWRITE_ORDER.match(line) or line.startswith("Rewrite Score: "):
+                    rewrites.append((participant_id, current[0], current[1], "\n".join(current[2]).strip()))
+                    current = None
+                else:
+                    current[2].append(line)  # A rewrite that spans several lines
+                continue
+            match = REWRITE_TOPIC.match(line)
+            if match:
+                topic_id = match.group(1)
+                continue
+            match = REWRITTEN.match(line)
+            if match:
+                interaction_num = int(match.group(1))
+                # Transcripts from before the topic catalog have no "Rewrite topic" line: use the study's topics.
+                if topic_id is None:
+                    topic_id = catalog.test_topic(interaction_num).id
+                current = [interaction_num, topic_id, [match.group(2)]]
+                topic_id = None
+    return rewrites
+
+
+def print_summary(topic_ids, scores):
+    topic_ids = np.array(topic_ids)
+    print(f"{len(topic_ids)} rewrites, {int((~scores['within_limit']).sum())} not shorter than {MAX_WORDS} words.\n")
+    print(f"{'topic':<20} {'n':>4} {'words':>6} {'max':>4} {'over':>5} {'grade':>6} {'ease':>5} {'sim orig':>9} "
+          f"{'sim gen':>8} {'copied':>7}")
+    for topic_id in np.unique(topic_ids):
+        rows = topic_ids == topic_id
+        print(f"{topic_id:<20} {rows.sum():>4} {scores['words'][rows].mean():>6.1f} {scores['words'][rows].max():>4} "
+              f"{(~scores['within_limit'][rows]).sum():>5} {scores['grade_level'][rows].mean():>6.1f} "
+              f"{scores['reading_ease'][rows].mean():>5.0f} {scores['similarity_original'][rows].mean():>9.2f} "
+              f"{scores['similarity_generic'][rows].mean():>8.2f} {scores['copied_original'][rows].mean():>7.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score the customized rewrites in session transcripts.")
+    parser.add_argument("inputs", nargs="+", help="Transcripts, directories of transcripts, or glob patterns.")
+    parser.add_argument("-o", "--output", default=None, help="Write one row per rewrite to this CSV file.")
+    args = parser.parse_args()
+
+    paths = analytics.transcript_paths(args.inputs)
+    rows = [(os.path.basename(path),) + rewrite for path in paths for rewrite in read_rewrites(path)]
+    if not rows:
+        sys.exit("No rewrites found.")
+    scores = score_batch([row[4] for row in rows], [row[3] for row in rows])
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["file", "participant_id", "interaction", "topic"] + list(SCORE_COLUMNS))
+            for i, row in enumerate(rows):
+                writer.writerow(list(row[:4]) + [round(scores[name][i].item(), 4) for name in SCORE_COLUMNS])
+        print(f"Wrote {args.output}\n")
+    print_summary([row[3] for row in rows], scores)
@@ -0,0 +1,58 @@
+import copy
+import json
+import os
+
+# Session checkpoints. The session state that cannot be recomputed (the participant's choices and page times, the
+# student profiles, and the test session rewrites) is written to the session log (see event_log.py) as "checkpoint"
+# events: at every page transition, and as soon as a profile or rewrite has been generated. Each checkpoint holds the
+# current value of the fields it names, so the state at any point is all checkpoints up to there applied in order.
+# The log is append-only and synced to disk at every page boundary, so after a crash everything up to the last
+# completed page (and every completion logged before the crash) can be recovered.
+#
+# Resume a session from its log (this reopens the same log and transcript and appends to them):
+#   python GUI.py --resume "2024-01-01 10-00-00 ID-P01.jsonl"
+# The participant returns to the page they were on, and any profile or rewrite that was already generated is reused, so
+# no GPT call is repeated. Rewrites that had not arrived yet are requested again.
+
+# Fields whose keys are page or GPT interaction numbers (JSON object keys are strings, so they are converted back).
+INT_KEYED_FIELDS = ("user_choices", "notUser_choices", "runtimes", "generated_texts", "rewrite_orders",
+                    "rewrite_generations", "topics")
+
+
+class SessionCheckpointError(Exception):
+    """Raised when a session cannot be resumed from a log (no checkpoints, or the session already ended)."""
+
+
+def snapshot(gui, fields, values=None):
+    '''The current value of the given GUI attributes (copied, since the log is written on another thread)'''
+    state = {field: getattr(gui, field) for field in fields}
+    state.update(values or {})
+    return copy.deepcopy(state)
+
+
+def load(log_path):
+    '''Return the session state from the checkpoints in a session log'''
+    state = {}
+    ended = False
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # A line cut off by the crash
+            if record.get("event") == "checkpoint":
+                state.update(record["payload"])
+            elif record.get("event") == "session_end":
+                ended = True
+    if not state:
+        raise SessionCheckpointError(f"{log_path} has no checkpoints to resume from.")
+    if ended:
+        raise SessionCheckpointError(f"The session in {log_path} has already ended.")
+
+    for field in INT_KEYED_FIELDS:
+        if field in state:
+            state[field] = {int(key): value for key, value in state[field].items()}
+    if "generated_texts" in state:
+        state["generated_texts"] = {key: tuple(value) for key, value in state["generated_texts"].items()}
+    state["session_filename"] = os.path.splitext(log_path)[0]
+    return state
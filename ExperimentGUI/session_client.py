@@ -0,0 +1,149 @@
+import json
+import os
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import openai_interact_profile
+import openai_interact_rewrite
+import timing
+
+# Where the GUI gets its profiles and rewrites. By default they are generated in this process by the PROFILER and
+# REWRITE modules. With GUI_SESSION_SERVER set to the address of a session server (see session_server.py), e.g.
+#   GUI_SESSION_SERVER=http://192.168.1.10:8770 GUI_SESSION_TOKEN=<secret> python GUI.py
+# the GUI is a thin client: every profile and rewrite is generated by the server, which is shared by all the stations
+# in the room, so they share its connection pool, completion cache, and rate limit. The functions below have the same
+# arguments and results as the local ones, and print the server's output for the job, so the transcript is unchanged.
+#
+# GUI_SESSION_TOKEN is the secret the server was started with; it is sent with every request (the server refuses
+# requests without it).
+#
+# The server does not stream. With streaming on, on_token is called once with the whole customized rewrite.
+
+SESSION_SERVER = os.environ.get("GUI_SESSION_SERVER")  # None = generate locally
+SESSION_TOKEN = os.environ.get("GUI_SESSION_TOKEN")
+POLL_WAIT = 25  # Seconds each long poll waits on the server.
+CONNECT_TIMEOUT = 10
+
+
+class SessionServerError(Exception):
+    """Raised when the session server cannot be reached or a job on it failed."""
+
+
+class SessionClient:
+    """Submits profile and rewrite jobs to a session server and waits for their results."""
+
+    def __init__(self, base_url, token=SESSION_TOKEN):
+        self.base_url = base_url.rstrip('/')
+        self.headers = {"Content-Type": "application/json"}
+        if token:
+            self.headers["X-Session-Token"] = token
+
+    def request(self, method, path, body=None, timeout=CONNECT_TIMEOUT):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method, headers=self.headers)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return json.loads(response.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read().decode("utf-8")).get("error", e.reason)
+            except ValueError:
+                message = e.reason
+            raise SessionServerError(f"Session server returned {e.code}: {message}") from e
+        except (urllib.error.URLError, OSError) as e:
+            raise SessionServerError(f"Cannot reach the session server at {self.base_url}: {e}") from e
+
+    def submit(self, kind, **request):
+        return self.request("POST", "/v1/jobs", dict(request, kind=kind))["id"]
+
+    def result(self, job_id):
+        '''Wait for a job and return its result. Prints the job's output (for the transcript).'''
+        while True:
+            job = self.request("GET", f"/v1/jobs/{job_id}?wait={POLL_WAIT}", timeout=POLL_WAIT + CONNECT_TIMEOUT)
+            if job["status"] != "running":
+                break
+        if job["log"]:
+            print(job["log"], end="")
+        if job["status"] == "failed":
+            raise SessionServerError(job["error"])
+        return job["result"]
+
+    def get_student_profile(self, selections, notSelections, paragraph_pair_list):
+        with timing.span("server profile", "gpt"):
+            result = self.result(self.submit("profile", selections=list(selections),
+                                             notSelections=list(notSelections),
+                                             paragraph_pair_list=list(paragraph_pair_list)))
+        return result["student_profile"], result["student_profile_opposite"]
+
+    def get_gpt_response(self, job_id, choice=None, on_token=None):
+        with timing.span("server rewrite", "gpt"):
+            result = self.result(job_id)
+        paragraph1, paragraph2 = result["paragraph1"], result["paragraph2"]
+        if on_token is not None:
+            on_token(paragraph2 if choice == 'first' else paragraph1)
+        return paragraph1, paragraph2
+
+    def get_gpt_responses(self, student_profile, interaction_nums, max_workers=None, on_token=None, choices=None,
+                          topics=None):
+        '''Same as openai_interact_rewrite.get_gpt_responses, with the rewrites generated by the server'''
+        interaction_nums = list(interaction_nums)
+        if not interaction_nums:
+            return
+        choices = choices or {}
+        topics = topics or {}
+        # Submit every job first so the server works on all of them at the same time, then wait for each one.
+        jobs = {}
+        for interaction_num in interaction_nums:
+            try:
+                jobs[interaction_num] = self.submit("rewrite", student_profile=student_profile,
+                                                    interaction_num=interaction_num,
+                                                    choice=choices.get(interaction_num),
+                                                    topic_id=topics.get(interaction_num))
+            except SessionServerError as e:
+                jobs[interaction_num] = e
+        executor = ThreadPoolExecutor(max_workers=max_workers or len(interaction_nums))
+        futures = {}
+        for interaction_num, job_id in jobs.items():
+            token_callback = None
+            if on_token is not None:
+                token_callback = lambda text, n=interaction_num: on_token(n, text)
+            futures[executor.submit(self.wait_rewrite, job_id, choices.get(interaction_num),
+                                    token_callback)] = interaction_num
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future
+        finally:
+            executor.shutdown(wait=False)
+
+    def wait_rewrite(self, job_id, choice, on_token):
+        if isinstance(job_id, Exception):
+            raise job_id  # The job could not be submitted.
+        return self.get_gpt_response(job_id, choice, on_token)
+
+    def status(self):
+        return self.request("GET", "/v1/status")
+
+
+_client = SessionClient(SESSION_SERVER) if SESSION_SERVER else None
+
+
+def get_student_profile(selections, notSelections, paragraph_pair_list):
+    if _client is None:
+        return openai_interact_profile.get_student_profile(selections, notSelections, paragraph_pair_list)
+    return _client.get_student_profile(selections, notSelections, paragraph_pair_list)
+
+
+def get_gpt_response(student_profile, interaction_num, on_token=None, choice=None, topic_id=None):
+    if _client is None:
+        return openai_interact_rewrite.get_gpt_response(student_profile, interaction_num, on_token, choice, topic_id)
+    return _client.wait_rewrite(_client.submit("rewrite", student_profile=student_profile,
+                                               interaction_num=interaction_num, choice=choice, topic_id=topic_id),
+                                choice, on_token)
+
+
+def get_gpt_responses(student_profile, interaction_nums, max_workers=None, on_token=None, choices=None, topics=None):
+    if _client is None:
+        return openai_interact_rewrite.get_gpt_responses(student_profile, interaction_nums, max_workers, on_token,
+                                                         choices, topics)
+    return _client.get_gpt_responses(student_profile, interaction_nums, max_workers, on_token, choices, topics)
@@ -0,0 +1,264 @@
+import argparse
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import completion_cache
+import llm_backend
+import openai_interact_profile
+import openai_interact_rewrite
+import request_scheduler
+
+# Local session server: one process that generates the profiles and rewrites for every GUI station in the room. The
+# stations run the GUI as a thin client (GUI_SESSION_SERVER=http://<server>:8770 python GUI.py, see session_client.py)
+# and this process owns everything that should be shared: one backend client (and so one pool of HTTP connections to
+# the API), the completion cache, and the request scheduler's rate limit and request budget (request_scheduler.py).
+#
+#   GUI_SESSION_TOKEN=<secret> python session_server.py --host 0.0.0.0 --port 8770 --workers 32 \
+#       --requests-per-minute 120
+#
+# The server spends the study's API quota and hands back the generated profiles, so stations must prove they belong to
+# the study: every request carries the shared secret in GUI_SESSION_TOKEN as an X-Session-Token header (set the same
+# GUI_SESSION_TOKEN on every station, see session_client.py), and requests without it are refused with 401. The server
+# only runs without a token when it listens on the loopback interface (the default, --host 127.0.0.1).
+#
+# Protocol (JSON over HTTP):
+#   POST /v1/jobs       {"kind": "profile", "selections": [...], "notSelections": [...], "paragraph_pair_list": [...]}
+#                       {"kind": "rewrite", "student_profile": "...", "interaction_num": 1, "choice": "first",
+#                        "topic_id": "plate-tectonics"}
+#                       -> {"id": "<job id>"}
+#   GET  /v1/jobs/<id>?wait=25
+#                       -> {"id", "status": "running" | "done" | "failed", "result", "error", "log"}
+#                       Waits up to `wait` seconds for the job to finish (long polling), so results are handed back as
+#                       soon as they are ready without the stations polling in a tight loop.
+#   GET  /v1/status     -> job counts and the scheduler's statistics.
+# Every request needs the X-Session-Token header if the server has a token.
+# "log" is the text the PROFILER or REWRITE module printed for the job, so the station can copy it into its own
+# transcript exactly as if it had generated the text locally.
+
+DEFAULT_PORT = 8770
+DEFAULT_WORKERS = 32
+JOB_TTL = 600  # Seconds a finished job is kept for its station to collect.
+MAX_WAIT = 60  # Longest long-poll wait, in seconds.
+TOKEN = os.environ.get("GUI_SESSION_TOKEN")  # Shared secret of the study's stations (None = no check, loopback only)
+TOKEN_HEADER = "X-Session-Token"
+LOOPBACK_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+
+class CapturingStdout:
+    """sys.stdout replacement that collects the output of the threads running a job, and passes everything else on."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is not None:
+            buffer.append(text)
+            return len(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    @contextmanager
+    def capture(self):
+        self.local.buffer = []
+        try:
+            yield self.local.buffer
+        finally:
+            self.local.buffer = None
+
+
+class Job:
+    def __init__(self, kind, request):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.request = request
+        self.status = "running"
+        self.result = None
+        self.error = None
+        self.log = ""
+        self.finished = 0.0
+        self.done = threading.Event()
+
+    def to_json(self):
+        return {"id": self.id, "kind": self.kind, "status": self.status, "result": self.result, "error": self.error,
+                "log": self.log}
+
+
+class SessionService:
+    """Runs profile and rewrite jobs for all stations on a bounded pool of workers."""
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="session-job")
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.stdout = sys.stdout if isinstance(sys.stdout, CapturingStdout) else CapturingStdout(sys.stdout)
+        sys.stdout = self.stdout
+
+    def submit(self, request):
+        if not isinstance(request, dict):
+            raise ValueError(f"The request must be a JSON object, not {type(request).__name__}.")
+        kind = request.get("kind")
+        if kind == "profile":
+            args = (list(request["selections"]), list(request["notSelections"]), list(request["paragraph_pair_list"]))
+        elif kind == "rewrite":
+            args = (request["student_profile"], int(request["interaction_num"]), None, request.get("choice"),
+                    request.get("topic_id"))
+        else:
+            raise ValueError(f"Unknown job kind {kind!r}. Must be 'profile' or 'rewrite'.")
+
+        job = Job(kind, request)
+        with self.lock:
+            self.expire_locked()
+            self.jobs[job.id] = job
+        self.executor.submit(self.run, job, args)
+        return job
+
+    def run(self, job, args):
+        with self.stdout.capture() as output:
+            try:
+                if job.kind == "profile":
+                    profile, profile_opposite = openai_interact_profile.get_student_profile(*args)
+                    job.result = {"student_profile": profile, "student_profile_opposite": profile_opposite}
+                else:
+                    paragraph1, paragraph2 = openai_interact_rewrite.get_gpt_response(*args)
+                    job.result = {"paragraph1": paragraph1, "paragraph2": paragraph2}
+                job.status = "done"
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+                job.status = "failed"
+        job.log = "".join(output)
+        job.finished = time.monotonic()
+        job.done.set()
+        self.stdout.stream.write(f"[session] {job.kind} job {job.id[:8]} {job.status}"
+                                 f"{' (' + job.error + ')' if job.error else ''}\n")
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def expire_locked(self):
+        now = time.monotonic()
+        expired = [job_id for job_id, job in self.jobs.items() if job.done.is_set() and now - job.finished > JOB_TTL]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def status(self):
+        with self.lock:
+            running = sum(1 for job in self.jobs.values() if not job.done.is_set())
+            total = len(self.jobs)
+        scheduler = request_scheduler.get_scheduler()
+        with scheduler.lock:
+            stats = dict(scheduler.stats)
+        return {"jobs_running": running, "jobs_kept": total, "scheduler": stats, "backend": llm_backend.BACKEND,
+                "cache_mode": completion_cache.CACHE_MODE}
+
+
+class SessionHandler(BaseHTTPRequestHandler):
+    service = None  # Set in serve()
+    token = None  # Set in serve()
+    protocol_version = "HTTP/1.1"
+
+    def authorized(self):
+        '''True if the request carries the server's token (sends the 401 response if not)'''
+        if self.token is None:
+            return True
+        if hmac.compare_digest(self.headers.get(TOKEN_HEADER, "").encode("utf-8"), self.token.encode("utf-8")):
+            return True
+        self.send_json(401, {"error": f"Missing or wrong {TOKEN_HEADER} (set GUI_SESSION_TOKEN on the station)."})
+        return False
+
+    def do_POST(self):
+        if not self.authorized():
+            return
+        if self.path.rstrip('/') != "/v1/jobs":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = self.service.submit(json.loads(self.rfile.read(length) or b"{}"))
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": f"Invalid request: {e}"})
+            return
+        self.send_json(202, {"id": job.id})
+
+    def do_GET(self):
+        if not self.authorized():
+            return
+        url = urlparse(self.path)
+        if url.path.rstrip('/') == "/v1/status":
+            self.send_json(200, self.service.status())
+            return
+        if not url.path.startswith("/v1/jobs/"):
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        job = self.service.get(url.path[len("/v1/jobs/"):].strip('/'))
+        if job is None:
+            self.send_json(404, {"error": "Unknown or expired job."})
+            return
+        try:
+            wait = min(MAX_WAIT, float(parse_qs(url.query).get("wait", ["0"])[0]))
+        except ValueError:
+            wait = 0
+        job.done.wait(wait)
+        self.send_json(200, job.to_json())
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Every job is already reported when it finishes (see SessionService.run).
+
+
+def serve(host="127.0.0.1", port=DEFAULT_PORT, workers=DEFAULT_WORKERS, token=TOKEN):
+    '''Create the session server (call serve_forever() on the result to start it)'''
+    if not token and host not in LOOPBACK_HOSTS:
+        raise SystemExit(f"Refusing to listen on {host} without a token: anyone on the network could spend the API "
+                         f"quota and read the generated profiles. Set GUI_SESSION_TOKEN (on the server and every "
+                         f"station).")
+    SessionHandler.service = SessionService(workers)
+    SessionHandler.token = token or None
+    server = ThreadingHTTPServer((host, port), SessionHandler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared profile/rewrite generation for several GUI stations.")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Use 0.0.0.0 to accept stations on the local network (needs GUI_SESSION_TOKEN).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Jobs run at the same time.")
+    parser.add_argument("--requests-per-minute", type=float, default=None,
+                        help="Request budget shared by all stations (default: see request_scheduler.py).")
+    parser.add_argument("--max-concurrent", type=int, default=None, help="API requests in flight at the same time.")
+    args = parser.parse_args()
+
+    request_scheduler.get_scheduler().configure(requests_per_minute=args.requests_per_minute,
+                                                max_concurrent=args.max_concurrent)
+    server = serve(args.host, args.port, args.workers)
+    print(f"Session server listening on http://{args.host}:{args.port} "
+          f"(backend {llm_backend.BACKEND}, cache mode {completion_cache.CACHE_MODE}, "
+          f"{'token required' if TOKEN else 'no token, loopback only'})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,131 @@
+import itertools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Hand-off of the session's GPT requests between the GUI (Tk main thread) and the worker threads. Every profile and
+# rewrite request of the session runs on one bounded worker executor, and its result is handed back to the main thread,
+# which is the only thread that reads or writes the GUI's session fields (student_profile, generated_texts, ...).
+#
+# Each kind of result has a slot ("profile", or ("rewrite", n) for the rewrite of GPT interaction n). Submitting a
+# request to a slot gives it a new generation id and supersedes the slot's previous request:
+# - a request that has not started yet is cancelled;
+# - a request that is already running (a GPT call cannot be interrupted) runs to the end, but its result is discarded,
+#   and the new request starts when it finishes. Each slot has at most one request running and one waiting, so pressing
+#   Refresh any number of times costs at most two GPT calls, and an older generation can never replace the one the
+#   participant asked for.
+
+# Worker threads for the session's requests. Requests beyond this wait in the executor's queue.
+GENERATION_WORKERS = int(os.environ.get("GUI_GENERATION_WORKERS", "4"))
+
+
+def slot_name(slot):
+    return slot if isinstance(slot, str) else f"{slot[0]} {slot[1]}"
+
+
+class Request:
+    """One request for a slot."""
+
+    def __init__(self, generation, function, args, on_done, on_error):
+        self.generation = generation
+        self.function = function
+        self.args = args
+        self.on_done = on_done
+        self.on_error = on_error
+        self.future = None  # Set when the request is handed to the executor (None while it waits for its slot)
+
+
+class SessionState:
+    """The requests of a session: the current request (and generation id) of each slot, and the worker executor."""
+
+    def __init__(self, deliver, max_workers=GENERATION_WORKERS):
+        # deliver(function, *args) runs function(*args) on the GUI thread (e.g. with root.after).
+        self.deliver = deliver
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="generation")
+        self.lock = threading.Lock()
+        self.generation_ids = itertools.count(1)
+        self.current = {}  # slot -> the slot's newest request, until its result is handed back
+        self.started = {}  # slot -> the slot's request on the executor (queued or running)
+
+    def submit(self, slot, function, *args, on_done=None, on_error=None):
+        '''Run function(*args) on a worker as the slot's current request, superseding the slot's previous request.
+        on_done(result) or on_error(exception) is called on the GUI thread, unless the request has been superseded by
+        then. Returns the request's generation id.'''
+        request = Request(next(self.generation_ids), function, args, on_done, on_error)
+        with self.lock:
+            previous = self.current.get(slot)
+            self.current[slot] = request
+            superseded = self.supersede_locked(slot, previous)
+            if slot not in self.started:
+                self.start_locked(slot, request)
+        if superseded:
+            print(superseded)
+        return request.generation
+
+    def cancel(self, slot):
+        '''Supersede the slot's current request without starting a new one'''
+        with self.lock:
+            superseded = self.supersede_locked(slot, self.current.pop(slot, None))
+        if superseded:
+            print(superseded)
+
+    def supersede_locked(self, slot, request):
+        # Returns a message for the transcript describing what became of the superseded request.
+        if request is None:
+            return None
+        if request.future is None:
+            return f"Dropped the waiting {slot_name(slot)} request (generation {request.generation})."
+        if request.future.cancel():
+            del self.started[slot]
+            return f"Cancelled the queued {slot_name(slot)} request (generation {request.generation})."
+        if not request.future.done():
+            return (f"The running {slot_name(slot)} request (generation {request.generation}) is superseded; its "
+                    f"result will be discarded.")
+        return None
+
+    def start_locked(self, slot, request):
+        self.started[slot] = request
+        request.future = self.executor.submit(self.run, slot, request)
+
+    def is_current(self, slot, generation):
+        with self.lock:
+            request = self.current.get(slot)
+            return request is not None and request.generation == generation
+
+    def run(self, slot, request):
+        # Runs on a worker thread. Nothing here touches the GUI: the outcome is handed to the GUI thread.
+        try:
+            if self.is_current(slot, request.generation):
+                try:
+                    result = request.function(*request.args)
+                except Exception as e:
+                    self.deliver(self.finish, slot, request, request.on_error, e)
+                else:
+                    self.deliver(self.finish, slot, request, request.on_done, result)
+        finally:
+            # Start the request that has been waiting for the slot, if any.
+            with self.lock:
+                if self.started.get(slot) is request:
+                    del self.started[slot]
+                waiting = self.current.get(slot)
+                if waiting is not None and waiting.future is None:
+                    self.start_locked(slot, waiting)
+
+    def finish(self, slot, request, callback, value):
+        # Runs on the GUI thread. The slot may have been superseded while the result was on its way.
+        with self.lock:
+            if self.current.get(slot) is not request:
+                discarded = True
+            else:
+                discarded = False
+                del self.current[slot]
+        if discarded:
+            print(f"Discarded the result of a superseded {slot_name(slot)} request (generation {request.generation}).")
+        elif callback is not None:
+            callback(value)
+
+    def shutdown(self):
+        '''Drop the waiting and queued requests and let the running ones finish in the background'''
+        with self.lock:
+            self.current.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,192 @@
+import os
+import threading
+
+import session_client
+import timing
+
+
+# The speculative pipeline starts generating the student profile and the test session rewrites while the participant
+# is still on the training session. Each job is tied to the exact selections (and paragraph pairs) it was built from.
+# When a later choice changes those selections, the job becomes stale: it does not start the rewrites if the profile is
+# still running, and any results that arrive afterwards are thrown away, so a profile can never be shown for choices
+# the participant did not make.
+#
+# A GPT call cannot be interrupted, so a stale job still finishes its profile. To bound the calls a participant who
+# keeps changing their last choice can cause, at most one job runs at a time: a job submitted while another is running
+# waits for it, replacing any job that was already waiting (one running plus one waiting at most). Once the
+# participant commits to the choices, a waiting job for them is claimed and starts at once instead of queueing behind
+# the stale job, so a claim is never slower than a fresh request.
+#
+# Speculative generation is off by default (it spends GPT calls on choices that may still change). Set GUI_SPECULATIVE=1
+# to turn it on.
+SPECULATIVE_GENERATION = os.environ.get("GUI_SPECULATIVE", "0") == "1"
+
+
+class SpeculativeJob:
+    """Profile and rewrites generated in the background for one exact set of training selections."""
+
+    def __init__(self, key, selections, notSelections, paragraph_pair_list, experiment_version,
+                 num_gpt_interactions, topics=None):
+        self.key = key
+        self.selections = list(selections)
+        self.notSelections = list(notSelections)
+        self.paragraph_pair_list = list(paragraph_pair_list)
+        self.experiment_version = experiment_version
+        self.num_gpt_interactions = num_gpt_interactions
+        self.topics = topics  # Topic id by GPT interaction number (None = the study's topics)
+
+        self.student_profile = None
+        self.student_profile_opposite = None
+        self.generated_texts = {}  # (paragraph1, paragraph2) tuples keyed by GPT interaction number.
+        self.changed = threading.Condition()  # Notified when a rewrite arrives and when the job is done.
+        self.error = None
+
+        self.stale = False
+        self.start_time = 0
+        self.profile_time = 0
+        self.stop_time = 0
+        self.profile_ready = threading.Event()
+        self.done = threading.Event()
+
+    def run(self):
+        self.start_time = timing.now()
+        job_span = timing.begin("speculative job", "gpt", selections=str(self.selections))
+        try:
+            self.student_profile, self.student_profile_opposite = session_client.get_student_profile(
+                self.selections, self.notSelections, self.paragraph_pair_list)
+            self.profile_time = timing.now()
+            self.profile_ready.set()
+
+            # Experimental group rewrites use the actual profile, the Control group uses the opposite profile.
+            if self.experiment_version == "Experimental":
+                rewrite_profile = self.student_profile
+            elif self.experiment_version == "Control":
+                rewrite_profile = self.student_profile_opposite
+            else:
+                raise ValueError("Invalid experiment version. Must be either 'Experimental' or Control'.")
+
+            # Do not spend more GPT calls on selections the participant has already changed.
+            if not self.stale:
+                for interaction_num, future in session_client.get_gpt_responses(
+                        rewrite_profile, range(1, self.num_gpt_interactions + 1), topics=self.topics):
+                    try:
+                        generated_text = future.result()
+                    except Exception as e:
+                        print(f"Speculative rewrite {interaction_num} failed for selections {self.selections}: {e}")
+                        continue
+                    if self.stale:
+                        continue
+                    with self.changed:
+                        self.generated_texts[interaction_num] = generated_text
+                        self.changed.notify_all()
+        except Exception as e:
+            self.error = e
+            print(f"Speculative generation failed for selections {self.selections}: {e}")
+        self.stop_time = timing.now()
+        job_span.end(stale=self.stale, error=str(self.error) if self.error else None)
+        self.profile_ready.set()
+        with self.changed:
+            self.done.set()
+            self.changed.notify_all()
+
+    def wait_profile(self):
+        '''Wait for the profile. Returns the job.'''
+        self.profile_ready.wait()
+        return self
+
+    def wait_rewrite(self, interaction_num):
+        '''Wait for one rewrite. Returns it, or None if the job finished without it.'''
+        with self.changed:
+            self.changed.wait_for(lambda: interaction_num in self.generated_texts or self.done.is_set())
+            return self.generated_texts.get(interaction_num)
+
+    def profile_succeeded(self):
+        return self.profile_ready.is_set() and not self.stale and self.student_profile is not None \
+            and self.error is None
+
+    def succeeded(self):
+        return (self.done.is_set() and self.profile_succeeded()
+                and len(self.generated_texts) == self.num_gpt_interactions)
+
+
+class SpeculativePipeline:
+    """Start, track, and invalidate speculative profile/rewrite jobs."""
+
+    def __init__(self, num_gpt_interactions, topics=None):
+        self.num_gpt_interactions = num_gpt_interactions
+        self.topics = topics
+        self.lock = threading.Lock()
+        self.job = None  # Only the most recent job can still be used. Older jobs are stale by definition.
+        self.running = None  # The job whose thread is running (possibly stale)
+        self.waiting = None  # The job that starts when the running one finishes
+
+    @staticmethod
+    def make_key(selections, notSelections, paragraph_pair_list, experiment_version):
+        return tuple(selections), tuple(notSelections), tuple(paragraph_pair_list), experiment_version
+
+    def submit(self, selections, notSelections, paragraph_pair_list, experiment_version):
+        """Start a job for these selections. Reuse the current job if it was built from the same inputs."""
+        key = self.make_key(selections, notSelections, paragraph_pair_list, experiment_version)
+        with self.lock:
+            if self.job is not None and self.job.key == key and self.job.error is None:
+                return self.job
+            self.invalidate_locked()
+
+            job = SpeculativeJob(key, selections, notSelections, paragraph_pair_list, experiment_version,
+                                 self.num_gpt_interactions, self.topics)
+            self.job = job
+            if self.running is not None:
+                self.waiting = job
+                print(f"Speculative generation for selections {job.selections} waits for the running job.")
+                return job
+            self.running = job
+
+        self.start(job)
+        return job
+
+    def start(self, job):
+        print(f"Speculative generation started for selections {job.selections}.")
+        threading.Thread(target=self.run, args=(job,), daemon=True).start()
+
+    def run(self, job):
+        job.run()
+        with self.lock:
+            if self.running is not job:
+                return  # A claimed job started while this one was still running (see claim)
+            job, self.waiting = self.waiting, None
+            self.running = job
+        if job is not None:
+            self.start(job)
+
+    def claim(self, selections, notSelections, paragraph_pair_list, experiment_version):
+        """Return the job built from exactly these inputs (finished or in flight), or None if there is none."""
+        key = self.make_key(selections, notSelections, paragraph_pair_list, experiment_version)
+        with self.lock:
+            job = self.job
+            if job is None or job.key != key or job.stale:
+                return None
+            if job.profile_ready.is_set() and not job.profile_succeeded():
+                return None
+            waited = job is self.waiting
+            if waited:
+                # The stale running job finishes in the background; the claimed job does not wait for it.
+                self.waiting = None
+                self.running = job
+        if waited:
+            self.start(job)
+        return job
+
+    def invalidate(self):
+        with self.lock:
+            self.invalidate_locked()
+
+    def invalidate_locked(self):
+        if self.job is not None and not self.job.stale:
+            self.job.stale = True
+            print(f"Speculative generation discarded for selections {self.job.selections} (stale).")
+        if self.waiting is not None:
+            # A waiting job never started: it is dropped without any GPT call.
+            self.waiting.profile_ready.set()
+            self.waiting.done.set()
+            self.waiting = None
+        self.job = None
@@ -0,0 +1,128 @@
+import argparse
+import json
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_backend import StandInBackend, StandInError
+
+# A small local HTTP server speaking the chat-completions protocol, backed by the deterministic StandInBackend. Point
+# the GUI at it with:
+#   python stand_in_server.py --port 8765 --latency 2.0
+#   GUI_LLM_BACKEND=http GUI_LLM_BASE_URL=http://127.0.0.1:8765/v1 python GUI.py
+# Because every request goes through the real OpenAI SDK and HTTP stack, this exercises the same connection and
+# threading paths as a live session, without credentials or network access. Streaming requests ("stream": true) are
+# answered with server-sent events, one chunk per token.
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    backend = None  # Set in serve()
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        if self.path.rstrip('/') not in ("/v1/chat/completions", "/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            model = request["model"]
+            messages = request["messages"]
+        except (ValueError, KeyError) as e:
+            self.send_json(400, {"error": {"message": f"Invalid request: {e}", "type": "invalid_request_error"}})
+            return
+
+        params = {k: v for k, v in request.items() if k not in ("model", "messages", "stream")}
+        try:
+            if request.get("stream"):
+                self.stream_completion(model, messages, params)
+                return
+            content = self.backend.chat_completion(model, messages, **params)
+        except StandInError as e:
+            error_type = "rate_limit_error" if e.status_code == 429 else "server_error"
+            self.send_json(e.status_code, {"error": {"message": str(e), "type": error_type}})
+            return
+        prompt_tokens = sum(len(message["content"].split()) for message in messages)
+        completion_tokens = len(content.split())
+        self.send_json(200, {"id": f"chatcmpl-{uuid.uuid4().hex}",
+                             "object": "chat.completion",
+                             "created": int(time.time()),
+                             "model": model,
+                             "choices": [{"index": 0,
+                                          "message": {"role": "assistant", "content": content},
+                                          "finish_reason": "stop"}],
+                             "usage": {"prompt_tokens": prompt_tokens,
+                                       "completion_tokens": completion_tokens,
+                                       "total_tokens": prompt_tokens + completion_tokens}})
+
+    def stream_completion(self, model, messages, params):
+        # Server-sent events, one chat.completion.chunk per token, terminated by [DONE] (as the OpenAI API does).
+        tokens = self.backend.stream_chat_completion(model, messages, **params)
+        first_token = next(tokens, None)  # Simulated errors are raised here, before the response has started.
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        def send_chunk(delta, finish_reason=None):
+            chunk = {"id": chunk_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send_chunk({"role": "assistant", "content": ""})
+        if first_token is not None:
+            send_chunk({"content": first_token})
+        for token in tokens:
+            send_chunk({"content": token})
+        send_chunk({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        print(f"[stand-in] {self.address_string()} {format % args}")
+
+
+def serve(host="127.0.0.1", port=8765, latency=None, jitter=None, responses=None, error_rate=None):
+    '''Create the stand-in server (call serve_forever() on the result to start it)'''
+    StandInHandler.backend = StandInBackend(latency=latency, jitter=jitter, responses=responses, error_rate=error_rate)
+    return ThreadingHTTPServer((host, port), StandInHandler)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the chat-completions API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=None, help="Mean seconds per request.")
+    parser.add_argument("--jitter", type=float, default=None, help="Latency jitter as a fraction of the mean.")
+    parser.add_argument("--responses", default=None, help="JSON file of response templates.")
+    parser.add_argument("--error-rate", type=float, default=None,
+                        help="Fraction of requests answered with a simulated 429 or 500 error.")
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses, 'r', encoding='utf-8') as f:
+            responses = json.load(f)
+
+    server = serve(args.host, args.port, args.latency, args.jitter, responses, args.error_rate)
+    print(f"Stand-in chat-completions server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,82 @@
+import os
+import threading
+from contextlib import contextmanager
+
+import timing
+
+# Startup timing and warm-up. GUI.py imports this module first and times each group of imports and setup steps with
+# startup.phase(), so every start reports where the time went before the participant ID screen appeared, e.g.
+#
+#   Startup: participant ID screen after 0.24 s (import customtkinter 0.14 s, import experiment modules 0.05 s,
+#            GUI setup 0.03 s, first draw 0.02 s)
+#
+# Anything not needed for the participant ID screen is done afterwards on a background warm-up thread, while the
+# researcher types the ID: loading the OpenAI SDK and creating its client, loading the tokenizer, and so on. Each
+# warm-up task is timed as well, and the full breakdown goes in the session log (the "session_start" event).
+# Set GUI_WARM_UP=0 to skip the warm-up (everything is then loaded on first use, as before).
+# For a per-module breakdown of the imports, run "python -X importtime GUI.py".
+
+WARM_UP = os.environ.get("GUI_WARM_UP", "1") != "0"
+
+start_time = timing.now()  # When this module was imported (just before the GUI's own imports)
+phases = []  # (name, seconds) in the order they ran
+warm_up_tasks = []  # (name, seconds, error) of the background warm-up
+warm_up_done = threading.Event()
+warm_up_started = False
+ready_time = None
+report = None
+
+
+@contextmanager
+def phase(name):
+    '''Time a startup step (e.g. a group of imports)'''
+    phase_start = timing.now()
+    try:
+        yield
+    finally:
+        phases.append((name, timing.now() - phase_start))
+
+
+def ready(name="participant ID screen"):
+    '''Record that the first screen is up and return the startup report (only the first call counts)'''
+    global ready_time, report
+    if report is None:
+        ready_time = timing.now()
+        accounted = sum(seconds for _, seconds in phases)
+        phases.append(("first draw", max(0.0, ready_time - start_time - accounted)))
+        report = f"Startup: {name} after {ready_time - start_time:.2f} s (" + \
+            ", ".join(f"{phase_name} {seconds:.2f} s" for phase_name, seconds in phases) + ")"
+    return report
+
+
+def warm_up(tasks):
+    '''Run (name, function) tasks one after another on a background thread. A failed task is reported and skipped (it
+    is tried again on first use).'''
+    global warm_up_started
+    if warm_up_started:
+        return  # Once per process
+    warm_up_started = True
+    if not WARM_UP:
+        warm_up_done.set()
+        return
+
+    def worker():
+        for name, func in tasks:
+            task_start = timing.now()
+            error = None
+            try:
+                func()
+            except Exception as e:
+                error = str(e)
+            warm_up_tasks.append((name, timing.now() - task_start, error))
+        warm_up_done.set()
+
+    threading.Thread(target=worker, daemon=True, name="warm-up").start()
+
+
+def breakdown():
+    '''The startup and warm-up times as a dict (for the session log)'''
+    return {"ready_s": round(ready_time - start_time, 4) if ready_time is not None else None,
+            "phases": {name: round(seconds, 4) for name, seconds in phases},
+            "warm_up": {name: {"s": round(seconds, 4), "error": error} for name, seconds, error in warm_up_tasks},
+            "warm_up_done": warm_up_done.is_set()}
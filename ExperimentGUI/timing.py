@@ -0,0 +1,119 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Monotonic, high-resolution timing for the GUI and the GPT calls. Durations are measured with time.perf_counter_ns,
+# which is not affected by changes to the wall clock (unlike time.time()).
+#
+# Spans are recorded in the Chrome trace event format and exported once per session, e.g.
+#   "2024-01-01 10-00-00 ID-P01.trace.json"
+# Open the file in chrome://tracing or https://ui.perfetto.dev to see, thread by thread, where the time goes: page
+# render, participant dwell, loading, the PROFILER and REWRITE calls, and network versus parse time within each call.
+# Spans that start and end on the same thread nest by time. Spans that are started on one thread and ended on another
+# (e.g. the loading page) can be put on their own named track instead.
+
+
+def now():
+    '''Monotonic time in seconds (only meaningful as a difference between two calls)'''
+    return time.perf_counter_ns() / 1e9
+
+
+class Span:
+    """One timed interval. End it with end() (or use Tracer.span as a context manager)."""
+
+    def __init__(self, tracer, name, cat, args, tid):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.tid = tid
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+
+    def end(self, **args):
+        '''Record the span (only the first call counts) and return its duration in seconds'''
+        if self.end_ns is None:
+            self.end_ns = time.perf_counter_ns()
+            self.args.update(args)
+            self.tracer.record({"name": self.name, "cat": self.cat, "ph": "X", "tid": self.tid,
+                                "ts": self.tracer.micros(self.start_ns),
+                                "dur": (self.end_ns - self.start_ns) / 1000, "args": self.args})
+        return self.elapsed()
+
+    def elapsed(self):
+        '''Seconds since the span started (or its duration, once it has ended)'''
+        return ((self.end_ns or time.perf_counter_ns()) - self.start_ns) / 1e9
+
+
+class Tracer:
+    """Collects spans and instant events from every thread and exports them as a Chrome trace."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.origin_ns = time.perf_counter_ns()
+        self.pid = os.getpid()
+        self.events = []
+        self.thread_names = {}  # tid -> name, for the thread_name metadata events
+        self.tracks = {}  # track name -> tid
+
+    def micros(self, ns):
+        return (ns - self.origin_ns) / 1000
+
+    def tid(self, track=None):
+        if track is None:
+            thread = threading.current_thread()
+            with self.lock:
+                self.thread_names.setdefault(thread.ident, thread.name)
+            return thread.ident
+        with self.lock:
+            if track not in self.tracks:
+                # Virtual tracks get small ids, so they cannot collide with real thread idents.
+                self.tracks[track] = len(self.tracks) + 1
+                self.thread_names[self.tracks[track]] = track
+            return self.tracks[track]
+
+    def record(self, event):
+        event["pid"] = self.pid
+        with self.lock:
+            self.events.append(event)
+
+    def begin(self, name, cat="gui", track=None, **args):
+        '''Start a span. track: put the span on a named track instead of the current thread's.'''
+        return Span(self, name, cat, args, self.tid(track))
+
+    @contextmanager
+    def span(self, name, cat="gui", track=None, **args):
+        span = self.begin(name, cat, track, **args)
+        try:
+            yield span
+        finally:
+            span.end()
+
+    def instant(self, name, cat="gui", track=None, **args):
+        self.record({"name": name, "cat": cat, "ph": "i", "s": "t", "tid": self.tid(track),
+                     "ts": self.micros(time.perf_counter_ns()), "args": args})
+
+    def trace(self):
+        with self.lock:
+            events = list(self.events)
+            names = dict(self.thread_names)
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                    for tid, name in names.items()]
+        return {"traceEvents": metadata + events, "displayTimeUnit": "ms"}
+
+    def export(self, path):
+        '''Write the trace as Chrome trace JSON'''
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.trace(), f)
+        os.replace(tmp_path, path)
+
+
+# One tracer is shared by the GUI and every module it calls.
+tracer = Tracer()
+begin = tracer.begin
+span = tracer.span
+instant = tracer.instant
+export = tracer.export
@@ -0,0 +1,65 @@
+import functools
+import math
+import re
+import threading
+
+import llm_backend
+
+# Local prompt token counts (no API call), for the benchmarks and for keeping prompts within budget.
+#
+# If the optional tiktoken package is installed (pip install tiktoken), counts are exact for the GPT-4 tokenizer.
+# Otherwise they are estimated: text is split the way the GPT tokenizers split it before encoding (words with their
+# leading space, runs of digits, runs of punctuation), and long words count as several tokens. On English prose the
+# estimate is usually within a few percent of the exact count, which is close enough to compare prompts with each
+# other, but use tiktoken when the exact number matters (e.g. billing).
+
+# Chat formatting overhead per message and per reply (from OpenAI's guidance for the gpt-3.5/gpt-4 chat models).
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+ESTIMATE_CHARS_PER_TOKEN = 6  # Letters per token in long words (estimate only)
+
+_ESTIMATE_PATTERN = re.compile(r"'s|'t|'re|'ve|'m|'ll|'d| ?[A-Za-z]+| ?\d{1,3}| ?[^\sA-Za-z\d]+|\s+(?!\S)|\s+")
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    '''Return the tiktoken encoding for the model (None if tiktoken is not installed)'''
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+            except ImportError:
+                _encoding = False
+            else:
+                try:
+                    _encoding = tiktoken.encoding_for_model(llm_backend.MODEL)
+                except KeyError:
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+        return _encoding or None
+
+
+def method():
+    '''How tokens are counted: "tiktoken <encoding>" or "estimate"'''
+    encoding = get_encoding()
+    return f"tiktoken {encoding.name}" if encoding is not None else "estimate"
+
+
+@functools.lru_cache(maxsize=256)  # The same long messages (system messages, paragraph pairs) are counted repeatedly.
+def count_tokens(text):
+    '''Number of tokens in the text'''
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    count = 0
+    for piece in _ESTIMATE_PATTERN.findall(text):
+        word = piece.strip()
+        count += math.ceil(len(word) / ESTIMATE_CHARS_PER_TOKEN) if word.isalpha() else 1
+    return count
+
+
+def count_message_tokens(messages):
+    '''Number of prompt tokens a list of chat messages is billed as'''
+    return sum(TOKENS_PER_MESSAGE + count_tokens(message["content"]) + count_tokens(message["role"])
+               for message in messages) + TOKENS_PER_REPLY
@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+import random
+import threading
+
+import token_count
+
+# The topic catalog (topics.json) holds everything the GUI and the REWRITE model need to know about each topic: the
+# page title, the icon, and for test session topics the original text, its generic rewrite, where the text came from,
+# and precomputed prompt token counts. It is loaded once and topics are looked up by id, so adding a topic (or a
+# dozen) is an edit to topics.json, not to the code.
+#
+# "training_topics" lists the training session topics in page order (their paragraph pairs are in
+# input_paragraphs.csv). "test_topics" is the test session used in the study, in page order. Set GUI_RANDOM_TOPICS to a
+# number to instead draw that many test topics at random for each session from every topic that has an original text
+# and a generic rewrite.
+#
+# Token counts are stored in the catalog so they are not recounted for every session. After editing a text, refresh
+# them with:
+#   python topic_catalog.py count
+# and list the topics with:
+#   python topic_catalog.py list
+
+CATALOG_PATH = os.environ.get("GUI_TOPIC_CATALOG", "topics.json")
+RANDOM_TOPICS = int(os.environ.get("GUI_RANDOM_TOPICS", "0"))  # Test topics drawn per session (0 = "test_topics")
+
+
+class TopicCatalogError(Exception):
+    """Raised when the topic catalog cannot be used (bad file, unknown topic id, or not enough test topics)."""
+
+
+class Topic:
+    """One topic of the catalog."""
+
+    def __init__(self, topic_id, record):
+        self.id = topic_id
+        self.title = record["title"]
+        self.icon = record["icon"]
+        self.source = record.get("source")
+        self.original_text = record.get("original_text")
+        self.generic_rewrite = record.get("generic_rewrite")
+        self.tokens = record.get("tokens", {})  # Prompt tokens of original_text and generic_rewrite
+
+    def can_rewrite(self):
+        '''True if the topic can be used in the test session (it has an original text and a generic rewrite)'''
+        return bool(self.original_text and self.generic_rewrite)
+
+
+class TopicCatalog:
+    """The topics of a catalog file, by id."""
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+            self.topics = {topic_id: Topic(topic_id, record) for topic_id, record in self.data["topics"].items()}
+            self.training_topic_ids = list(self.data["training_topics"])
+            self.test_topic_ids = list(self.data["test_topics"])
+        except (OSError, ValueError, KeyError) as e:
+            raise TopicCatalogError(f"{path} is not a valid topic catalog: {e}")
+        for topic_id in self.training_topic_ids + self.test_topic_ids:
+            self.get(topic_id)
+        for topic_id in self.test_topic_ids:
+            if not self.topics[topic_id].can_rewrite():
+                raise TopicCatalogError(f"Test topic '{topic_id}' in {path} needs an original_text and a "
+                                        f"generic_rewrite.")
+
+    def get(self, topic_id):
+        try:
+            return self.topics[topic_id]
+        except KeyError:
+            raise TopicCatalogError(f"Unknown topic '{topic_id}' (not in {self.path}).")
+
+    def test_topic(self, interaction_num, topic_id=None):
+        '''The topic of a test page: topic_id if given, otherwise the study's topic for that GPT interaction number'''
+        return self.get(topic_id if topic_id is not None else self.test_topic_ids[interaction_num - 1])
+
+    def rewritable_ids(self):
+        return [topic_id for topic_id, topic in self.topics.items() if topic.can_rewrite()]
+
+    def session_topics(self, count=RANDOM_TOPICS, rng=random):
+        '''Test topic ids for one session, in page order: a random draw of count topics, or "test_topics" if count is
+        0'''
+        if not count:
+            return list(self.test_topic_ids)
+        candidates = self.rewritable_ids()
+        if count > len(candidates):
+            raise TopicCatalogError(f"Cannot draw {count} test topics, {self.path} only has {len(candidates)}.")
+        return rng.sample(candidates, count)
+
+    def count_tokens(self):
+        '''Recount the prompt tokens of every text in the catalog'''
+        for topic_id, record in self.data["topics"].items():
+            tokens = {field: token_count.count_tokens(record[field])
+                      for field in ("original_text", "generic_rewrite") if record.get(field)}
+            if tokens:
+                record["tokens"] = tokens
+                self.topics[topic_id].tokens = tokens
+        self.data["token_count"] = token_count.method()
+
+    def save(self, path=None):
+        with open(path or self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    '''The catalog at CATALOG_PATH, loaded on first use'''
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = TopicCatalog(CATALOG_PATH)
+        return _catalog
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the topic catalog or refresh its token counts.")
+    parser.add_argument("command", choices=["list", "count"])
+    parser.add_argument("--catalog", default=CATALOG_PATH)
+    args = parser.parse_args()
+
+    catalog = TopicCatalog(args.catalog)
+    if args.command == "count":
+        catalog.count_tokens()
+        catalog.save()
+        print(f"Counted tokens in {args.catalog} with {token_count.method()}.")
+    else:
+        for topic_id, topic in catalog.topics.items():
+            if topic_id in catalog.training_topic_ids:
+                role = "training"
+            elif topic_id in catalog.test_topic_ids:
+                role = "test"
+            else:
+                role = "test (random only)" if topic.can_rewrite() else "unused"
+            tokens = ", ".join(f"{field} {count}" for field, count in topic.tokens.items())
+            print(f"{topic_id:<20} {role:<20} {topic.title} ({topic.icon}){'  tokens: ' + tokens if tokens else ''}")